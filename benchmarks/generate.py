@@ -0,0 +1,113 @@
+import os
+import random
+from typing import Dict, List, NamedTuple
+import yaml
+
+# the dumper isn't on any hot path of the generator itself, but writing out 100k hosts with the pure python one takes
+# longer than the benchmark does
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+ENVIRONMENTS = ('prod-aws', 'prod-se3', 'canary', 'dev')
+REGIONS = ('us-east-1', 'us-west-2', 'eu-west-1', 'ap-south-1', 'se3')
+PACKAGE_TYPES = ('binary', 'index', 'config')
+PHASES = ('pre', 'changebroker', 'partition', 'post')
+HOST_ORDER_LABEL = 'pogo.deploy.stage'
+
+# the files the benchmark reads, written out by write_inventory
+BenchmarkFiles = NamedTuple('BenchmarkFiles', (
+    ('hosts', str),
+    ('packages', str),
+    ('pipeline', str)
+))
+
+
+# a made up inventory that looks like the real thing (labels, stages, a handful of packages per host), only bigger.
+# everything comes out of a seeded random so the same scale and seed always produce exactly the same inventory, which
+# is what makes runs comparable with each other.
+def generate_hosts(host_count: int, package_names: List[str], seed: int = 0, stage_count: int = 10) -> Dict:
+    rng = random.Random(seed)
+
+    hosts = {}
+    for i in range(host_count):
+        labels = {
+            'pogo.deploy.environment': rng.choice(ENVIRONMENTS),
+            'pogo.deploy.region': rng.choice(REGIONS),
+            HOST_ORDER_LABEL: rng.randrange(stage_count),
+        }
+        # a sparse label, so the queries and indexes see a mix of common and rare postings
+        if rng.random() < 0.1:
+            labels['pogo.test.data'] = 'True'
+
+        hosts[f'host-{i:06d}'] = {
+            'labels': labels,
+            'name': f'HOST_{i:06d}',
+            'packages': rng.sample(package_names, min(len(package_names), rng.randint(3, 8)))
+        }
+
+    return hosts
+
+
+def generate_packages(package_count: int, seed: int = 0) -> Dict:
+    rng = random.Random(seed)
+    return {
+        f'property{i:04d}': {'labels': {'type': rng.choice(PACKAGE_TYPES), 'tier': rng.choice(('a', 'b'))}}
+        for i in range(package_count)
+    }
+
+
+def generate_pipeline(template_dir: str) -> Dict:
+    # a job per phase, each with the kind of selectors a real pipeline uses
+    selectors = {
+        'pre': {'host': [], 'package': []},
+        'changebroker': {'host': [], 'package': [{'key': 'type', 'operator': 'In', 'values': ['binary']}]},
+        'partition': {
+            'host': [{'key': 'pogo.deploy.environment', 'operator': 'NotIn', 'values': ['dev']}],
+            'package': [{'key': 'type', 'operator': 'In', 'values': ['binary', 'index']}]
+        },
+        'post': {'host': [{'key': 'pogo.test.data', 'operator': 'DoesNotExist'}], 'package': []},
+    }
+
+    return {
+        'phases': list(PHASES),
+        'template': os.path.join(template_dir, 'pipeline.j2'),
+        'host_order_label': HOST_ORDER_LABEL,
+        'jobs': {
+            f'job-{phase}': {
+                'phase': phase,
+                'template': os.path.join(template_dir, 'job.j2'),
+                'variables': {'action': phase},
+                'selectors': selectors[phase]
+            } for phase in PHASES
+        }
+    }
+
+
+def write_inventory(output_dir: str, host_count: int, package_count: int = None, seed: int = 0) -> BenchmarkFiles:
+    # roughly one package for every fifty hosts, with a floor so small runs still have something to select from
+    package_count = package_count or max(20, host_count // 50)
+    os.makedirs(output_dir, exist_ok=True)
+
+    packages = generate_packages(package_count, seed)
+    files = BenchmarkFiles(*(os.path.join(output_dir, f) for f in ('hosts.yml', 'packages.yml', 'pipeline.yml')))
+
+    _dump({'hosts': generate_hosts(host_count, sorted(packages), seed)}, files.hosts)
+    _dump({'packages': packages}, files.packages)
+    _dump(generate_pipeline(output_dir), files.pipeline)
+
+    with open(os.path.join(output_dir, 'pipeline.j2'), 'w') as f:
+        f.write(
+            "stages:\n{% for s in stages %}\n  - {{ s }}\n{% endfor %}\n\n{% for j in jobs %}\n{{ j }}\n{% endfor %}\n"
+        )
+
+    with open(os.path.join(output_dir, 'job.j2'), 'w') as f:
+        f.write(
+            "{{ stagename }}-{{ jobname }}-{{ hostname }}:\n  stage: {{ stagename }}\n  variables:\n"
+            "    ACTION: \"{{ vars.action }}\"\n  script:\n{% for p in packages %}\n    - deploy {{ p }}\n{% endfor %}\n"
+        )
+
+    return files
+
+
+def _dump(data: Dict, path: str):
+    with open(path, 'w') as f:
+        yaml.dump(data, f, Dumper=SafeDumper)
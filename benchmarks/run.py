@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+from benchmarks.generate import write_inventory, BenchmarkFiles
+from deploy_pipeline.inventory.loader import load_config, load_yaml_file
+from deploy_pipeline.labels.grouping import LabelGroup
+from deploy_pipeline.labels.joining import LabelJoin
+from deploy_pipeline.labels.indexing import INDEX_SET, INDEX_MODES
+from deploy_pipeline.labels.matching import query_from_string, LabelIndex
+from deploy_pipeline.labels.utils import with_data
+from deploy_pipeline.pipeline.config import validate_pipeline
+from deploy_pipeline.pipeline.output import write_chunks
+from deploy_pipeline.pipeline.pipeline import load_pipeline_from_config, Stage
+from deploy_pipeline.pipeline.plan import select_jobs, plan_stage_jobs
+from deploy_pipeline.pipeline.render import render_stage_jobs
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+from deploy_pipeline.vars.scopes import variable_scope, resolve_scope
+
+STAGES = ('parse', 'validate', 'index', 'match', 'join', 'group', 'render', 'write')
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+DEFAULT_TOLERANCE = 1.25
+
+# anything quicker than this is mostly noise, it isn't flagged no matter how much slower it got
+MIN_SECONDS = 0.01
+
+
+# runs the same steps deploy_pipeline does, one stage at a time, so each of them can be measured on its own.  the time
+# of each stage is the best of the repeats, the memory is the peak allocated while the stage ran (tracemalloc slows
+# everything down a lot, so that is a separate pass that isn't timed).
+def run_benchmark(files: BenchmarkFiles, output_path: str, repeat: int = 1, index_mode: str = INDEX_SET) -> Dict:
+    results = {stage: {'seconds': None, 'peak_bytes': None} for stage in STAGES}
+
+    for _ in range(repeat):
+        for stage, seconds in _run_stages(files, output_path, index_mode, trace_memory=False).items():
+            if results[stage]['seconds'] is None or seconds < results[stage]['seconds']:
+                results[stage]['seconds'] = seconds
+
+    for stage, peak_bytes in _run_stages(files, output_path, index_mode, trace_memory=True).items():
+        results[stage]['peak_bytes'] = peak_bytes
+
+    return results
+
+
+def compare_results(results: Dict, baseline: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    # anything that got more than tolerance times slower (or bigger) than the baseline is a regression, only the scales
+    # and stages present in both are compared
+    regressions = []
+    for scale, stages in results.get('scales', {}).items():
+        for stage, measured in stages.items():
+            expected = baseline.get('scales', {}).get(scale, {}).get(stage)
+            if not expected:
+                continue
+
+            if measured['seconds'] > max(expected['seconds'] * tolerance, MIN_SECONDS):
+                regressions.append(
+                    f"{scale} hosts, {stage}: {measured['seconds']:.3f}s (baseline {expected['seconds']:.3f}s)"
+                )
+
+            if expected.get('peak_bytes') and measured['peak_bytes'] > expected['peak_bytes'] * tolerance:
+                regressions.append(
+                    f"{scale} hosts, {stage}: {measured['peak_bytes']} bytes (baseline {expected['peak_bytes']} bytes)"
+                )
+
+    return regressions
+
+
+@contextmanager
+def _measure(measurements: Dict, stage: str, trace_memory: bool):
+    if trace_memory:
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        yield
+        measurements[stage] = tracemalloc.get_traced_memory()[1] - start
+    else:
+        start = time.perf_counter()
+        yield
+        measurements[stage] = time.perf_counter() - start
+
+
+def _run_stages(files: BenchmarkFiles, output_path: str, index_mode: str, trace_memory: bool) -> Dict[str, float]:
+    measurements = {}
+    if trace_memory:
+        tracemalloc.start()
+
+    try:
+        with _measure(measurements, 'parse', trace_memory):
+            config = load_config([files.hosts, files.packages])
+            pipeline_yaml = load_yaml_file(files.pipeline)
+
+        with _measure(measurements, 'validate', trace_memory):
+            pipeline_config = validate_pipeline(pipeline_yaml)
+            pipeline = load_pipeline_from_config(pipeline_config)
+
+        with _measure(measurements, 'index', trace_memory):
+            host_index = LabelIndex(config['hosts'], 'labels', index_mode)
+            package_index = LabelIndex(config['packages'], 'labels', index_mode)
+            # the posting lists are built lazily, make sure that happens here rather than in the first query
+            _ = host_index.postings, package_index.postings
+
+        with _measure(measurements, 'match', trace_memory):
+            matched_hosts = with_data(
+                host_index.match().add_query(query_from_string(pipeline_config['host_order_label'])).do(),
+                config['hosts']
+            )
+            matched_packages = package_index.match().do()
+
+        with _measure(measurements, 'join', trace_memory):
+            host_packages = LabelJoin(matched_hosts, 'packages').match(matched_packages)
+
+        with _measure(measurements, 'group', trace_memory):
+            host_order = LabelGroup(
+                with_data(host_packages.keys(), config['hosts']), 'labels', host_index
+            ).group(pipeline_config['host_order_label'])
+
+        with _measure(measurements, 'render', trace_memory):
+            rendered_pipeline = _render(pipeline, pipeline_config, host_index, package_index, host_packages, host_order)
+
+        with _measure(measurements, 'write', trace_memory):
+            write_chunks([rendered_pipeline], output_path)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return measurements
+
+
+def _render(pipeline, pipeline_config: Dict, host_index: LabelIndex, package_index: LabelIndex,
+            host_packages: Dict, host_order: Dict) -> str:
+    templates = TemplateRegistry().load_templates(
+        [pipeline_config['template']] + [job_v['template'] for job_v in pipeline_config['jobs'].values()]
+    )
+    variables = variable_scope()
+
+    job_stages = Stage(pipeline, host_order.keys())
+    job_selections = select_jobs(
+        pipeline.get_jobs(), host_index, package_index, host_index.restrict(host_packages.keys()),
+        package_index.restrict({p for pg in host_packages.values() for p in pg})
+    )
+    stage_job_plans = plan_stage_jobs(job_stages.get_stage_jobs(), job_selections, host_order, host_packages)
+
+    return templates.get_template(pipeline.template).render({
+        'stages': list(job_stages.get_stages()),
+        'includes': pipeline_config['includes'],
+        'jobs': [
+            rendered_job for result in render_stage_jobs(stage_job_plans, templates, variables)
+            for _, _, rendered_job in result.rendered
+        ],
+        'vars': resolve_scope(variables),
+    }).strip()
+
+
+def main(argv: Iterable[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='benchmark each stage of deploy-pipeline against a synthetic inventory')
+
+    parser.add_argument('--hosts', metavar='<host count>', type=int, nargs='+', default=list(DEFAULT_SCALES),
+                        help='the inventory sizes to benchmark')
+
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic inventory')
+
+    parser.add_argument('--repeat', type=int, default=1, help='number of timed runs per scale, the best one is kept')
+
+    parser.add_argument('--index-mode', choices=INDEX_MODES, default=INDEX_SET, help='label index representation')
+
+    parser.add_argument('--work-dir', metavar='<path to dir>',
+                        help='where the synthetic inventory is written (a temp dir if not provided)')
+
+    parser.add_argument('--output', metavar='<path to results>.json', help='write the results to a json file')
+
+    parser.add_argument('--baseline', metavar='<path to results>.json',
+                        help='results of a previous run, anything that regressed past the tolerance fails the run')
+
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='how many times slower (or bigger) than the baseline counts as a regression')
+
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'index_mode': args.index_mode,
+        'scales': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        for host_count in args.hosts:
+            scale_dir = os.path.join(work_dir, str(host_count))
+            files = write_inventory(scale_dir, host_count, seed=args.seed)
+
+            scale_results = run_benchmark(
+                files, os.path.join(scale_dir, 'output.yml'), args.repeat, args.index_mode
+            )
+            results['scales'][str(host_count)] = scale_results
+
+            for stage, measured in scale_results.items():
+                print(f"{host_count:>8} hosts  {stage:<10} {measured['seconds']:>9.4f}s "
+                      f"{measured['peak_bytes'] / (1 << 20):>9.1f}MiB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+
+        return 1 if regressions else 0
+
+    return 0
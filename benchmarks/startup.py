@@ -0,0 +1,111 @@
+import argparse
+import subprocess
+import sys
+from typing import Iterable, List, NamedTuple
+
+# the cli entrypoint, run the way the console script runs it
+ENTRYPOINT = 'import sys; from deploy_pipeline.main import main; sys.argv[0] = "deploy-pipeline"; main()'
+
+# cumulative import time of deploy_pipeline.main for a --help, in milliseconds.  importing everything up front came in
+# around 140ms, deferring the heavy imports brought that down to around 50ms (same machine).  the budget leaves room for
+# a slower machine while still catching the eager imports creeping back in.
+DEFAULT_BUDGET_MS = 100
+
+# none of these have any business being imported just to print the help
+DEFERRED_MODULES = (
+    'yaml',
+    'jinja2',
+    'multiprocessing',
+    'concurrent.futures',
+    'deploy_pipeline.inventory.loader',
+    'deploy_pipeline.labels.matching',
+    'deploy_pipeline.pipeline.render',
+    'deploy_pipeline.pipeline.templates',
+)
+
+# a module as reported by python -X importtime, times are in microseconds
+ImportTime = NamedTuple('ImportTime', (
+    ('name', str),
+    ('self_us', int),
+    ('cumulative_us', int),
+    ('depth', int)
+))
+
+
+def measure_startup(args: Iterable[str] = ('--help',), repeat: int = 5) -> List[ImportTime]:
+    # the best of the repeats for each module, the first run usually pays for a cold disk cache
+    best = {}
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', ENTRYPOINT, *args],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True
+        )
+
+        for import_time in parse_importtime(process.stderr):
+            if import_time.name not in best or import_time.cumulative_us < best[import_time.name].cumulative_us:
+                best[import_time.name] = import_time
+
+    return list(best.values())
+
+
+def parse_importtime(output: str) -> List[ImportTime]:
+    # import time:       self [us] |     cumulative | imported package
+    # import time:       5603 |      57505 | deploy_pipeline.main
+    import_times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue
+
+        import_times.append(ImportTime(
+            name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip()) - 1) // 2
+        ))
+
+    return import_times
+
+
+def check_budget(import_times: List[ImportTime], budget_ms: float = DEFAULT_BUDGET_MS) -> List[str]:
+    imported = {import_time.name: import_time for import_time in import_times}
+
+    problems = [f'{name} imported at startup' for name in DEFERRED_MODULES if name in imported]
+
+    main_import = imported.get('deploy_pipeline.main')
+    if main_import and main_import.cumulative_us > budget_ms * 1000:
+        problems.append(
+            f'deploy_pipeline.main took {main_import.cumulative_us / 1000:.1f}ms to import (budget {budget_ms}ms)'
+        )
+
+    return problems
+
+
+def main(argv: Iterable[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='measure the import time of deploy-pipeline with python -X importtime')
+
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs, the quickest one is kept')
+
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='fail if importing deploy_pipeline.main takes longer than this')
+
+    parser.add_argument('--top', type=int, default=15, help='number of the slowest imports to list')
+
+    parser.add_argument('args', nargs='*', default=['--help'],
+                        help='arguments to run deploy-pipeline with (--help by default), put them after a --')
+
+    args = parser.parse_args(argv)
+
+    import_times = measure_startup(args.args, args.repeat)
+    for import_time in sorted(import_times, key=lambda i: i.cumulative_us, reverse=True)[:args.top]:
+        print(f'{import_time.cumulative_us / 1000:>9.1f}ms {import_time.self_us / 1000:>9.1f}ms  {import_time.name}')
+
+    problems = check_budget(import_times, args.budget_ms)
+    for problem in problems:
+        print(f'Over Budget: {problem}', file=sys.stderr)
+
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import time
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, Mapping, Set, Tuple, Union
+from deploy_pipeline.labels.indexing import BitsetIndex
+from deploy_pipeline.labels.matching import build_label_index, INDEX_SET
+import deploy_pipeline.metrics.metrics as metrics
+
+# bump this whenever the layout of the cached objects changes, old entries are then simply never looked up again
+CACHE_VERSION = 1
+
+# every edit of an inventory file or template leaves entries behind that nothing will look up again.  the cache dir is
+# pruned of the entries that haven't been used in MAX_AGE seconds, and then of the least recently used ones past
+# MAX_ENTRIES.  that happens the first time a run stores anything, at most once every _TOUCH_AGE seconds across all of
+# the runs (and service requests) sharing the cache dir.
+MAX_ENTRIES = 10000
+MAX_AGE = 30 * 24 * 60 * 60
+
+# an entry read back is only marked as used again once it is this old, no point touching it on every single hit
+_TOUCH_AGE = 60 * 60
+
+# the modified time of this file is when the cache dir was last pruned
+_PRUNED_MARKER = '.pruned'
+
+_ENTRY_PATTERN = re.compile(r'^[a-z]+-v(\d+)-')
+
+
+# a cache of parsed inventory files and the label indexes built from them.  entries are keyed by a digest of the file
+# content so an edited file is always re-parsed, the mtime+size of each file is remembered as well so an unchanged
+# file doesn't even need to be read to find its digest.
+#
+# everything is stored as a pickle, which is about as compact and fast to read back as it gets without pulling in
+# another dependency.  keep in mind that means the cache dir needs to be trusted just like the code is.
+#
+# the same cache dir is used for the rendered pipeline fragments (see pipeline/fragments.py), which go through get/put
+# and the text entries.
+class InventoryCache:
+    max_entries: int
+    max_age: float
+
+    _cache_dir: str
+    _digests: Dict[str, str]
+    _pruned: bool
+
+    def __init__(self, cache_dir: str, max_entries: int = MAX_ENTRIES, max_age: float = MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+        self._cache_dir = cache_dir
+        self._digests = {}
+        self._pruned = False
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def digest(self, path: str) -> str:
+        real_path = os.path.realpath(path)
+        if real_path in self._digests:
+            return self._digests[real_path]
+
+        # fast path, if the file hasn't been touched since we last hashed it there is no need to read it again
+        stat = os.stat(real_path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        stat_path = self._entry_path('stat', hashlib.sha256(real_path.encode('utf-8')).hexdigest())
+
+        stat_entry = self._read(stat_path)
+        if stat_entry and stat_entry[0] == stat_key:
+            digest = stat_entry[1]
+        else:
+            digest = _file_digest(real_path)
+            self._write(stat_path, (stat_key, digest))
+
+        self._digests[real_path] = digest
+        return digest
+
+    def load(self, path: str, loader: Callable[[str], Any]) -> Any:
+        entry_path = self._entry_path('data', self.digest(path))
+
+        data = self._read(entry_path)
+        if data is None:
+            data = loader(path)
+            self._write(entry_path, data)
+
+        return data
+
+    def label_index(self, paths: Iterable[str], source_name: str, source: Mapping, sub_key: str = None,
+                    index_mode: str = INDEX_SET) -> Union[Dict[Tuple, Set], BitsetIndex]:
+        # the source is the result of merging every one of the paths (in order), so the index is keyed by the digests
+        # of all of them along with the part of the merged config it was built from
+        index_key = hashlib.sha256(repr((
+            [self.digest(path) for path in paths], source_name, sub_key, index_mode
+        )).encode('utf-8')).hexdigest()
+        entry_path = self._entry_path('index', index_key)
+
+        label_index = self._read(entry_path)
+        metrics.count('inventory_cache.index_misses' if label_index is None else 'inventory_cache.index_hits')
+        if label_index is None:
+            with metrics.span('label_index.build'):
+                label_index = build_label_index(source, sub_key, index_mode)
+
+            self._write(entry_path, label_index)
+
+        return label_index
+
+    def get(self, entry_type: str, key: str) -> Union[Any, None]:
+        return self._read(self._entry_path(entry_type, key))
+
+    def put(self, entry_type: str, key: str, data: Any):
+        self._write(self._entry_path(entry_type, key), data)
+
+    def read_text(self, entry_type: str, key: str) -> Union[Iterator[str], None]:
+        # text entries are read back in blocks, they can be as big as the whole rendered pipeline
+        entry_path = self._entry_path(entry_type, key, '.txt')
+        try:
+            f = open(entry_path)
+        except FileNotFoundError:
+            return None
+
+        self._touch(entry_path, f)
+
+        def read_blocks():
+            with f:
+                yield from iter(lambda: f.read(1 << 20), '')
+
+        return read_blocks()
+
+    def write_text(self, entry_type: str, key: str, chunks: Iterable[str]) -> Iterator[str]:
+        # passes the chunks through untouched while writing them to the entry, the entry only shows up once every
+        # chunk has made it through.  if the consumer bails out part way the partial entry is thrown away.
+        self._prune()
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+
+            os.replace(tmp_path, self._entry_path(entry_type, key, '.txt'))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _entry_path(self, entry_type: str, key: str, suffix: str = '.pickle') -> str:
+        return os.path.join(self._cache_dir, f'{entry_type}-v{CACHE_VERSION}-{key}{suffix}')
+
+    def _read(self, entry_path: str) -> Union[Any, None]:
+        try:
+            with open(entry_path, 'rb') as f:
+                self._touch(entry_path, f)
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            # a truncated or corrupt entry is just a miss, it'll be overwritten with a good one
+            return None
+
+    def _write(self, entry_path: str, data: Any):
+        # concurrent runs may share the cache dir, write to a temp file and swap it in so readers never see a
+        # partially written entry
+        self._prune()
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _touch(self, entry_path: str, f: IO):
+        # the modified time of an entry doubles as the last time it was used, which is what the pruning goes by
+        now = time.time()
+        if now - os.fstat(f.fileno()).st_mtime > _TOUCH_AGE:
+            try:
+                os.utime(entry_path, (now, now))
+            except OSError:
+                pass
+
+    def _prune(self):
+        if self._pruned:
+            return
+
+        self._pruned = True
+
+        marker_path = os.path.join(self._cache_dir, _PRUNED_MARKER)
+        now = time.time()
+        try:
+            if now - os.stat(marker_path).st_mtime < _TOUCH_AGE:
+                return
+        except FileNotFoundError:
+            pass
+
+        with open(marker_path, 'a'):
+            os.utime(marker_path, (now, now))
+
+        # entries written by another version of the cache, temp files left behind by a run that didn't get to clean
+        # up after itself (only old ones, another run may still be writing) and anything unused for too long go.  the
+        # rest are kept most recently used first up to the limit.
+        entries = []
+        pruned = 0
+        for name in os.listdir(self._cache_dir):
+            path = os.path.join(self._cache_dir, name)
+            try:
+                used = os.stat(path).st_mtime
+            except OSError:
+                continue
+
+            match = _ENTRY_PATTERN.match(name)
+            if name.endswith('.tmp'):
+                stale = now - used > _TOUCH_AGE
+            elif match:
+                stale = int(match.group(1)) != CACHE_VERSION or now - used > self.max_age
+            else:
+                continue
+
+            if stale:
+                pruned += _remove(path)
+            elif not name.endswith('.tmp'):
+                entries.append((used, path))
+
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            pruned += _remove(path)
+
+        metrics.count('inventory_cache.pruned', pruned)
+
+
+def _remove(path: str) -> int:
+    # another run sharing the cache dir may have beaten us to it
+    try:
+        os.unlink(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
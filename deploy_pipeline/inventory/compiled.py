@@ -0,0 +1,507 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from deploy_pipeline.inventory.loader import expand_config_paths, load_config, InventoryException
+from deploy_pipeline.labels.indexing import BitsetIndex, SPARSE_RATIO, INDEX_SET, INDEX_BITSET, iter_ids
+from deploy_pipeline.pipeline.output import atomic_open
+
+# a compiled inventory starts with the magic, the format version and the size of the table of contents (json, it only
+# describes where the arrays are).  the arrays follow, each one starting on an 8 byte boundary.
+MAGIC = b'DPINV\x00'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<6sHQ')
+
+# the parts of the inventory that are compiled, the rest of the config isn't used by the pipeline
+SECTIONS = ('hosts', 'packages')
+
+# the value code of the (<label>) postings, i.e. the ones exists/doesnotexist look at
+NO_VALUE = 0xFFFFFFFF
+
+# how each symbol is typed, the labels are compared by value (0 and '0' are different labels) so the type is kept
+_TYPE_STR, _TYPE_INT, _TYPE_FLOAT, _TYPE_BOOL, _TYPE_NONE = range(5)
+
+# posting list kinds, the same split as the bitset index: a bitmap unless an array of ids is smaller
+_POSTING_IDS, _POSTING_BITMAP = range(2)
+
+
+# with a big enough fleet the parsed inventory is millions of small dicts, lists and strings, and building them is most
+# of the load time (and memory) no matter how fast the yaml parser is.  compiling the inventory lays it out in columns
+# instead, in a file that is mapped into memory rather than read:
+#
+# - every label key, label value and package a host references is a symbol, stored once in the symbol table and
+#   referred to everywhere else by its code
+# - each section (hosts, packages) has a table of its row names, the labels of every row as two arrays of key and value
+#   codes with an offsets array marking where each row starts, and the same offset/value arrays for the packages
+# - the posting lists of the label index come precompiled, as arrays of row ids or bitmaps over the row ids
+#
+# opening one only reads the table of contents.  the label indexes are built straight from the posting lists (the set
+# of index keys is all that is decoded up front), row names are decoded as they are needed, and the rows themselves
+# are only ever looked at through a lazy view when a host's packages are joined.  nothing is ever decoded into a dict
+# per host.
+def compile_inventory(config: Dict, output_path: str) -> int:
+    symbols = _SymbolEncoder()
+    arrays = []
+
+    for section_name in SECTIONS:
+        section = config.get(section_name) or {}
+        arrays.extend(_compile_section(section_name, section, symbols))
+
+    arrays.extend(_string_table('symbols', symbols.symbols))
+
+    # the arrays are laid out back to back, every one on an 8 byte boundary so they can be cast in place
+    contents = {'version': FORMAT_VERSION, 'byteorder': sys.byteorder, 'arrays': {}}
+    offset = 0
+    for name, typecode, data in arrays:
+        contents['arrays'][name] = [offset, typecode, len(data)]
+        offset += _aligned(len(data) * data.itemsize)
+
+    encoded_contents = json.dumps(contents, separators=(',', ':')).encode('utf-8')
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(encoded_contents)) + encoded_contents
+    header += b'\x00' * (_aligned(len(header)) - len(header))
+
+    # written to a temp file and swapped in, anything that has the previous file mapped (i.e. the service) keeps
+    # reading the previous file rather than having it change underneath it
+    with atomic_open(output_path, 'wb') as f:
+        f.write(header)
+        for _, _, data in arrays:
+            encoded = data.tobytes()
+            f.write(encoded)
+            f.write(b'\x00' * (_aligned(len(encoded)) - len(encoded)))
+
+        written = f.tell()
+
+    return written
+
+
+def is_compiled_inventory(path: str) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IsADirectoryError, FileNotFoundError):
+        return False
+
+
+def open_inventory(path: str) -> "CompiledInventory":
+    return CompiledInventory(path)
+
+
+class CompiledInventory:
+    path: str
+    symbols: "_StringTable"
+    hosts: "CompiledSection"
+    packages: "CompiledSection"
+
+    _arrays: Dict[str, memoryview]
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            # an empty file can't be mapped, it isn't a compiled inventory either way
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+        if len(buffer) < _HEADER.size:
+            raise CompiledInventoryException(f"Not a Compiled Inventory: {path}")
+
+        magic, version, contents_size = _HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise CompiledInventoryException(f"Not a Compiled Inventory: {path}")
+
+        if version != FORMAT_VERSION:
+            raise CompiledInventoryException(
+                f"Compiled Inventory Format {version} is Not Supported (Expected {FORMAT_VERSION}), Compile It Again: "
+                f"{path}"
+            )
+
+        contents = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + contents_size]).decode('utf-8'))
+
+        # the arrays are cast in place, which means they are in the byte order of the machine that compiled them
+        if contents['byteorder'] != sys.byteorder:
+            raise CompiledInventoryException(f"Compiled Inventory Has a Different Byte Order, Compile It Again: {path}")
+
+        view = memoryview(buffer)
+        data_start = _aligned(_HEADER.size + contents_size)
+        self._arrays = {}
+        for name, (offset, typecode, length) in contents['arrays'].items():
+            start = data_start + offset
+            self._arrays[name] = view[start:start + length * array(typecode).itemsize].cast(typecode)
+
+        self.symbols = self.strings('symbols')
+        self.hosts = CompiledSection(self, 'hosts')
+        self.packages = CompiledSection(self, 'packages')
+
+    def array(self, name: str) -> Union[memoryview, None]:
+        return self._arrays.get(name)
+
+    def strings(self, name: str) -> "_StringTable":
+        return _StringTable(self.array(f'{name}.offsets'), self.array(f'{name}.types'), self.array(f'{name}.data'))
+
+
+# a section (hosts or packages) of a compiled inventory, it looks like the dict the yaml would have been parsed into
+# (row name -> row) so everything that reads the inventory works on it unchanged.  indexing a row hands back a view
+# that decodes the row's labels and packages out of the arrays when they are asked for.
+class CompiledSection(Mapping):
+    names: "_StringTable"
+
+    _inventory: CompiledInventory
+    _name: str
+    _label_offsets: memoryview
+    _label_keys: memoryview
+    _label_values: memoryview
+    _package_offsets: Union[memoryview, None]
+    _package_values: Union[memoryview, None]
+    _ids: Union[Dict[Any, int], None]
+
+    def __init__(self, inventory: CompiledInventory, name: str):
+        self._inventory = inventory
+        self._name = name
+
+        self.names = inventory.strings(f'{name}.names')
+        self._label_offsets = inventory.array(f'{name}.labels.offsets')
+        self._label_keys = inventory.array(f'{name}.labels.keys')
+        self._label_values = inventory.array(f'{name}.labels.values')
+        self._package_offsets = inventory.array(f'{name}.packages.offsets')
+        self._package_values = inventory.array(f'{name}.packages.values')
+
+        # row name -> row id, only needed to look a row up by its name so it is built on first use
+        self._ids = None
+
+    def __getitem__(self, key) -> "CompiledRow":
+        return CompiledRow(self, self._row_ids()[key])
+
+    def __contains__(self, key) -> bool:
+        return key in self._row_ids()
+
+    def __iter__(self) -> Iterator:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self._name!r}, {len(self)} Row(s))'
+
+    @property
+    def has_packages(self) -> bool:
+        return self._package_offsets is not None
+
+    def labels(self, row_id: int) -> Dict:
+        symbols = self._inventory.symbols
+        start, end = self._label_offsets[row_id], self._label_offsets[row_id + 1]
+        return {
+            symbols[k]: symbols[v] for k, v in zip(self._label_keys[start:end], self._label_values[start:end])
+        }
+
+    def packages(self, row_id: int) -> List:
+        symbols = self._inventory.symbols
+        start, end = self._package_offsets[row_id], self._package_offsets[row_id + 1]
+        return [symbols[package] for package in self._package_values[start:end]]
+
+    def postings(self, index_mode: str = INDEX_SET) -> Union["CompiledPostings", BitsetIndex]:
+        # the precompiled posting lists in the form the label index wants them, ready to be handed to LabelIndex
+        if index_mode == INDEX_BITSET:
+            return BitsetIndex(self.names, CompiledPostings(self._inventory, self._name, self._bitset_posting))
+
+        return CompiledPostings(self._inventory, self._name, self._set_posting)
+
+    def _row_ids(self) -> Dict[Any, int]:
+        if self._ids is None:
+            self._ids = {name: i for i, name in enumerate(self.names)}
+
+        return self._ids
+
+    def _set_posting(self, kind: int, posting: memoryview) -> set:
+        names = self.names
+        ids = iter_ids(int.from_bytes(posting, 'little')) if kind == _POSTING_BITMAP else posting
+        return {names[i] for i in ids}
+
+    def _bitset_posting(self, kind: int, posting: memoryview) -> Union[int, memoryview]:
+        return int.from_bytes(posting, 'little') if kind == _POSTING_BITMAP else posting
+
+
+# a single row of a compiled section, standing in for the row's dict.  nothing is decoded until it is asked for and
+# nothing is kept, the row is only a (section, row id) pair.
+class CompiledRow(Mapping):
+    __slots__ = ('_section', '_row_id')
+
+    def __init__(self, section: CompiledSection, row_id: int):
+        self._section = section
+        self._row_id = row_id
+
+    def __getitem__(self, key) -> Any:
+        if key == 'labels':
+            return self._section.labels(self._row_id)
+        if key == 'packages' and self._section.has_packages:
+            return self._section.packages(self._row_id)
+
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator:
+        return iter(('labels', 'packages') if self._section.has_packages else ('labels',))
+
+    def __len__(self) -> int:
+        return 2 if self._section.has_packages else 1
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+# the posting lists of a section, index key -> posting list.  the index keys are decoded when the postings are opened
+# (there is one per distinct label and label value, not per row), each posting list is decoded the first time it is
+# looked up and kept from then on.
+class CompiledPostings(Mapping):
+    _kinds: memoryview
+    _offsets: memoryview
+    _data: memoryview
+    _decode: Callable[[int, memoryview], Any]
+    _index_keys: Dict[Tuple, int]
+    _decoded: Dict[Tuple, Any]
+
+    def __init__(self, inventory: CompiledInventory, section_name: str, decode: Callable[[int, memoryview], Any]):
+        symbols = inventory.symbols
+        labels = inventory.array(f'{section_name}.postings.labels')
+        values = inventory.array(f'{section_name}.postings.values')
+
+        self._kinds = inventory.array(f'{section_name}.postings.kinds')
+        self._offsets = inventory.array(f'{section_name}.postings.offsets')
+        self._data = inventory.array(f'{section_name}.postings.data')
+        self._decode = decode
+
+        self._index_keys = {
+            (symbols[label],) if value == NO_VALUE else (symbols[label], symbols[value]): i
+            for i, (label, value) in enumerate(zip(labels, values))
+        }
+        self._decoded = {}
+
+    def __getitem__(self, index_key: Tuple) -> Any:
+        if index_key not in self._decoded:
+            i = self._index_keys[index_key]
+            kind = self._kinds[i]
+            posting = self._data[self._offsets[i]:self._offsets[i + 1]]
+            self._decoded[index_key] = self._decode(kind, posting.cast('I') if kind == _POSTING_IDS else posting)
+
+        return self._decoded[index_key]
+
+    def __contains__(self, index_key) -> bool:
+        return index_key in self._index_keys
+
+    def __iter__(self) -> Iterator[Tuple]:
+        return iter(self._index_keys)
+
+    def __len__(self) -> int:
+        return len(self._index_keys)
+
+
+# a table of (typed) strings: an offsets array into the utf-8 data with a type per entry.  entries are decoded the
+# first time they are looked up.
+class _StringTable(Sequence):
+    _offsets: memoryview
+    _types: memoryview
+    _data: memoryview
+    _decoded: Union[List, None]
+
+    def __init__(self, offsets: memoryview, types: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._types = types
+        self._data = data
+        self._decoded = None
+
+    def __getitem__(self, i: int) -> Any:
+        if self._decoded is None:
+            self._decoded = [_UNDECODED] * len(self._types)
+
+        value = self._decoded[i]
+        if value is _UNDECODED:
+            value = self._decoded[i] = _decode(self._types[i], self._data[self._offsets[i]:self._offsets[i + 1]])
+
+        return value
+
+    def __iter__(self) -> Iterator:
+        return (self[i] for i in range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self._types)
+
+
+_UNDECODED = object()
+
+
+class _SymbolEncoder:
+    symbols: List
+    _codes: Dict[Tuple, int]
+
+    def __init__(self):
+        self.symbols = []
+        self._codes = {}
+
+    def code(self, value: Any) -> int:
+        # keyed by the type as well, 1, 1.0 and True are all equal (and hash the same) but they are different labels
+        symbol_key = (type(value), value)
+        if symbol_key not in self._codes:
+            _type_code(value)
+            self._codes[symbol_key] = len(self.symbols)
+            self.symbols.append(value)
+
+        return self._codes[symbol_key]
+
+
+def _compile_section(section_name: str, section: Dict, symbols: _SymbolEncoder) -> Iterable[Tuple[str, str, array]]:
+    names = []
+    label_offsets, label_keys, label_values = array('Q', [0]), array('I'), array('I')
+    package_offsets, package_values = array('Q', [0]), array('I')
+    has_packages = False
+
+    # same order as build_label_index, the groups come out of the index in the order their values were first seen
+    postings = {}
+    for i, (name, row) in enumerate(section.items()):
+        names.append(name)
+
+        for label, value in (row.get('labels') or {}).items():
+            label_code, value_code = symbols.code(label), symbols.code(value)
+            label_keys.append(label_code)
+            label_values.append(value_code)
+
+            postings.setdefault((label_code, NO_VALUE), []).append(i)
+            postings.setdefault((label_code, value_code), []).append(i)
+
+        label_offsets.append(len(label_keys))
+
+        if 'packages' in row:
+            has_packages = True
+            package_values.extend(symbols.code(package) for package in row['packages'] or ())
+
+        package_offsets.append(len(package_values))
+
+    yield from _string_table(f'{section_name}.names', names)
+    yield f'{section_name}.labels.offsets', 'Q', label_offsets
+    yield f'{section_name}.labels.keys', 'I', label_keys
+    yield f'{section_name}.labels.values', 'I', label_values
+
+    if has_packages:
+        yield f'{section_name}.packages.offsets', 'Q', package_offsets
+        yield f'{section_name}.packages.values', 'I', package_values
+
+    # every posting list is either the ids (4 bytes each) or a bitmap over every row, whichever is smaller.  they all
+    # go into one blob with each one starting on a 4 byte boundary so the ids can be cast in place.
+    posting_labels, posting_values, posting_kinds = array('I'), array('I'), array('B')
+    posting_offsets, posting_data = array('Q', [0]), bytearray()
+    for (label_code, value_code), ids in postings.items():
+        posting_labels.append(label_code)
+        posting_values.append(value_code)
+
+        if len(ids) * SPARSE_RATIO < len(names):
+            posting_kinds.append(_POSTING_IDS)
+            posting_data += array('I', ids).tobytes()
+        else:
+            posting_kinds.append(_POSTING_BITMAP)
+            bitmap = bytearray((len(names) + 7) // 8)
+            for row_id in ids:
+                bitmap[row_id >> 3] |= 1 << (row_id & 7)
+            posting_data += bitmap
+            posting_data += b'\x00' * (-len(posting_data) % 4)
+
+        posting_offsets.append(len(posting_data))
+
+    yield f'{section_name}.postings.labels', 'I', posting_labels
+    yield f'{section_name}.postings.values', 'I', posting_values
+    yield f'{section_name}.postings.kinds', 'B', posting_kinds
+    yield f'{section_name}.postings.offsets', 'Q', posting_offsets
+    yield f'{section_name}.postings.data', 'B', array('B', posting_data)
+
+
+def _string_table(name: str, values: List) -> Iterable[Tuple[str, str, array]]:
+    offsets, types, data = array('Q', [0]), array('B'), bytearray()
+    for value in values:
+        types.append(_type_code(value))
+        data += _encode(value)
+        offsets.append(len(data))
+
+    yield f'{name}.offsets', 'Q', offsets
+    yield f'{name}.types', 'B', types
+    yield f'{name}.data', 'B', array('B', data)
+
+
+def _type_code(value: Any) -> int:
+    # bool before int, a bool is an int as far as isinstance is concerned
+    if isinstance(value, bool):
+        return _TYPE_BOOL
+    if isinstance(value, str):
+        return _TYPE_STR
+    if isinstance(value, int):
+        return _TYPE_INT
+    if isinstance(value, float):
+        return _TYPE_FLOAT
+    if value is None:
+        return _TYPE_NONE
+
+    raise CompiledInventoryException(f"Unsupported Value in Compiled Inventory: {value!r}")
+
+
+def _encode(value: Any) -> bytes:
+    if isinstance(value, bool):
+        return b'1' if value else b''
+    if value is None:
+        return b''
+
+    return (value if isinstance(value, str) else repr(value)).encode('utf-8')
+
+
+def _decode(type_code: int, data: memoryview) -> Any:
+    text = bytes(data).decode('utf-8')
+    if type_code == _TYPE_STR:
+        return text
+    if type_code == _TYPE_INT:
+        return int(text)
+    if type_code == _TYPE_FLOAT:
+        return float(text)
+    if type_code == _TYPE_BOOL:
+        return text == '1'
+
+    return None
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def main(argv: Iterable[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='deploy-pipeline compile-inventory',
+        description='compile the host and package config into a file deploy-pipeline maps into memory instead of '
+                    'parsing, pass it to --config in place of the yaml'
+    )
+
+    parser.add_argument('--config', metavar='<path to host and package config>.yml',
+                        help='path to the host and package config yaml files or directories of them, the hosts and '
+                             'packages from every file are merged', required=True, nargs='+')
+
+    parser.add_argument('--output', metavar='<path to compiled inventory>', required=True,
+                        help='path to write the compiled inventory to')
+
+    parser.add_argument('--jobs', type=int, default=1, help='number of processes to parse the config files with')
+
+    args = parser.parse_args(argv)
+
+    config_files = expand_config_paths(args.config)
+    if any(is_compiled_inventory(path) for path in config_files):
+        parser.error('the config is already compiled')
+
+    config = load_config(config_files, workers=args.jobs)
+    written = compile_inventory(config, args.output)
+
+    print(
+        f"Compiled Inventory: {args.output} ({len(config.get('hosts') or {})} Host(s), "
+        f"{len(config.get('packages') or {})} Package(s), {written} Bytes)"
+    )
+    return 0
+
+
+class CompiledInventoryException(InventoryException):
+    pass
@@ -0,0 +1,107 @@
+import os
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+import yaml
+from deploy_pipeline.inventory.cache import InventoryCache
+from deploy_pipeline.pipeline.workers import worker_pool
+
+# libyaml's loader is several times faster than the pure python one, fall back to the pure python loader when PyYAML
+# was built without libyaml
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# the parts of the config that are merged key by key across files (i.e. sharded inventories), everything else at the
+# top level is simply replaced by the last file to define it
+MERGED_SECTIONS = ('hosts', 'packages')
+
+CONFIG_EXTENSIONS = ('.yml', '.yaml')
+
+
+def load_yaml_file(path: str) -> Any:
+    with open(path) as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def load_config_file(path: str, cache: Union[InventoryCache, None] = None) -> Dict:
+    # with a cache the yaml is only parsed when the file's content has changed, otherwise it is read back from disk
+    if cache:
+        return cache.load(path, load_yaml_file)
+
+    return load_yaml_file(path)
+
+
+def expand_config_paths(paths: Iterable[str]) -> List[str]:
+    # a directory stands in for every yaml file directly inside of it, sorted so the merge order is stable
+    config_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            config_paths.extend(sorted(
+                os.path.join(path, p) for p in os.listdir(path)
+                if p.endswith(CONFIG_EXTENSIONS) and os.path.isfile(os.path.join(path, p))
+            ))
+        else:
+            config_paths.append(path)
+
+    return config_paths
+
+
+def load_files(paths: List[str], loader: Callable[[str], Any], workers: int = 1) -> List[Any]:
+    # parsing is cpu bound (even with libyaml the python objects are built while holding the gil) so the files are
+    # spread over a process pool rather than threads.  results come back in the same order as the paths.
+    if workers <= 1 or len(paths) <= 1:
+        return [loader(path) for path in paths]
+
+    with worker_pool(min(workers, len(paths))) as executor:
+        return list(executor.map(loader, paths))
+
+
+def load_config(paths: List[str], cache: Union[InventoryCache, None] = None, workers: int = 1,
+                config: Dict = None) -> Dict:
+    config = config if config is not None else {}
+
+    # keeps track of which file defined each host/package so a conflict can point at both of them
+    origins = {}
+    for path, file_config in zip(paths, load_files(paths, partial(load_config_file, cache=cache), workers)):
+        merge_config(config, file_config or {}, path, origins)
+
+    return config
+
+
+def merge_config(config: Dict, file_config: Dict, path: str, origins: Dict[Tuple, str] = None) -> Dict:
+    origins = origins if origins is not None else {}
+
+    for config_k, config_v in file_config.items():
+        # a section with all of its entries commented out loads as null, it simply has nothing to add
+        if config_k in MERGED_SECTIONS:
+            if config_v is None:
+                config_v = {}
+            elif not isinstance(config_v, dict):
+                raise InventoryException(f"Malformed Section '{config_k}' in {path}: expected a mapping")
+
+        if config_k not in MERGED_SECTIONS or config_k not in config:
+            config[config_k] = config_v
+            # a section that is replaced outright still needs to be tracked, otherwise a conflict against it would go
+            # unnoticed
+            if config_k in MERGED_SECTIONS:
+                origins.update({(config_k, k): path for k in config_v})
+            continue
+
+        section = config[config_k]
+        for k, v in config_v.items():
+            # the same host (or package) can show up in more than one shard, as long as it is defined the same way
+            if k in section and section[k] != v:
+                raise InventoryConflictException(
+                    f"Conflicting Definition for {config_k} '{k}': {origins.get((config_k, k), '<unknown>')} and {path}"
+                )
+
+            section[k] = v
+            origins[(config_k, k)] = path
+
+    return config
+
+
+class InventoryException(Exception):
+    pass
+
+
+class InventoryConflictException(InventoryException):
+    pass
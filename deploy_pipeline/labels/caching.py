@@ -0,0 +1,115 @@
+import sys
+import threading
+from collections import OrderedDict
+from enum import Enum
+from typing import Any, Hashable, NamedTuple, Tuple, Union
+
+# roughly how much memory the cached results can hold on to (in bytes) before the least recently used are dropped
+MATCH_CACHE_BUDGET = 64 << 20
+
+MatchCacheStats = NamedTuple('MatchCacheStats', (
+    ('hits', int),
+    ('misses', int),
+    ('evictions', int),
+    ('entries', int),
+    ('size', int),
+    ('budget', int)
+))
+
+
+# lots of jobs share the exact same selectors (or none at all), and every one of them used to run its queries from
+# scratch.  the results of a LabelMatch are kept here, keyed by the index version, the set of queries and the
+# candidates they were restricted to, so the second job asking the same thing gets the answer straight back.
+#
+# an entry costs the size of its key, result and plan (see result_size, the keys themselves are shared with the
+# inventory, it's the tables that count), entries are dropped least recently used first once the budget is used up.
+# the sizes are what sys.getsizeof reports, a little under what the entries really take up (the cache's own
+# bookkeeping isn't in there), so the budget is an approximate one.  the service runs requests on a
+# thread each, so everything goes through a lock.
+class MatchCache:
+    budget: int
+
+    _lock: threading.Lock
+    _entries: "OrderedDict[Hashable, Tuple[Any, int]]"
+    _size: int
+
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, budget: int = MATCH_CACHE_BUDGET):
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Union[Any, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        with self._lock:
+            # anything bigger than the whole budget would just flush everything else out on its way through
+            if size > self.budget:
+                return
+
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, size)
+            self._size += size
+
+            while self._size > self.budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> MatchCacheStats:
+        with self._lock:
+            return MatchCacheStats(self.hits, self.misses, self.evictions, len(self._entries), self._size, self.budget)
+
+
+# what an entry costs: its key, the result and the plan that came with it, containers nested in them included (the
+# queries and plan steps are tuples of tuples).  the members of a set are the source's own keys, shared with the
+# inventory, so only the set itself counts, which also keeps this from walking every matched key.  strings are shared
+# the same way, big ints (the bitset candidates) are not.
+def result_size(*values: Any) -> int:
+    seen = set()
+    size = 0
+    pending = list(values)
+    while pending:
+        value = pending.pop()
+        if value is None or isinstance(value, (str, bool, Enum)) or id(value) in seen:
+            continue
+
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, (tuple, list)):
+            pending.extend(value)
+        elif isinstance(value, dict):
+            pending.extend(value.keys())
+            pending.extend(value.values())
+
+    return size
+
+
+# every index that asks for caching shares this one, so the budget holds for the whole process no matter how many
+# inventories (see service.py) are loaded
+MATCH_CACHE = MatchCache()
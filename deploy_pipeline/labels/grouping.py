@@ -1,31 +1,80 @@
 from collections import defaultdict
-from typing import Dict, Set
+from typing import Any, Dict, Mapping, Set, Tuple, Union
+from deploy_pipeline.labels.matching import LabelIndex
+import deploy_pipeline.metrics.metrics as metrics
 
 
 class LabelGroup:
-    _source: Dict
+    _source: Mapping
     _sub_key: str
+    _label_index: Union[LabelIndex, None]
 
     # it isn't lost on me that all of this stuff falls on its face if we need to nest further than one element into the
     # dict (i.e. { "foo": { "bar": { "baz": { "tag_key": "tag_value", "tag_key_1": "tag_value_1" } } } }, where the
     # nested foo["bar"]["baz"] is the source for the labels.  might need to be changed, even providing the option to
     # query based on sub-key is over-engineering (if it can even be called that), cause everything is under "labels"
     # currently.
-    def __init__(self, source: Dict, sub_key: str = None):
+    #
+    # when the label index for the source is supplied the groups are read straight out of its posting lists instead of
+    # the rows.  the source can be the indexed source itself or a narrowed view of it (i.e. with_data), in which case
+    # the groups only hold the keys in the view.
+    def __init__(self, source: Mapping, sub_key: str = None, label_index: LabelIndex = None):
         self._source = source
         self._sub_key = sub_key
+        self._label_index = label_index
 
-    def group(self, group_label: str) -> Dict[str, Set]:
+    def group(self, group_label: Union[str, Tuple[str, ...]]) -> Dict[Any, Set]:
+        # a single label groups by its value, a tuple of labels (i.e. region then stage) groups by the tuple of their
+        # values.  anything missing one of the labels doesn't belong to any group, it is left out rather than blowing
+        # up with a KeyError.
+        group_labels = (group_label,) if isinstance(group_label, str) else tuple(group_label)
+        with metrics.span('label_group'):
+            if self._label_index is not None:
+                groups = self._group_index(group_labels)
+            else:
+                groups = self._group_rows(group_labels)
+
+        metrics.count('label_group.groups', len(groups))
+
+        return {group_k[0]: v for group_k, v in groups.items()} if isinstance(group_label, str) else groups
+
+    def _group_rows(self, group_labels: Tuple[str, ...]) -> Dict[Tuple, Set]:
         # for future me, I chose this route due to code clarity.  if the data were laid out differently we could use
         # something like utilize itertools.groupby, but as it stands we are currently getting data fed in via a dict,
         # and we're grouping by a sub-key, so it seemed more straight forward to do this.
-        #
-        # originally i was going to do some fun list comprehensions mixed with sorting of tuples (required by groupby)
-        # and then feed that into itertools.groupby to get the grouped result, but that just seemed convoluted and since
-        # the performance isn't a concern right now, I won't pre-maturely optimize
         result = defaultdict(set)
         for source_k, source_v in self._source.items():
-            group_k = source_v[self._sub_key][group_label] if self._sub_key else source_v[group_label]
-            result[group_k].add(source_k)
+            labels = source_v.get(self._sub_key, {}) if self._sub_key else source_v
+            if all(group_label in labels for group_label in group_labels):
+                result[tuple(labels[group_label] for group_label in group_labels)].add(source_k)
+
+        return dict(result)
+
+    def _group_index(self, group_labels: Tuple[str, ...]) -> Dict[Tuple, Set]:
+        label_index = self._label_index
+
+        # None stands in for "every key in the index", which lets the first label take the posting lists as they are
+        # rather than intersecting them with everything
+        members = None if self._source is label_index.source else label_index.restrict(self._source.keys())
+
+        # the groups are refined one label at a time, the (<label>, <value>) posting lists already hold the members of
+        # every group so each step is an intersection per distinct value rather than a pass over every row.  groups
+        # come out ordered by the first label, then the second and so on.
+        groups = {(): members}
+        for group_label in group_labels:
+            refined = {}
+            for group_k, group_members in groups.items():
+                for value in label_index.label_values(group_label):
+                    posting = label_index.posting((group_label, value))
+                    if matched := posting if group_members is None else group_members & posting:
+                        refined[group_k + (value,)] = matched
+
+            groups = refined
 
-        return result
+        # groups taken straight from the posting lists are the index's own sets, those are handed out frozen so a caller
+        # changing a group can't change the index (and the cached matches built from it) along with it
+        shared = members is None and len(group_labels) == 1
+        return {
+            group_k: frozenset(label_index.keys_of(group_members)) if shared else label_index.keys_of(group_members)
+            for group_k, group_members in groups.items()
+        }
@@ -0,0 +1,108 @@
+from array import array
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Set, Tuple, Union
+
+# the index can either hold a set of source keys per label (the default) or a bitmap of source key ids.  the modes live
+# here rather than with LabelIndex (labels/matching.py, which still exports them) so the cli can offer them without
+# importing the rest of the label matching.
+INDEX_SET = 'set'
+INDEX_BITSET = 'bitset'
+INDEX_MODES = (INDEX_SET, INDEX_BITSET)
+
+# a posting list is stored as a bitmap (a python int, bit n set means the source key with id n has the label) unless it
+# is sparse enough that a plain array of ids is smaller.  an id takes 4 bytes in the array and the bitmap takes 1 bit
+# per source key, so anything holding fewer than 1/32nd of the keys is kept as an array.
+SPARSE_RATIO = 32
+
+Posting = Union[int, array]
+
+_popcount = getattr(int, 'bit_count', lambda bits: bin(bits).count('1'))
+
+
+# an inverted index of (<label>) and (<label>, <value>) just like the one LabelMatch builds, except every source key is
+# given a dense integer id and the posting lists hold ids rather than the keys themselves.  with tens of thousands of
+# hosts that is a fraction of the memory of a set of strings per label, and the queries turn into bitwise and/or/andnot
+# on ints (done in C) instead of allocating new sets of strings.  ids are only turned back into keys at the very end.
+class BitsetIndex:
+    _keys: List
+    _ids: Union[Dict[Any, int], None]
+    _postings: Dict[Tuple, Posting]
+
+    # every id set, i.e. the bitmap equivalent of source.keys()
+    all_bits: int
+
+    def __init__(self, keys: List, postings: Dict[Tuple, Posting]):
+        self._keys = keys
+        self._postings = postings
+
+        # key -> id, only needed when a set of keys has to be turned into a bitmap so it is built on first use
+        self._ids = None
+
+        self.all_bits = (1 << len(keys)) - 1
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, index_key: Tuple) -> bool:
+        return index_key in self._postings
+
+    def keys(self) -> Iterable[Tuple]:
+        return self._postings.keys()
+
+    def bits(self, index_key: Tuple) -> int:
+        posting = self._postings.get(index_key, 0)
+        return posting if type(posting) is int else _ids_to_bits(posting, len(self._keys))
+
+    def count(self, index_key: Tuple) -> int:
+        posting = self._postings.get(index_key, 0)
+        return _popcount(posting) if type(posting) is int else len(posting)
+
+    def bits_of(self, keys: Iterable) -> int:
+        if self._ids is None:
+            self._ids = {k: i for i, k in enumerate(self._keys)}
+
+        ids = self._ids
+        return _ids_to_bits((ids[k] for k in keys), len(self._keys))
+
+    def keys_of(self, bits: int) -> Set:
+        keys = self._keys
+        return {keys[i] for i in iter_ids(bits)}
+
+
+def build_bitset_index(source: Mapping[str, Any], sub_key: str = None) -> BitsetIndex:
+    keys = []
+    id_postings = defaultdict(list)
+
+    for i, (k, v) in enumerate(source.items()):
+        keys.append(k)
+        # allows the user to specify a sub key, or just use the dict by itself
+        l_source = v.get(sub_key, {}) if sub_key else v
+        for l_k, l_value in l_source.items():
+            # facilitate exists and doesnotexist lookups
+            id_postings[(l_k,)].append(i)
+            # facilitate in and not in lookups
+            id_postings[(l_k, l_value)].append(i)
+
+    postings = {}
+    for index_key, ids in id_postings.items():
+        postings[index_key] = array('I', ids) if len(ids) * SPARSE_RATIO < len(keys) else _ids_to_bits(ids, len(keys))
+
+    return BitsetIndex(keys, postings)
+
+
+def iter_ids(bits: int) -> Iterator[int]:
+    # walk the set bits from the low end, str.find does the scanning in C so this is proportional to the number of set
+    # bits rather than the width of the bitmap
+    reversed_bits = bin(bits)[:1:-1]
+    i = reversed_bits.find('1')
+    while i != -1:
+        yield i
+        i = reversed_bits.find('1', i + 1)
+
+
+def _ids_to_bits(ids: Iterable[int], size: int) -> int:
+    bitmap = bytearray((size + 7) // 8)
+    for i in ids:
+        bitmap[i >> 3] |= 1 << (i & 7)
+
+    return int.from_bytes(bitmap, 'little')
@@ -1,34 +1,55 @@
-from typing import Dict, Union, Iterable
+from typing import Any, Dict, Mapping, Union, Iterable, Set
 from collections import defaultdict
+import deploy_pipeline.metrics.metrics as metrics
 
 
 class LabelJoin:
-    # i should note that the type hint for "right" of Dict OR Iterable will fall on its face if join_key is provided
+    # i should note that the type hint for "right" of Mapping OR Iterable will fall on its face if join_key is provided
     # and the variable passed in doesn't implement __get__.  It'll thrown an exception so you'll know right away if you
     # have a problem
-    def __init__(self, left: Union[Dict, Iterable], join_key: str = None):
+    def __init__(self, left: Union[Mapping, Iterable], join_key: str = None):
         self._left = left
         self._left_key = join_key
 
     # see type hint warning above
-    def match(self, right: Union[Dict, Iterable], join_key: str = None):
+    def match(self, right: Union[Mapping, Iterable], join_key: str = None) -> Dict[str, Set]:
+        with metrics.span('label_join'):
+            result = self._match(right, join_key)
+
+        metrics.count('label_join.matched', len(result))
+        return result
+
+    def _match(self, right: Union[Mapping, Iterable], join_key: str = None) -> Dict[str, Set]:
         # holds the matched map of {left_key_1: {matched_right_key_1, matched_right_key_n}}
         result = defaultdict(set)
 
-        # iterate over the left dict, as keys and values
+        # this used to compare every left key against every right key (rebuilding the join key sets on each pass),
+        # which is fine for a handful of hosts but falls over with a real fleet.  now the right side is indexed once
+        # (join key -> right keys) and every left row just probes that index, so the cost is linear in the size of
+        # both sides rather than their product.
+        right_index = build_join_index(right, join_key)
+
         for left_k in self._left:
-            # if a left key is supplied, use it as the join key, if not just use the left dicts subkey(s) for joining
-            left_join_keys = set(self._left[left_k][self._left_key]) if self._left_key else {left_k}
-            # iterate over the right dict, again as keys and values
-            # we're doing all this nonsense to support lookups of nested keys (one level currently, since that is all
-            # that is needed)
-            for right_k in right:
-                # extract the join key
-                right_join_keys = set(right[right_k][join_key]) if join_key else {right_k}
-                # determine if there is any overlap between the keys, if there is we should count this as a match,
-                # implementation detail here, we could iterate over left or right join keys and do an if/match/break
-                # this is at least done in C: https://github.com/python/cpython/blob/master/Objects/setobject.c#L1166
-                if len(right_join_keys & left_join_keys) > 0:
-                    result[left_k].add(right_k)
+            # if a left key is supplied, use it as the join key, if not just use the left key itself for joining
+            left_join_keys = self._left[left_k][self._left_key] if self._left_key else (left_k,)
+            for left_join_k in left_join_keys:
+                if left_join_k in right_index:
+                    result[left_k].update(right_index[left_join_k])
 
         return result
+
+
+def build_join_index(source: Union[Mapping, Iterable], join_key: str = None) -> Dict[Any, Set]:
+    # builds the inverted index of {join_key_value: {source_key_1, source_key_n}}.  when there is no join key the
+    # source keys are joined on themselves (the identity join), so each key simply maps to itself.
+    if not join_key:
+        return {source_k: {source_k} for source_k in source}
+
+    index = defaultdict(set)
+    for source_k in source:
+        # we're doing all this nonsense to support lookups of nested keys (one level currently, since that is all
+        # that is needed)
+        for join_v in source[source_k][join_key]:
+            index[join_v].add(source_k)
+
+    return index
@@ -1,6 +1,10 @@
 from enum import Enum
 from collections import defaultdict
-from typing import Dict, Any, NamedTuple, Tuple, Iterable, Set, Union
+from itertools import count
+from typing import Dict, Any, Mapping, NamedTuple, Tuple, Iterable, Set, Union, List, Callable
+from deploy_pipeline.labels.indexing import BitsetIndex, build_bitset_index, INDEX_SET, INDEX_BITSET
+from deploy_pipeline.labels.caching import MatchCache, result_size
+import deploy_pipeline.metrics.metrics as metrics
 
 
 class Operator(Enum):
@@ -17,105 +21,401 @@ LabelQuery = NamedTuple('LabelQuery', (
 ))
 
 
+# a query plan, as reported by LabelMatch.explain.  estimate is the number of keys expected to survive the query on its
+# own (worked out from the posting list sizes, None when scanning), matched is the number of keys left after the step
+# actually ran (None if it never ran because nothing was left to match).
+PlanStep = NamedTuple('PlanStep', (
+    ('query', LabelQuery),
+    ('estimate', Union[int, None]),
+    ('matched', Union[int, None])
+))
+
+QueryPlan = NamedTuple('QueryPlan', (
+    ('strategy', str),
+    ('source_size', int),
+    ('steps', List[PlanStep]),
+    ('matched', int)
+))
+
+STRATEGY_INDEX = 'index'
+STRATEGY_SCAN = 'scan'
+
+# sources with this many keys (or fewer) are just scanned row by row, building an index for a handful of rows costs
+# more than it could ever save.  a prebuilt index is always used regardless.
+SCAN_THRESHOLD = 64
+
+POSITIVE_OPERATORS = (Operator.In, Operator.Exists)
+
+_popcount = getattr(int, 'bit_count', lambda bits: bin(bits).count('1'))
+
+# every index gets a version of its own, cached match results are only ever handed back to the index they came from
+_index_versions = count()
+
+
+# the inverted index of (<label>) and (<label>, <value>) over a source, built once (per inventory) and shared by any
+# number of LabelMatch queries.  the posting lists are only built the first time something actually needs them.
+#
+# an index that is going to see the same queries over and over (i.e. the inventory's, queried by every job) can be
+# handed a MatchCache to remember the results in.  the index never changes once it is built, a new inventory is a new
+# index with a new version, so nothing cached for the old one is ever handed back.
+class LabelIndex:
+    source: Mapping[str, Any]
+    sub_key: str
+    index_mode: str
+    version: int
+    match_cache: Union[MatchCache, None]
+
+    _postings: Union[Dict[Tuple, Set], BitsetIndex, None]
+    _label_values: Union[Dict[str, List], None]
+
+    def __init__(self, source: Mapping[str, Any], sub_key: str = None, index_mode: str = INDEX_SET,
+                 postings: Union[Dict[Tuple, Set], BitsetIndex] = None, match_cache: MatchCache = None):
+        self.source = source
+        self.sub_key = sub_key
+        self.version = next(_index_versions)
+        self.match_cache = match_cache
+
+        # prebuilt posting lists (i.e. loaded from the inventory cache) *must* have been built from the same source and
+        # sub key, their type wins over the index mode
+        self.index_mode = index_mode if postings is None else _postings_mode(postings)
+        self._postings = postings
+        self._label_values = None
+
+    @property
+    def built(self) -> bool:
+        return self._postings is not None
+
+    @property
+    def postings(self) -> Union[Dict[Tuple, Set], BitsetIndex]:
+        if self._postings is None:
+            with metrics.span('label_index.build'):
+                self._postings = build_label_index(self.source, self.sub_key, self.index_mode)
+
+            metrics.count('label_index.keys', len(self.source))
+            metrics.count('label_index.postings', len(self._postings.keys()))
+
+        return self._postings
+
+    def count(self, index_key: Tuple) -> int:
+        postings = self.postings
+        return postings.count(index_key) if isinstance(postings, BitsetIndex) else len(postings.get(index_key, ()))
+
+    def posting(self, index_key: Tuple) -> Union[Set, int]:
+        # the posting list in whatever form the index holds it natively (a set of keys or a bitmap).  the set is the
+        # one held by the index, so treat it as read only.
+        postings = self.postings
+        return postings.bits(index_key) if isinstance(postings, BitsetIndex) else postings.get(index_key, set())
+
+    def keys_of(self, matched: Union[Set, int]) -> Set:
+        # the inverse of restrict, turns a native posting list (or candidates) back into source keys
+        return self.postings.keys_of(matched) if type(matched) is int else matched
+
+    def label_values(self, label: str) -> List:
+        # every distinct value of a label, in the order they were first seen.  the index keys already hold them, so
+        # this is worked out once from those rather than from the rows.
+        if self._label_values is None:
+            label_values = defaultdict(list)
+            for index_key in self.postings.keys():
+                if len(index_key) == 2:
+                    label_values[index_key[0]].append(index_key[1])
+
+            self._label_values = label_values
+
+        return self._label_values.get(label, [])
+
+    def restrict(self, keys: Iterable) -> Union[Set, int]:
+        # turns a set of source keys into whatever the index uses natively, so the same candidates can be handed to
+        # lots of queries without being converted every time.  either way they are hashable (a frozenset hangs on to
+        # its hash), which is what the match cache keys on.
+        if self.index_mode == INDEX_BITSET:
+            return self.postings.bits_of(keys)
+
+        return keys if isinstance(keys, frozenset) else frozenset(keys)
+
+    def match(self, candidates: Union[Iterable, int] = None) -> "LabelMatch":
+        return LabelMatch(self.source, self.sub_key, self, candidates=candidates)
+
+
 class LabelMatch:
-    _source: Dict[str, Any]
+    _source: Mapping[str, Any]
     _sub_key: str
     _queries: Set[LabelQuery]
 
-    _index_complete: bool
-    _label_index: Union[Dict[Tuple, Set], None]
+    _index: LabelIndex
+    _candidates: Union[Set, int, None]
+    _scan_threshold: int
+    _plan: Union[QueryPlan, None]
 
-    def __init__(self, source: Dict[str, Any], sub_key: str = None):
+    # candidates restricts the query to a subset of the source keys (i.e. just the hosts in a given stage), they can
+    # either be the keys themselves or whatever LabelIndex.restrict handed back for them.
+    def __init__(self, source: Mapping[str, Any], sub_key: str = None,
+                 label_index: Union[LabelIndex, Dict[Tuple, Set], BitsetIndex] = None, index_mode: str = INDEX_SET,
+                 scan_threshold: int = SCAN_THRESHOLD, candidates: Union[Iterable, int] = None):
         self._source = source
         self._sub_key = sub_key
+        self._scan_threshold = scan_threshold
 
         self._queries = set()
+        self._plan = None
+
+        # the inverted index of (<label>) and (<label>, <value>) to facilitate key-based lookups.  it is either shared
+        # (a LabelIndex built once for the source), prebuilt posting lists, or built from the source on demand.
+        if not isinstance(label_index, LabelIndex):
+            label_index = LabelIndex(source, sub_key, index_mode, label_index)
 
-        # build an inverted index of (<label>) and (<label>, <value>)
-        # to facilitate key-based lookups
-        self._label_index = None
+        self._index = label_index
+        self._candidates = candidates if candidates is None or isinstance(candidates, (set, frozenset, int)) else set(
+            candidates
+        )
 
     def add_query(self, query: LabelQuery) -> "LabelMatch":
         self._queries.add(query)
+        self._plan = None
         return self
 
     def add_queries(self, queries: Iterable[LabelQuery]) -> "LabelMatch":
         for query in queries:
             self._queries.add(query)
 
+        self._plan = None
         return self
 
-    def _get_index(self) -> Dict[Tuple, Set]:
-        # the label index will only be None if it isn't built yet
-        if self._label_index is not None:
-            return self._label_index
-
-        # nuke the existing index if it's there (shouldn't be)
-        self._label_index = defaultdict(set)
-
-        # note the reverse index here isn't super kind to memory, in fact it's pretty verbose.  the trade-off here
-        # is that it should be kinder in the long run to CPU.  the reverse index allows dictionary matches which are
-        # implemented in C (ok, duck typing could make that not the case, i.e. someone passes in a Dict-like object
-        # that sub-classes UserDict where the C optimizations aren't present, but i have to draw the line somewhere)
-        # re-thought if memory becomes an issue (right now it isn't), but it this makes the subsequent query code
-        # *WAY* more simple
-        for k, v in self._source.items():
-            # allows the user to specify a sub key, or just use the dict by itself
-            l_source = v.get(self._sub_key, {}) if self._sub_key else v
-            for l_k, l_value in l_source.items():
-                # facilitate exists and doesnotexist lookups
-                self._label_index[(l_k,)].add(k)
-                # facilitate in and not in lookups
-                self._label_index[(l_k, l_value)].add(k)
-
-        return self._label_index
+    def _get_index(self) -> Union[Dict[Tuple, Set], BitsetIndex]:
+        return self._index.postings
+
+    def explain(self) -> QueryPlan:
+        # the plan (and the intermediate sizes) come from actually running the queries
+        if self._plan is None:
+            self.do()
+
+        return self._plan
 
     def do(self) -> Set:
+        # the same queries against the same candidates always match the same keys, the index's match cache (if it has
+        # one) hands back the result (and the plan) of the last time they were run
+        match_cache = self._index.match_cache
+        if match_cache is not None:
+            cache_key = self._cache_key()
+            cached = match_cache.get(cache_key)
+            if cached is not None:
+                metrics.count('label_match.cache_hits')
+                matched_keys, self._plan = cached
+                return matched_keys
+
+            metrics.count('label_match.cache_misses')
+
+        with metrics.span('label_match'):
+            matched_keys = self._do()
+
+        # the sizes of the posting lists the queries that ran actually read (the estimates of the negative queries are
+        # what's left once their postings are taken away, not the postings themselves)
+        if metrics.current() is not None:
+            metrics.count('label_match.queries', len(self._queries))
+            if self._plan.strategy == STRATEGY_INDEX:
+                metrics.count('label_match.postings_touched', sum(
+                    self._index.count(search_key)
+                    for step in self._plan.steps if step.matched is not None for search_key in _search_keys(step.query)
+                ))
+
+        # the result is shared by everyone asking the same thing from here on, so it is frozen on the way in
+        if match_cache is not None:
+            if type(matched_keys) is set:
+                matched_keys = frozenset(matched_keys)
+
+            match_cache.put(cache_key, (matched_keys, self._plan), result_size(cache_key, matched_keys, self._plan))
+
+        return matched_keys
+
+    def _cache_key(self) -> Tuple:
+        candidates = self._candidates
+        if type(candidates) is set:
+            candidates = frozenset(candidates)
+
+        return self._index.version, frozenset(self._queries), candidates
+
+    def _do(self) -> Set:
+        # no queries, everything (we were allowed to look at) matches
+        if not self._queries:
+            matched_keys = self._source.keys() if self._candidates is None else self._candidate_keys()
+            self._plan = QueryPlan(STRATEGY_INDEX, len(matched_keys), [], len(matched_keys))
+            return matched_keys
+
+        # not worth building an index for
+        if not self._index.built and self._start_size() <= self._scan_threshold:
+            return self._do_scan()
+
         # fetch the index
         label_index = self._get_index()
+        if isinstance(label_index, BitsetIndex):
+            return self._do_bitset(label_index)
 
         # in python3 keys returns a memory view which is a set like object and is perfect for us since we for
         # simplicity we assume the result set starts at *everything* and is narrowed down via the queries
         # the first iteration of the query loop will return a new set of filtered results, thus not needing to
         # write back to the original (which isn't supported by a memory view).
-        index_keys = label_index.keys()
-        matched_keys = self._source.keys()
-        for query in self._queries:
-            found = set()
+        matched_keys = self._source.keys() if self._candidates is None else self._candidates
+        start_size = len(matched_keys)
+        steps = []
+        for query, estimate in self._plan_queries(self._index.count):
+            # nothing left to narrow down, no point running the rest of the queries
+            if steps and not matched_keys:
+                steps.append(PlanStep(query, estimate, None))
+                continue
 
-            # this could use come clean-up
-            if query.operator == Operator.In:
-                for search_key in set((query.key, f) for f in query.values):
-                    if search_key in index_keys:
-                        found.update(label_index[search_key])
+            found = set()
+            for search_key in _search_keys(query):
+                if search_key in label_index:
+                    found.update(label_index[search_key])
 
+            if query.operator in POSITIVE_OPERATORS:
                 matched_keys = matched_keys & found
+            else:
+                matched_keys = matched_keys - found
 
-            if query.operator == Operator.NotIn:
-                for search_key in set((query.key, f) for f in query.values):
-                    if search_key in index_keys:
-                        found.update(label_index[search_key])
+            steps.append(PlanStep(query, estimate, len(matched_keys)))
 
-                matched_keys = matched_keys - found
+        self._plan = QueryPlan(STRATEGY_INDEX, start_size, steps, len(matched_keys))
 
-            if query.operator == Operator.Exists:
-                if (query.key,) in index_keys:
-                    found.update(label_index[(query.key,)])
+        # return the matched keys
+        return matched_keys
 
-                matched_keys = matched_keys & found
+    def _do_bitset(self, label_index: BitsetIndex) -> Set:
+        # same idea as above, start with every key and narrow it down, only with bitmaps so every operation is a
+        # single and/andnot on an int.  the ids are only translated back into keys once all of the queries are done.
+        matched_bits = label_index.all_bits if self._candidates is None else self._candidate_bits(label_index)
+        start_size = _popcount(matched_bits)
+        steps = []
+        for query, estimate in self._plan_queries(label_index.count):
+            if steps and not matched_bits:
+                steps.append(PlanStep(query, estimate, None))
+                continue
 
-            if query.operator == Operator.DoesNotExist:
-                if (query.key,) in index_keys:
-                    found.update(label_index[(query.key,)])
+            found_bits = 0
+            for search_key in _search_keys(query):
+                found_bits |= label_index.bits(search_key)
 
-                matched_keys = matched_keys - found
+            if query.operator in POSITIVE_OPERATORS:
+                matched_bits &= found_bits
+            else:
+                matched_bits &= ~found_bits
 
-            if not found:
-                break
+            steps.append(PlanStep(query, estimate, _popcount(matched_bits)))
+
+        matched_keys = label_index.keys_of(matched_bits)
+        self._plan = QueryPlan(STRATEGY_INDEX, start_size, steps, len(matched_keys))
 
-        # return the matched keys
         return matched_keys
 
+    def _do_scan(self) -> Set:
+        # check each row against the queries directly, the candidates are narrowed one query at a time (rather than
+        # checking every query per row) so the intermediate sizes can be reported the same way as the index plans
+        candidates = list(self._source.keys() if self._candidates is None else self._candidate_keys())
+        start_size = len(candidates)
+        steps = []
+        for query, estimate in self._plan_queries():
+            if steps and not candidates:
+                steps.append(PlanStep(query, estimate, None))
+                continue
+
+            candidates = [k for k in candidates if _row_matches(self._row_labels(k), query)]
+            steps.append(PlanStep(query, estimate, len(candidates)))
+
+        self._plan = QueryPlan(STRATEGY_SCAN, start_size, steps, len(candidates))
+
+        return set(candidates)
+
+    def _start_size(self) -> int:
+        if self._candidates is None:
+            return len(self._source)
+
+        return _popcount(self._candidates) if type(self._candidates) is int else len(self._candidates)
+
+    def _candidate_keys(self) -> Set:
+        if type(self._candidates) is int:
+            return self._get_index().keys_of(self._candidates)
+
+        return self._candidates
+
+    def _candidate_bits(self, label_index: BitsetIndex) -> int:
+        if type(self._candidates) is int:
+            return self._candidates
+
+        return label_index.bits_of(self._candidates)
+
+    def _row_labels(self, k) -> Dict:
+        # allows the user to specify a sub key, or just use the dict by itself
+        return self._source[k].get(self._sub_key, {}) if self._sub_key else self._source[k]
+
+    def _plan_queries(self, posting_size: Callable[[Tuple], int] = None) -> List[Tuple[LabelQuery, Union[int, None]]]:
+        # estimate how many keys survive each query on its own.  the positive queries (in/exists) go first, the most
+        # selective of them first since it shrinks the candidates the most, the negative ones (notin/doesnotexist) go
+        # last since they can only ever remove keys from what is left.  the remaining fields just break ties so the
+        # plan doesn't depend on the order the queries happen to come out of the set.
+        start_size = self._start_size()
+        planned = []
+        for query in self._queries:
+            estimate = None
+            if posting_size:
+                found_size = min(sum(posting_size(search_key) for search_key in _search_keys(query)), start_size)
+                estimate = found_size if query.operator in POSITIVE_OPERATORS else start_size - found_size
+
+            planned.append((query, estimate))
+
+        return sorted(planned, key=lambda p: (
+            p[0].operator not in POSITIVE_OPERATORS, p[1] or 0, p[0].key, p[0].operator.value, repr(p[0].values)
+        ))
+
+
+def _postings_mode(postings: Union[Dict[Tuple, Set], BitsetIndex]) -> str:
+    return INDEX_BITSET if isinstance(postings, BitsetIndex) else INDEX_SET
+
+
+def _search_keys(query: LabelQuery) -> Iterable[Tuple]:
+    # the index keys a query has to look at, (<label>, <value>) for in and notin, (<label>,) for exists and
+    # doesnotexist
+    if query.operator in (Operator.In, Operator.NotIn):
+        return [(query.key, value) for value in query.values]
+
+    return [(query.key,)]
+
+
+def _row_matches(labels: Dict, query: LabelQuery) -> bool:
+    if query.operator == Operator.In:
+        return query.key in labels and labels[query.key] in query.values
+
+    if query.operator == Operator.NotIn:
+        return not (query.key in labels and labels[query.key] in query.values)
+
+    if query.operator == Operator.Exists:
+        return query.key in labels
+
+    return query.key not in labels
+
+
+def build_label_index(source: Mapping[str, Any], sub_key: str = None,
+                      index_mode: str = INDEX_SET) -> Union[Dict[Tuple, Set], BitsetIndex]:
+    if index_mode == INDEX_BITSET:
+        return build_bitset_index(source, sub_key)
+
+    label_index = defaultdict(set)
+
+    # note the reverse index here isn't super kind to memory, in fact it's pretty verbose.  the trade-off here
+    # is that it should be kinder in the long run to CPU.  the reverse index allows dictionary matches which are
+    # implemented in C (ok, duck typing could make that not the case, i.e. someone passes in a Dict-like object
+    # that sub-classes UserDict where the C optimizations aren't present, but i have to draw the line somewhere)
+    # re-thought if memory becomes an issue (right now it isn't), but it this makes the subsequent query code
+    # *WAY* more simple
+    for k, v in source.items():
+        # allows the user to specify a sub key, or just use the dict by itself
+        l_source = v.get(sub_key, {}) if sub_key else v
+        for l_k, l_value in l_source.items():
+            # facilitate exists and doesnotexist lookups
+            label_index[(l_k,)].add(k)
+            # facilitate in and not in lookups
+            label_index[(l_k, l_value)].add(k)
+
+    return label_index
+
 
 def new_query(key: str, operator: Operator, values: Iterable = None) -> LabelQuery:
     return LabelQuery(
@@ -134,29 +434,12 @@ def query_from_object(obj_query: Dict) -> LabelQuery:
 
 
 def query_from_string(str_query: str) -> LabelQuery:
-    # not equal
-    if '!=' in str_query:
-        key, value = str_query.split('!=', 2)
-        return new_query(key, Operator.NotIn, [value])
-
-    # equal
-    if '=' in str_query:
-        key, value = str_query.split('=', 2)
-        return new_query(key, Operator.In, [value])
-
-    # in
-    if ' in (' in str_query:
-        key, values = str_query.rstrip(')').split(' in (', 2)
-        return new_query(key.strip(), Operator.In, [v.strip() for v in values.split(',')])
-
-    # not in
-    if ' notin (' in str_query:
-        key, values = str_query.rstrip(')').split(' notin (', 2)
-        return new_query(key, Operator.NotIn, [v.strip() for v in values.split(',')])
-
-    # not exists
-    if str_query.startswith('!'):
-        return new_query(str_query[1:], Operator.DoesNotExist)
-
-    # exists
-    return new_query(str_query, Operator.Exists)
+    # a single requirement of the selector grammar (see the selectors module), anything that takes more than one query
+    # to answer (a comma or an or) has to go through compile_selector and match_selectors instead
+    from deploy_pipeline.labels.selectors import compile_selector, SelectorException
+
+    groups = compile_selector(str_query).groups
+    if len(groups) != 1 or len(groups[0]) != 1:
+        raise SelectorException(f"Expected a Single Label Query: {str_query}")
+
+    return groups[0][0]
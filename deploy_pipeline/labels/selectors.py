@@ -0,0 +1,184 @@
+import re
+from functools import lru_cache
+from itertools import product
+from typing import Iterable, List, NamedTuple, Set, Tuple, Union
+from deploy_pipeline.labels.matching import new_query, LabelIndex, LabelQuery, Operator
+
+# a selector is the kubernetes label selector syntax with or groups and parentheses on top:
+#
+#   expression  := conjunction ('||' conjunction)*
+#   conjunction := term ((',' | '&&') term)*
+#   term        := '(' expression ')' | requirement
+#   requirement := '!' key | key | key ('=' | '==' | '!=') value | key ('in' | 'notin') '(' value (',' value)* ')'
+#
+# i.e. "env in (prod, canary), !pogo.test.data || region=se3".  a selector is compiled down to a plan that ORs groups
+# of LabelQuerys which are ANDed together, the same queries LabelMatch has always run, so every group runs against the
+# index posting lists exactly like a job's selectors do.  the plan is a plain (sorted) tuple of tuples, immutable and
+# hashable, and it always comes out the same for the same selector no matter the order its clauses were written in.
+Selector = NamedTuple('Selector', (
+    ('groups', Tuple[Tuple[LabelQuery, ...], ...]),
+))
+
+# number of compiled selectors kept around, the same handful of selectors is compiled over and over (every stage, every
+# request to the service) so this is really just a ceiling
+SELECTOR_CACHE_SIZE = 4096
+
+_TOKENS = re.compile(r'\s*(?:(\|\||&&|!=|==|[=!(),])|([^\s()!=,|&]+))')
+
+
+@lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def compile_selector(source: str) -> Selector:
+    parser = _Parser(source)
+    groups = parser.expression()
+    if parser.peek() is not None:
+        raise SelectorSyntaxException(f"Unexpected '{parser.peek()}' in Selector: {source}")
+
+    return _selector(groups)
+
+
+def selector_from_queries(queries: Iterable[LabelQuery]) -> Selector:
+    return _selector([list(queries)])
+
+
+def combine_selectors(selectors: Iterable[Union[Selector, LabelQuery]]) -> Selector:
+    # ANDs selectors (and plain queries) together, every group of one with every group of the others
+    groups = [[]]
+    for selector in selectors:
+        selector_groups = selector.groups if isinstance(selector, Selector) else ((selector,),)
+        groups = [group + list(selector_group) for group, selector_group in product(groups, selector_groups)]
+
+    return _selector(groups)
+
+
+def match_selectors(label_index: LabelIndex, selectors: Iterable[Union[Selector, LabelQuery]],
+                    candidates: Union[Iterable, int] = None) -> Set:
+    # a single group (no || anywhere) is a plain LabelMatch, just like it always was.  otherwise each group is matched
+    # on its own and the matches are put together.
+    groups = combine_selectors(selectors).groups
+    if len(groups) == 1:
+        return label_index.match(candidates).add_queries(groups[0]).do()
+
+    matched_keys = set()
+    for group in groups:
+        matched_keys |= label_index.match(candidates).add_queries(group).do()
+
+    return matched_keys
+
+
+def _selector(groups: Iterable[Iterable[LabelQuery]]) -> Selector:
+    # the same query twice in a group, or the same group twice, doesn't change what matches
+    return Selector(tuple(sorted({tuple(sorted(set(group), key=_query_order)) for group in groups}, key=lambda g: [
+        _query_order(query) for query in g
+    ])))
+
+
+def _query_order(query: LabelQuery) -> Tuple:
+    return query.key, query.operator.value, repr(query.values)
+
+
+# a recursive descent parser over the grammar above, each rule hands back the groups (lists of queries ANDed
+# together) that are ORed together.  an AND of ORs is multiplied out into an OR of ANDs as it goes.
+class _Parser:
+    _source: str
+    _tokens: List[Tuple[bool, str]]
+    _position: int
+
+    def __init__(self, source: str):
+        self._source = source
+        self._position = 0
+
+        # (is a label, text) for every token
+        self._tokens = []
+        position = 0
+        source = source.rstrip()
+        while position < len(source):
+            token = _TOKENS.match(source, position)
+            if not token:
+                raise SelectorSyntaxException(f"Invalid Selector: {self._source}")
+
+            self._tokens.append((token.group(2) is not None, token.group(1) or token.group(2)))
+            position = token.end()
+
+    def peek(self) -> Union[str, None]:
+        return self._tokens[self._position][1] if self._position < len(self._tokens) else None
+
+    def take(self, expected: str = None) -> str:
+        token = self.peek()
+        if token is None or (expected and token != expected):
+            raise SelectorSyntaxException(
+                f"Expected '{expected or 'label'}' but {'found ' + repr(token) if token else 'reached the end'} in "
+                f"Selector: {self._source}"
+            )
+
+        self._position += 1
+        return token
+
+    def expression(self) -> List[List[LabelQuery]]:
+        groups = self.conjunction()
+        while self.peek() == '||':
+            self.take()
+            groups = groups + self.conjunction()
+
+        return groups
+
+    def conjunction(self) -> List[List[LabelQuery]]:
+        groups = self.term()
+        while self.peek() in (',', '&&'):
+            self.take()
+            groups = [group + term_group for group, term_group in product(groups, self.term())]
+
+        return groups
+
+    def term(self) -> List[List[LabelQuery]]:
+        if self.peek() == '(':
+            self.take()
+            groups = self.expression()
+            self.take(')')
+            return groups
+
+        return [[self.requirement()]]
+
+    def requirement(self) -> LabelQuery:
+        if self.peek() == '!':
+            self.take()
+            return new_query(self.label(), Operator.DoesNotExist)
+
+        key = self.label()
+        operator = self.peek()
+        if operator in ('=', '=='):
+            self.take()
+            return new_query(key, Operator.In, [self.label()])
+
+        if operator == '!=':
+            self.take()
+            return new_query(key, Operator.NotIn, [self.label()])
+
+        if operator in ('in', 'notin'):
+            self.take()
+            return new_query(key, Operator.In if operator == 'in' else Operator.NotIn, self.values())
+
+        return new_query(key, Operator.Exists)
+
+    def values(self) -> List[str]:
+        self.take('(')
+        values = [self.label()]
+        while self.peek() == ',':
+            self.take()
+            values.append(self.label())
+
+        self.take(')')
+        return values
+
+    def label(self) -> str:
+        if self._position < len(self._tokens) and not self._tokens[self._position][0]:
+            raise SelectorSyntaxException(f"Expected a Label but found '{self.peek()}' in Selector: {self._source}")
+
+        return self.take()
+
+
+class SelectorException(Exception):
+    pass
+
+
+class SelectorSyntaxException(SelectorException):
+    pass
@@ -1,7 +1,40 @@
-from typing import Dict, Set
+from collections.abc import Mapping, Set as AbstractSet
+from typing import Any, Dict, Iterable, Iterator
 
 
-# might want to investigate how to do this as a generator, that way we don't take the memory penalty when all we want
-# is access to the labels
-def with_data(matched_keys: Set, source_data: Dict) -> Dict:
-    return {matched_key: source_data[matched_key] for matched_key in matched_keys}
+# a read-only window onto part of a dict: the keys that are in the window plus a reference to the backing dict.  this
+# is what with_data hands back now, narrowing a big inventory down to the matched hosts used to copy every matched entry
+# into a brand new dict (and main does that a few times over), now it only costs the key set.
+#
+# like a dict view it is live, the key set and the backing dict are referenced rather than copied, so neither should be
+# changed while the view is in use.
+class DataView(Mapping):
+    __slots__ = ('_keys', '_data')
+
+    def __init__(self, keys: Iterable, data: Dict):
+        # anything set like (sets, dict keys) is used as is, anything else has to be turned into a set to get o(1)
+        # membership checks
+        self._keys = keys if isinstance(keys, AbstractSet) else set(keys)
+        self._data = data
+
+    def __getitem__(self, key) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+
+        return self._data[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+def with_data(matched_keys: Iterable, source_data: Dict) -> DataView:
+    return DataView(matched_keys, source_data)
@@ -0,0 +1,88 @@
+import logging as log
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import IO, Iterable
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+# the stock QueueHandler formats the message before queueing the record, which is exactly the work we're trying to get
+# off the render path.  the records never leave the process so they can be queued as is and formatted by the listener.
+class DeferredQueueHandler(QueueHandler):
+    listener: 'BufferedQueueListener'
+
+    def __init__(self, log_queue: queue.SimpleQueue, listener: 'BufferedQueueListener'):
+        super().__init__(log_queue)
+        # the listener writing out this handler's queue, it is stopped along with the handler being replaced
+        self.listener = listener
+
+    def prepare(self, record: log.LogRecord) -> log.LogRecord:
+        return record
+
+
+# writes the records out on its own thread, only flushing the stream once it has caught up with the queue rather than
+# after every single line
+class BufferedQueueListener(QueueListener):
+    def handle(self, record: log.LogRecord):
+        super().handle(record)
+
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+    # writes out anything still queued.  a listener can be stopped twice (replaced by another start_logging and then
+    # stopped by whoever started it), only the first one does anything.
+    def stop(self):
+        if self._thread is None:
+            return
+
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+class _StreamHandler(log.StreamHandler):
+    # flushing is left to the listener
+    def emit(self, record: log.LogRecord):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+def start_logging(logger: log.Logger, level: str, log_format: str, stream: IO = None) -> BufferedQueueListener:
+    handler = _StreamHandler(stream or sys.stdout)
+    handler.setFormatter(log.Formatter(log_format))
+
+    log_queue = queue.SimpleQueue()
+    listener = BufferedQueueListener(log_queue, handler)
+
+    # swap out whatever a previous call attached, otherwise every line would show up once per call.  its listener has
+    # nothing left to write out once the handler is gone.
+    for previous in [h for h in logger.handlers if isinstance(h, DeferredQueueHandler)]:
+        logger.removeHandler(previous)
+        previous.listener.stop()
+
+    logger.addHandler(DeferredQueueHandler(log_queue, listener))
+    logger.setLevel(level)
+
+    listener.start()
+    return listener
+
+
+def stop_logging(logger: log.Logger, listener: BufferedQueueListener):
+    listener.stop()
+
+    for previous in [h for h in logger.handlers if isinstance(h, DeferredQueueHandler) and h.listener is listener]:
+        logger.removeHandler(previous)
+
+
+# joins the values only if the line actually gets written
+class LazyJoin:
+    def __init__(self, values: Iterable, separator: str = ', '):
+        self._values = values
+        self._separator = separator
+
+    def __str__(self) -> str:
+        return self._separator.join(str(v) for v in self._values)
@@ -2,18 +2,22 @@ import argparse
 import logging as log
 import os
 import sys
-import yaml
 from itertools import chain
+from typing import TYPE_CHECKING, Callable, Dict, IO, Iterable, List, NamedTuple, Union
 from deploy_pipeline import __cli_name__
-import deploy_pipeline.vars.parsers as varp
-from deploy_pipeline.labels.matching import query_from_string, query_from_object, new_query, Operator, LabelMatch
-from deploy_pipeline.labels.utils import with_data
-from deploy_pipeline.labels.joining import LabelJoin
-from deploy_pipeline.labels.grouping import LabelGroup
-from deploy_pipeline.pipeline.config import validate_pipeline
-from deploy_pipeline.pipeline.pipeline import load_pipeline_from_config, Stage
-from deploy_pipeline.pipeline.templates import get_template
-
+import deploy_pipeline.metrics.metrics as metrics
+from deploy_pipeline.logs import start_logging, stop_logging, LazyJoin, LOG_LEVELS
+from deploy_pipeline.labels.indexing import INDEX_SET, INDEX_MODES
+
+# the generator runs in a whole lot of short lived ci jobs, so the startup cost adds up.  only what the argument parsing
+# needs is imported up front, everything else (yaml, jinja, the label and pipeline modules) is imported by the code
+# path that uses it, which means --help and a bad argument don't pay for any of it.  see benchmarks/startup.py for the
+# budget the tests hold this to.
+if TYPE_CHECKING:
+    from deploy_pipeline.inventory.cache import InventoryCache
+    from deploy_pipeline.labels.matching import LabelIndex
+    from deploy_pipeline.pipeline.render import RenderedStageJob
+    from deploy_pipeline.pipeline.templates import TemplateRegistry
 
 CLI_NAME = __cli_name__
 logger = log.getLogger(CLI_NAME)
@@ -25,75 +29,159 @@ DEFAULT_CONFIG = {
 }
 
 
-def deploy_pipeline(args: dict) -> int:
-    # config shim
-    config = DEFAULT_CONFIG
-
-    # init the logger
-    logger.setLevel(config['global']['general']['log_level'])
-
-    # stdout log handler
-    handler = log.StreamHandler(sys.stdout)
-    handler.setFormatter(log.Formatter(config['global']['general']['log_format']))
-
-    # attach stdout handler
-    logger.addHandler(handler)
-
-    logger.info(f"Starting {CLI_NAME}")
+# the parsed config along with the label indexes over its hosts and packages
+Inventory = NamedTuple('Inventory', (
+    ('config', Dict),
+    ('host_index', 'LabelIndex'),
+    ('package_index', 'LabelIndex')
+))
+
+
+def load_inventory(config_files: List[str], inventory_cache: Union['InventoryCache', None], workers: int,
+                   index_mode: str) -> Inventory:
+    import copy
+    from deploy_pipeline.inventory.compiled import is_compiled_inventory, open_inventory, CompiledInventoryException
+    from deploy_pipeline.inventory.loader import load_config
+    from deploy_pipeline.labels.caching import MATCH_CACHE
+    from deploy_pipeline.labels.matching import LabelIndex
+
+    # config shim, every load gets its own copy.  the defaults used to be loaded into (and the hosts and packages
+    # left behind in) the module level DEFAULT_CONFIG, which falls apart as soon as there is more than one run per
+    # process (see service.py).
+    config = copy.deepcopy(DEFAULT_CONFIG)
+
+    # a compiled inventory (see deploy-pipeline compile-inventory) is mapped into memory rather than parsed, and its
+    # label indexes come precompiled along with it.  it already is the whole inventory, there is nothing to merge it
+    # with.
+    if any(is_compiled_inventory(config_file) for config_file in config_files):
+        if len(config_files) != 1:
+            raise CompiledInventoryException("A Compiled Inventory Can't Be Merged With Other Config Files")
+
+        with metrics.span('config.load'):
+            compiled = open_inventory(config_files[0])
+
+        config.update(hosts=compiled.hosts, packages=compiled.packages)
+        return Inventory(
+            config,
+            LabelIndex(compiled.hosts, 'labels', index_mode, compiled.hosts.postings(index_mode), MATCH_CACHE),
+            LabelIndex(compiled.packages, 'labels', index_mode, compiled.packages.postings(index_mode), MATCH_CACHE)
+        )
+
+    with metrics.span('config.load'):
+        load_config(config_files, inventory_cache, workers, config)
+
+    # the label indexes over every host and package are built once and shared by every query for the rest of the run.
+    # the inventory cache hangs on to them between runs, so they only get rebuilt when the inventory actually changes.
+    # jobs tend to share selectors, so the match results are remembered too.
+    host_index = LabelIndex(config['hosts'], 'labels', index_mode, inventory_cache.label_index(
+        config_files, 'hosts', config['hosts'], 'labels', index_mode
+    ) if inventory_cache else None, MATCH_CACHE)
+    package_index = LabelIndex(config['packages'], 'labels', index_mode, inventory_cache.label_index(
+        config_files, 'packages', config['packages'], 'labels', index_mode
+    ) if inventory_cache else None, MATCH_CACHE)
+
+    return Inventory(config, host_index, package_index)
+
+
+# the inventory loader and the template registry can be handed in by something that keeps them around between runs
+# (see service.py), the same goes for where the pipeline ends up when it isn't written to a file
+def deploy_pipeline(args: dict, inventory_loader: Callable[..., Inventory] = load_inventory,
+                    templates: 'TemplateRegistry' = None, stream: IO = None) -> int:
+    # see the note with the imports at the top of the module
+    import deploy_pipeline.vars.parsers as varp
+    import deploy_pipeline.vars.scopes as vscopes
+    from deploy_pipeline.inventory.cache import InventoryCache
+    from deploy_pipeline.inventory.loader import expand_config_paths, load_files, load_yaml_file
+    from deploy_pipeline.labels.matching import new_query, Operator
+    from deploy_pipeline.labels.selectors import compile_selector, match_selectors, SelectorException
+    from deploy_pipeline.labels.utils import with_data
+    from deploy_pipeline.labels.joining import LabelJoin
+    from deploy_pipeline.labels.grouping import LabelGroup
+    from deploy_pipeline.pipeline.config import validate_pipeline
+    from deploy_pipeline.pipeline.pipeline import load_pipeline_from_config, Stage
+    from deploy_pipeline.pipeline.templates import TemplateRegistry
+    from deploy_pipeline.pipeline.output import strip_chunks, write_chunks
+    from deploy_pipeline.pipeline.fragments import FragmentCache
+    from deploy_pipeline.pipeline.plan import select_jobs, plan_stage_jobs
+    from deploy_pipeline.pipeline.render import render_stage_jobs
+    from deploy_pipeline.pipeline.compact import compact_jobs
+    from deploy_pipeline.pipeline.shards import split_shards, write_shards, render_parent, ShardException
+
+    # the logger itself is setup by main, everything in here is logged %-style so nothing is formatted unless the line
+    # is actually going to be written
+    logger.info("Starting %s", CLI_NAME)
     # echo out the arguments, cause its SUPER hard to find the provided args in gitlab pipelines
     for arg_k, arg_v in args.items():
-        logger.debug(f"Captured Argument '{arg_k}': {arg_v}")
+        logger.debug("Captured Argument '%s': %s", arg_k, arg_v)
 
     # suck the deploy configs into the config dict
     logger.info("Parsing Additional Config")
-    for config_f in args.get('config', []):
-        with open(config_f) as f:
-            config.update(yaml.safe_load(f))
+    # config files can be sharded across several files (or a directory of them), the hosts and packages from each of
+    # them are merged together.  parsing is spread across the worker processes.
+    workers = args.get('jobs') or 1
+    config_files = expand_config_paths(args.get('config', []))
+    inventory_cache = InventoryCache(args['cache_dir']) if args.get('cache_dir') else None
+    for config_f in config_files:
+        logger.debug("Parsing Config File: %s", config_f)
+
+    config, host_index, package_index = inventory_loader(
+        config_files, inventory_cache, workers, args.get('index_mode') or INDEX_SET
+    )
     logger.debug("Completed Parsing Additional Config")
 
     # suck in the variables
-    # going full steam ahead on a functional paradigm apparently, i wouldn't think the number of variables parsed
-    # would be an issue for all the merging but time will tell.
-    logger.info(f"Parsing Input Variables")
-    variables = {}
-    # files first
-    for var_file in args['var_files']:
-        variables = varp.with_var_file(var_file, variables)
-
-    # then cli vars
-    for var in args['vars']:
-        variables = varp.with_var(var, variables)
-
-    # then environment vars
-    for env_var in (k for k in os.environ if k.startswith(varp.ENV_VAR_PREFIX)):
-        variables = varp.with_env_var(env_var, variables)
-
-    logger.info(f"Parsing Pipeline File: {args['pipeline']}")
+    # each kind of variable source is its own layer, stacked so that environment vars beat cli vars which beat var
+    # files.  the var files are read through the same worker pool as the config files.
+    logger.info("Parsing Input Variables")
+    with metrics.span('variables.parse'):
+        variables = vscopes.variable_scope(
+            load_files(args['var_files'], varp.load_var_file, workers),
+            args['vars'],
+            (k for k in os.environ if k.startswith(varp.ENV_VAR_PREFIX))
+        )
+
+    logger.info("Parsing Pipeline File: %s", args['pipeline'])
 
     # read and validate our pipeline config file
-    with open(args['pipeline']) as f:
-        pipeline_config = validate_pipeline(yaml.safe_load(f))
+    with metrics.span('pipeline.validate'):
+        pipeline_config = validate_pipeline(load_yaml_file(args['pipeline']))
+
+    # compile every template the pipeline references up front, a typo in a job template should fail the run before
+    # we spend any time matching labels.  the registry hangs on to the compiled templates for the rest of the run.
+    logger.info("Compiling Pipeline Templates")
+    templates = (templates or TemplateRegistry(args.get('template_cache_dir'))).load_templates(chain(
+        [pipeline_config['template']],
+        [job_v['template'] for job_v in pipeline_config['jobs'].values()]
+    ))
 
     # attempt at the single responsibility principle.  this makes the pipeline loader responsible for parsing out
     # the pipeline yaml into the pipeline object (a little factory).  this frees the pipeline object from having to
     # maintain any knowledge of the pipeline yaml.
     pipeline = load_pipeline_from_config(pipeline_config)
 
+    # the command line selectors are compiled before anything is matched, so a typo ends the run with a message rather
+    # than a stack trace
+    try:
+        cli_host_selectors = [compile_selector(hq_arg) for hq_arg in args['host_selector']]
+        cli_package_selectors = [compile_selector(pq_arg) for pq_arg in args['package_selector']]
+    except SelectorException as e:
+        logger.error("%s", e)
+        return 1
+
     # do any initial host queries
     host_queries = filter(None, chain(
         # take advantage of the fact that currently "host_order_label" is required in the pipeline yaml
         # to make sure we don't completely bork an environment by doing *everything* at once, it just so happens
-        # that host-order-label is simply an exists query of the host labels.
-        [query_from_string(pipeline_config['host_order_label'])],
-        # add in any pipeline level host queries
-        [query_from_object(hq_pipe) for hq_pipe in pipeline_config.get('selectors', {}).get('host', [])],
+        # that host-order-label is simply an exists query of the host labels.  it is a label name, not a selector, so
+        # the query is built as is rather than parsed (a name with i.e. a comma in it would be taken apart).
+        [new_query(pipeline_config['host_order_label'], Operator.Exists)],
+        # add in any pipeline level host queries (already parsed by the validator)
+        pipeline_config['selectors']['host'],
         # add in any queries supplied at the command line
-        [query_from_string(hq_arg) for hq_arg in args['host_selector']]
+        cli_host_selectors
     ))
 
-    host_query = LabelMatch(config['hosts'], 'labels')
-    host_query.add_queries(host_queries)
-    matched_hosts = with_data(host_query.do(), config['hosts'])
+    matched_hosts = with_data(match_selectors(host_index, host_queries), config['hosts'])
     if not matched_hosts:
         logger.error("No Host(s) Matching Label Query")
         return 1
@@ -101,14 +189,12 @@ def deploy_pipeline(args: dict) -> int:
     # do any initial package queries
     package_queries = filter(None, chain(
         # filer anything passed in via the command line
-        [query_from_string(q) for q in args['package_selector']],
-        # filter out any pipeline level package queries
-        [query_from_object(pq_pipe) for pq_pipe in pipeline_config.get('selectors', {}).get('package', [])]
+        cli_package_selectors,
+        # filter out any pipeline level package queries (already parsed by the validator)
+        pipeline_config['selectors']['package']
     ))
 
-    package_query = LabelMatch(config['packages'], 'labels')
-    package_query.add_queries(package_queries)
-    matched_packages = package_query.do()
+    matched_packages = match_selectors(package_index, package_queries)
     if not matched_packages:
         logger.error("No Package(s) Matched Label Query")
         return 1
@@ -117,11 +203,13 @@ def deploy_pipeline(args: dict) -> int:
     # but the compartmentalized functions seem to work for now.
     host_packages = LabelJoin(matched_hosts, 'packages').match(matched_packages)
 
-    # groups joined hosts and packages by the specified label. sigh, I'm using were using a bunch of with_data which
-    # is just a thin wrapper around a dict comprehension, this could lead to performance issues if I am not careful
+    # groups joined hosts and packages by the specified label.  with_data is just a view over the host dict these days,
+    # so narrowing the hosts down to the joined ones doesn't copy anything, and the groups come straight out of the
+    # host index rather than another pass over the hosts
     host_order = LabelGroup(
         with_data(host_packages.keys(), config['hosts']),
-        "labels"
+        "labels",
+        host_index
     ).group(pipeline_config['host_order_label'])
     if not host_order:
         logger.error("Unable to Determine Group(s)")
@@ -130,90 +218,165 @@ def deploy_pipeline(args: dict) -> int:
     job_stages = Stage(pipeline, host_order.keys())
 
     # attempting to avoid useless layers of abstraction by leaving the pipeline vars a plain old dict
-    pipeline_template = get_template(pipeline.template)
+    pipeline_template = templates.get_template(pipeline.template)
     pipeline_template_vars = {
         'stages': [],
         'includes': pipeline_config.get('includes', []),
         'jobs': [],
-        'vars': variables,
+        'vars': vscopes.resolve_scope(variables),
     }
 
     # put here for logging purposes, otherwise we could just use a list comprehension in the template variables
     for s in job_stages.get_stages():
-        logger.info(f'Processing Stage: {s}')
+        logger.info('Processing Stage: %s', s)
         pipeline_template_vars['stages'].append(s)
 
-    # provide fully hydrated dicts to allow per stage lookups
-    matched_hosts = with_data(host_packages.keys(), config['hosts'])
-    matched_packages = with_data({p for pg in host_packages.values() for p in pg}, config['packages'])
-
-    for stage, phase_name, stage_name, job in job_stages.get_stage_jobs():
-        logger.info(f'Processing Stage: {stage_name} - Job: {job.name}')
-
-        # load the template associated with this stage
-        stage_template = get_template(job.template)
-
-        # at this point we have probably narrowed down the list of hosts and packages we are going to install to,
-        # however we need to take it a step further.  by default the job query
-        # each job provides the ability to add host and package selectors
-        # of their own to be able to include (or exclude) hosts and packages at that particular phase.
-        matched_stage_hosts = LabelMatch(matched_hosts, 'labels').add_queries(chain(
-            [new_query(pipeline_config['host_order_label'], Operator.In, [stage])],
-            [query_from_object(hq) for hq in job.host_selectors]
-        )).do()
-
-        if not matched_stage_hosts:
-            logger.info(f'No Matched Hosts for {stage_name}: {job.name}')
-
-        # narrow the scope to only the packages included in this phase
-        matched_stage_packages = LabelMatch(matched_packages, 'labels').add_queries([
-            query_from_object(pq) for pq in job.package_selectors
-        ]).do()
-
-        if not matched_stage_packages:
-            logger.info(f'No Matched Packages for {stage_name}: {job.name}')
-
-        # join the packages and hosts to ensure we only get supported host/package combinations
-        #
-        # doing the queries separately cuts down on the complexity of the query system in general (not having to
-        # worry about joining things and taking a union), but in a way it cuts down on testability.  we can (and should)
-        # test the individual components, but any extension of this system needs to take into account that you *MUST*
-        # join hosts and packages to do anything useful with them.
-        stage_hosts_packages = LabelJoin(
-            with_data(matched_stage_hosts, matched_hosts), 'packages'
-        ).match(matched_stage_packages)
-
-        for hostname, packages in stage_hosts_packages.items():
-            logger.info(f'Rendering Job Template for {hostname}: {", ".join(packages)}')
-
-            # setup the variables that will be shared with the template, for right now these are all of the variables
-            # that *any* job would need. i am explicitly providing key/value pairs here for the most part so the
-            # underlying jinja templates don't need to change if the domain object signature changes.  heh, this shows
-            # how much faith i have in the initial design.
-            pipeline_template_vars['jobs'].append(stage_template.render({
-                "stagename": stage_name,
-                "jobname": job.name,
-                "hostname": hostname,
-                "packages": sorted(packages),
-                "vars": {**variables, **job.variables}
-            }))
+    # the job queries only ever look at the hosts and packages that survived the join, restrict them to those rather
+    # than building a new index over them
+    host_candidates = host_index.restrict(host_packages.keys())
+    package_candidates = package_index.restrict({p for pg in host_packages.values() for p in pg})
+
+    # plan the work up front: the job selectors don't depend on the stage, so they are run once per job.  each
+    # (stage, job) is then just the intersection of the job's selection, the stage's host order group and the global
+    # host/package join.
+    job_selections = select_jobs(pipeline.get_jobs(), host_index, package_index, host_candidates, package_candidates)
+    stage_job_plans = plan_stage_jobs(job_stages.get_stage_jobs(), job_selections, host_order, host_packages)
+
+    # with a cache dir, every (stage, job) is fingerprinted and the fragments rendered by previous runs are reused.  if
+    # the fingerprints (and the pipeline template and its variables) are all the same as a previous run, its output is
+    # written out as is.
+    fragment_cache = FragmentCache(inventory_cache) if inventory_cache else None
+    compact = bool(args.get('compact'))
+
+    # sharded output: the stages are split across several child pipeline files and the output gets a parent pipeline
+    # that triggers them in order.  the shards are rendered by the worker processes, a shard per worker.
+    if args.get('shard_dir'):
+        try:
+            shards = split_shards(
+                job_stages.get_stage_groups(), stage_job_plans, args['shard_dir'], args.get('shard_stages')
+            )
+        except ShardException as e:
+            logger.error("%s", e)
+            return 1
+
+        os.makedirs(args['shard_dir'], exist_ok=True)
+
+        for written_shard in write_shards(
+                shards, templates, pipeline.template, pipeline_template_vars, variables, workers, fragment_cache,
+                compact
+        ):
+            logger.info(
+                'Wrote Child Pipeline File: %s (%d Stage(s), %d Job(s))',
+                written_shard.path, written_shard.stage_count, written_shard.job_count
+            )
+            metrics.count('output.bytes', written_shard.written)
+            metrics.count('render.fragments', written_shard.job_count)
+
+        if args['output']:
+            logger.info('Writing Parent Pipeline File: %s', args['output'])
+
+        parent_pipeline = render_parent(shards, args.get('trigger_job'))
+        with metrics.span('write'):
+            metrics.count('output.bytes', write_chunks([parent_pipeline], args['output'], stream))
+
+        return 0
+
+    output_key = None
+    if fragment_cache:
+        stage_job_plans = list(stage_job_plans)
+        output_key = fragment_cache.output_key(
+            pipeline.template, pipeline_template_vars, stage_job_plans, variables, {'compact': compact}
+        )
+
+        if (cached_output := fragment_cache.output(output_key)) is not None:
+            logger.info('No Changes Detected, Using Previously Rendered Pipeline')
+            if args['output']:
+                logger.info('Writing Pipeline File: %s', args['output'])
+
+            with metrics.span('write'):
+                metrics.count('output.bytes', write_chunks(cached_output, args['output'], stream))
+
+            return 0
+
+    # the jobs are rendered lazily, one fragment at a time as the pipeline template asks for them.  when streaming the
+    # fragments go straight out the door and are never held in memory all at once.
+    #
+    # a line per (stage, job) and another per host adds up quick with a big inventory.  in summary mode only the totals
+    # for each stage are logged, once everything has been rendered.
+    log_summary = args.get('log_summary')
+    log_hosts = not log_summary and logger.isEnabledFor(log.INFO)
+
+    def render_results() -> Iterable['RenderedStageJob']:
+        # stage name -> [jobs, jobs without hosts, rendered host jobs, packages]
+        stage_summaries = {}
+        for result in render_stage_jobs(
+                stage_job_plans, templates, variables, workers=workers, fragment_cache=fragment_cache
+        ):
+            metrics.count('render.fragments', len(result.rendered))
+
+            if log_summary:
+                stage_summary = stage_summaries.setdefault(result.stage_name, [0, 0, 0, 0])
+                stage_summary[0] += 1
+                stage_summary[1] += 0 if result.host_count else 1
+                stage_summary[2] += len(result.rendered)
+                stage_summary[3] += sum(len(packages) for _, packages, _ in result.rendered)
+
+                yield result
+                continue
+
+            logger.info('Processing Stage: %s - Job: %s', result.stage_name, result.job.name)
+
+            if not result.host_count:
+                logger.info('No Matched Hosts for %s: %s', result.stage_name, result.job.name)
+
+            if not result.package_count:
+                logger.info('No Matched Packages for %s: %s', result.stage_name, result.job.name)
+
+            if log_hosts:
+                for hostname, packages, _ in result.rendered:
+                    logger.info('Rendering Job Template for %s: %s', hostname, LazyJoin(packages))
+
+            yield result
+
+        for stage_name, (jobs, empty_jobs, host_jobs, packages) in stage_summaries.items():
+            logger.info(
+                'Stage %s: %d Job(s), %d Without Matched Hosts, %d Host Job(s) Rendered, %d Package(s)',
+                stage_name, jobs, empty_jobs, host_jobs, packages
+            )
+
+    # compacting needs every fragment of a job before it can pull out what they have in common, so a compacted
+    # pipeline is never streamed job by job
+    def render_jobs() -> Iterable[str]:
+        if compact:
+            return compact_jobs(render_results())
+
+        return (rendered_job for result in render_results() for _, _, rendered_job in result.rendered)
 
     # write to a file if specified, otherwise go ahead and dump it to stdout
-    rendered_pipeline = pipeline_template.render(pipeline_template_vars).strip()
-    if args['output']:
-        logger.info(f'Writing Pipeline File: {args["output"]}')
-        with open(args['output'], 'w') as f:
-            f.write(rendered_pipeline)
+    if args.get('stream'):
+        # note that the pipeline template only gets a single pass over the jobs when streaming, so templates that need
+        # the job count (i.e. jobs|length) can't be streamed
+        pipeline_template_vars['jobs'] = render_jobs()
+        rendered_pipeline = strip_chunks(pipeline_template.generate(pipeline_template_vars))
     else:
-        print(rendered_pipeline)
+        pipeline_template_vars['jobs'] = list(render_jobs())
+        rendered_pipeline = [pipeline_template.render(pipeline_template_vars).strip()]
 
-    return 0
+    if fragment_cache:
+        rendered_pipeline = fragment_cache.store_output(output_key, rendered_pipeline)
 
+    if args['output']:
+        logger.info('Writing Pipeline File: %s', args['output'])
 
-def main():
-    # input arguments
-    parser = argparse.ArgumentParser()
+    # when streaming this takes in the rendering as well, the jobs are only rendered as they are written out
+    with metrics.span('write'):
+        metrics.count('output.bytes', write_chunks(rendered_pipeline, args['output'], stream))
+
+    return 0
 
+
+# the arguments of a single run, shared with the service which takes the same arguments in each request
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument('--pipeline', metavar='<path to pipeline config>.yml',
                         help='path to the deployment pipeline config yaml file', required=True)
 
@@ -221,14 +384,16 @@ def main():
                         help='path to the produced gitlab ci yml file')
 
     parser.add_argument('--config', metavar='<path to host and package config>.yml',
-                        help='path to the host and package config yaml files (used for label selectors)', required=True,
+                        help='path to the host and package config yaml files or directories of them (used for label '
+                             'selectors), the hosts and packages from every file are merged.  or a single inventory '
+                             'compiled by deploy-pipeline compile-inventory', required=True,
                         nargs='+')
 
-    parser.add_argument('--host-selector', metavar="<label query>",
-                        help='initial host selector(s)',
+    parser.add_argument('--host-selector', metavar="<label selector>",
+                        help='initial host selector(s), i.e. "env in (prod, canary), !pogo.test.data || region=se3"',
                         nargs='+', default=[])
 
-    parser.add_argument('--package-selector', metavar="<label query>", help='initial package selector(s)',
+    parser.add_argument('--package-selector', metavar="<label selector>", help='initial package selector(s)',
                         nargs='+', default=[])
 
     parser.add_argument('--vars', metavar="key=value", help='variables to pass',
@@ -237,5 +402,94 @@ def main():
     parser.add_argument('--var-files', metavar="<path to var file>.json", help='path to a variable file in json format',
                         nargs='+', default=[])
 
-    args = parser.parse_args()
-    exit(int(deploy_pipeline(vars(args))))
+    parser.add_argument('--template-cache-dir', metavar='<path to cache dir>',
+                        help='directory used to cache compiled templates between runs')
+
+    parser.add_argument('--cache-dir', metavar='<path to cache dir>',
+                        help='directory used to cache the parsed host and package config between runs')
+
+    parser.add_argument('--index-mode', choices=INDEX_MODES, default=INDEX_SET,
+                        help='how the label index stores its posting lists, bitset is far more compact for large '
+                             'inventories')
+
+    parser.add_argument('--jobs', metavar='N', type=int, default=1,
+                        help='number of worker processes used to load the config files and render the stage jobs')
+
+    parser.add_argument('--stream', action='store_true',
+                        help='stream the rendered pipeline to the output as it is produced')
+
+    parser.add_argument('--compact', action='store_true',
+                        help="pull each job's shared definition out into a hidden job the rendered jobs extend, and "
+                             "collapse hosts that render the same job into a parallel matrix over the hostname")
+
+    parser.add_argument('--shard-dir', metavar='<path to dir>',
+                        help='split the pipeline into several child pipeline files written to this directory, the '
+                             'output becomes a parent pipeline that triggers them in order')
+
+    parser.add_argument('--shard-stages', metavar='N', type=int,
+                        help='put every N stages in a shard rather than a shard per host order group')
+
+    parser.add_argument('--trigger-job', metavar='<job name>',
+                        help='name of the job generating the pipeline, the parent pipeline includes the child '
+                             'pipeline files as artifacts of this job rather than files in the repository')
+
+    parser.add_argument('--metrics-out', metavar='<path to metrics file>',
+                        help='write the timings and counters recorded during the run to a file')
+
+    parser.add_argument('--metrics-format', choices=metrics.FORMATS, default=metrics.FORMAT_JSON,
+                        help='format of the metrics file, json or openmetrics text')
+
+    parser.add_argument('--profile', metavar='<path to profile>',
+                        help='profile the run with cProfile and write the stats to a file (see pstats)')
+
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default=DEFAULT_CONFIG['global']['general']['log_level'],
+                        help='only log messages at or above this level')
+
+    parser.add_argument('--log-summary', action='store_true',
+                        help='log the totals for each stage instead of a line for every rendered job')
+
+    return parser
+
+
+def main():
+    # the service takes its own arguments, anything else is a single run
+    if sys.argv[1:2] == ['serve']:
+        # imported here, the service module builds on this one
+        from deploy_pipeline.service import main as serve_main
+        exit(serve_main(sys.argv[2:]))
+
+    if sys.argv[1:2] == ['compile-inventory']:
+        from deploy_pipeline.inventory.compiled import main as compile_main
+        exit(compile_main(sys.argv[2:]))
+
+    # input arguments
+    args = vars(add_arguments(argparse.ArgumentParser()).parse_args())
+
+    # log lines are queued and written out on a separate thread so the formatting and i/o stay off the render path.
+    # that thread could write them anywhere in the middle of a pipeline going to stdout, so they go to stderr then.
+    log_listener = start_logging(logger, args['log_level'], DEFAULT_CONFIG['global']['general']['log_format'],
+                                 None if args['output'] else sys.stderr)
+
+    # the metrics (and the profile) are written out even when the run fails, that's when they are needed the most
+    profiler = None
+    if args['profile']:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    with metrics.recording() as recorded:
+        try:
+            if profiler:
+                profiler.enable()
+
+            result = deploy_pipeline(args)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args['profile'])
+
+            if args['metrics_out']:
+                recorded.write(args['metrics_out'], args['metrics_format'])
+
+            stop_logging(logger, log_listener)
+
+    exit(int(result))
@@ -0,0 +1,136 @@
+import json
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import ContextManager, Dict, Iterator, List, Union
+
+FORMAT_JSON = 'json'
+FORMAT_OPENMETRICS = 'openmetrics'
+FORMATS = (FORMAT_JSON, FORMAT_OPENMETRICS)
+
+METRIC_PREFIX = 'deploy_pipeline'
+
+
+# timing spans and counters for a single run.  spans with the same name are rolled up (count, total and max) rather
+# than kept individually, LabelMatch.do alone runs a few times per job so keeping every one of them around isn't worth
+# it.
+class Metrics:
+    spans: Dict[str, List]
+    counters: Dict[str, int]
+
+    def __init__(self):
+        # name -> [count, total seconds, max seconds]
+        self.spans = {}
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def add_span(self, name: str, seconds: float):
+        span = self.spans.setdefault(name, [0, 0.0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+        span[2] = max(span[2], seconds)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    # folds in what was recorded somewhere else, i.e. by a worker process
+    def merge(self, other: 'Metrics'):
+        for name, (count, total, longest) in other.spans.items():
+            span = self.spans.setdefault(name, [0, 0.0, 0.0])
+            span[0] += count
+            span[1] += total
+            span[2] = max(span[2], longest)
+
+        for name, value in other.counters.items():
+            self.counters[name] += value
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'spans': {
+                name: {'count': count, 'total_seconds': total, 'max_seconds': longest}
+                for name, (count, total, longest) in self.spans.items()
+            },
+            'counters': dict(self.counters),
+        }, indent=2)
+
+    def to_openmetrics(self) -> str:
+        lines = [
+            f'# TYPE {METRIC_PREFIX}_span_seconds summary',
+            f'# UNIT {METRIC_PREFIX}_span_seconds seconds',
+        ]
+        for name, (count, total, _) in self.spans.items():
+            lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {count}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {total}')
+
+        for name, value in self.counters.items():
+            metric_name = f'{METRIC_PREFIX}_{_metric_name(name)}'
+            lines.append(f'# TYPE {metric_name} counter')
+            lines.append(f'{metric_name}_total {value}')
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_path: str, output_format: str = FORMAT_JSON):
+        with open(output_path, 'w') as f:
+            f.write(self.to_openmetrics() if output_format == FORMAT_OPENMETRICS else self.to_json())
+
+
+# the metrics being recorded in the current context, if any.  instrumented code calls span/count no matter what and
+# they do next to nothing unless something is recording, so the instrumentation can stay in the hot paths.  being a
+# context variable (rather than a module global) concurrent runs in the same process each record their own.
+_current: ContextVar[Union[Metrics, None]] = ContextVar('metrics', default=None)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+@contextmanager
+def recording(metrics: Metrics = None) -> Iterator[Metrics]:
+    metrics = metrics if metrics is not None else Metrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def current() -> Union[Metrics, None]:
+    return _current.get()
+
+
+def span(name: str) -> ContextManager:
+    metrics = _current.get()
+    return _NO_SPAN if metrics is None else metrics.span(name)
+
+
+def count(name: str, value: int = 1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def merge(other: Union[Metrics, None]):
+    metrics = _current.get()
+    if metrics is not None and other is not None:
+        metrics.merge(other)
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
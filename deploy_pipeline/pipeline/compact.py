@@ -0,0 +1,289 @@
+import re
+from typing import Any, Dict, Iterable, List, Set, Tuple, Union
+import yaml
+from deploy_pipeline.pipeline.render import RenderedStageJob
+
+# libyaml when it is there, same as the loader
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# the variable the hostname is handed to the jobs of a matrix in
+MATRIX_VARIABLE = 'DEPLOY_HOSTNAME'
+
+# gitlab won't create more than this many jobs out of a single parallel: matrix
+MATRIX_LIMIT = 200
+
+# the hidden definition pulled out of a job's entries is named after the job with this in front, so it stays clear
+# of the hidden jobs the templates define themselves
+HIDDEN_PREFIX = '.compact-'
+
+# the parts of a job gitlab expands variables in, the hostname can only be swapped for the matrix variable in these.
+# the scripts are run by the shell, which doesn't expand anything in single quotes (or a quoted heredoc), so a hostname
+# in there keeps the job per host.
+_SCRIPT_KEYS = ('script', 'before_script', 'after_script')
+_EXPANDED_KEYS = _SCRIPT_KEYS + ('variables',)
+
+
+# every (stage, job, host) renders the full job template, so the output is mostly the same blocks over and over again.
+# compacting leaves the rendering alone and works on what came out of it:
+#
+# 1. whatever every rendered entry of a job has in common (i.e. the image, tags, the rules) is pulled out into a hidden
+#    .compact-<job name> definition, and each entry only keeps what is its own plus an extends of the hidden definition.
+#    extends deep merges mappings, so the common part is worked out key by key through nested mappings as well.
+# 2. the hosts of a stage that rendered the same thing besides their hostname (i.e. the same packages) are collapsed
+#    into one job with a parallel: matrix over the hostname.  that only works if the hostname shows up where gitlab
+#    expands variables, anything else keeps a job per host.  so does a job that another job lists in its needs or
+#    dependencies, those point at the job by its name.
+#
+# a job whose fragments aren't each a single job definition (i.e. a template rendering several jobs per host), or that
+# use yaml the safe loader can't round trip (gitlab's !reference tags, anchors and aliases), is left exactly as it was
+# rendered.
+def compact_jobs(results: Iterable[RenderedStageJob]) -> List[str]:
+    job_results = {}
+    for result in results:
+        job_results.setdefault(result.job.name, []).append(result)
+
+    # every fragment is parsed up front, the job names other jobs point at (needs and dependencies) have to be known
+    # before any host is folded into a matrix, a matrix job doesn't answer to the name of any of its hosts' jobs
+    job_parsed = {job_name: _parse_results(results) for job_name, results in job_results.items()}
+    parsed_entries = [
+        name_entry for parsed in job_parsed.values() if parsed for _, host_entries in parsed
+        for name_entry in host_entries.values()
+    ]
+    referenced = _referenced_jobs(entry for _, entry in parsed_entries)
+    taken = _taken_names(parsed_entries)
+
+    compacted = []
+    for job_name, results in job_results.items():
+        if job_parsed[job_name] is None:
+            compacted.extend(rendered_job for result in results for _, _, rendered_job in result.rendered)
+            continue
+
+        entries = _compact_entries(job_parsed[job_name], referenced)
+
+        # a single entry would only be split into a hidden definition and a stub extending it, which is bigger
+        hidden_name = _hidden_name(job_name, taken)
+        hidden = _common([entry for _, entry in entries]) if len(entries) > 1 else None
+        if hidden:
+            compacted.append(_dump({hidden_name: hidden}))
+            entries = [(name, _extends(hidden_name, _without(entry, hidden))) for name, entry in entries]
+
+        compacted.extend(_dump({name: entry}) for name, entry in entries)
+
+    return compacted
+
+
+def _parse_results(results: List[RenderedStageJob]) -> Union[List[Tuple[RenderedStageJob, Dict]], None]:
+    # hostname -> (job name, job definition) for each result, or None if any of the fragments can't be compacted
+    parsed_results = []
+    for result in results:
+        parsed = {}
+        for hostname, _, rendered_job in result.rendered:
+            # anchors and aliases would come back out as &id001/*id001 (if they load at all), and gitlab's own tags
+            # (i.e. !reference) don't load with the safe loader.  either way the job is left as it was rendered.
+            try:
+                if _has_aliases(rendered_job):
+                    return None
+
+                rendered = yaml.load(rendered_job, Loader=SafeLoader)
+            except yaml.YAMLError:
+                return None
+
+            if not isinstance(rendered, dict) or len(rendered) != 1:
+                return None
+
+            (name, entry), = rendered.items()
+            if not isinstance(entry, dict):
+                return None
+
+            parsed[hostname] = (name, entry)
+
+        parsed_results.append((result, parsed))
+
+    return parsed_results
+
+
+def _taken_names(entries: Iterable[Tuple[str, Dict]]) -> Set[str]:
+    # every name the rendered jobs define or extend, whatever else the templates define is left to the prefix
+    taken = set()
+    for name, entry in entries:
+        extends = entry.get('extends', [])
+        taken.update([name] + ([extends] if isinstance(extends, str) else list(extends)))
+
+    return taken
+
+
+def _hidden_name(job_name: str, taken: Set[str]) -> str:
+    hidden_name = f'{HIDDEN_PREFIX}{job_name}'
+    suffix = 0
+    while hidden_name in taken:
+        suffix += 1
+        hidden_name = f'{HIDDEN_PREFIX}{job_name}-{suffix}'
+
+    return hidden_name
+
+
+def _has_aliases(rendered_job: str) -> bool:
+    # only worth walking the events when there could be an anchor in there at all
+    if '&' not in rendered_job and '*' not in rendered_job:
+        return False
+
+    return any(
+        isinstance(event, yaml.AliasEvent) or getattr(event, 'anchor', None)
+        for event in yaml.parse(rendered_job, Loader=SafeLoader)
+    )
+
+
+def _referenced_jobs(entries: Iterable[Dict]) -> Set[str]:
+    referenced = set()
+    for entry in entries:
+        for key in ('needs', 'dependencies'):
+            references = entry.get(key)
+            for reference in references if isinstance(references, list) else ():
+                if isinstance(reference, dict):
+                    reference = reference.get('job')
+                if isinstance(reference, str):
+                    referenced.add(reference)
+
+    return referenced
+
+
+def _compact_entries(parsed_results: List[Tuple[RenderedStageJob, Dict]],
+                     referenced: Set[str]) -> List[Tuple[str, Dict]]:
+    entries = []
+    for result, parsed in parsed_results:
+        # hosts whose entry is the same once the hostname is swapped for the matrix variable share a matrix, the
+        # entry itself is the grouping key (in its dumped form, it is a bunch of nested dicts and lists).  a job some
+        # other job needs (or depends on) keeps its own name.
+        matrices = {}
+        for hostname, (name, entry) in parsed.items():
+            templated = _templated(entry, hostname) if name not in referenced else None
+            if templated is not None:
+                matrices.setdefault(_dump(templated), (templated, []))[1].append(hostname)
+
+        host_matrices = {
+            hostname: matrix for matrix in matrices.values() if len(matrix[1]) > 1 for hostname in matrix[1]
+        }
+
+        # the rendered order is kept, a matrix takes the place of the first of its hosts
+        matrix_count = 0
+        for hostname, (name, entry) in parsed.items():
+            if hostname not in host_matrices:
+                entries.append((name, entry))
+                continue
+
+            templated, hostnames = host_matrices[hostname]
+            if hostname != hostnames[0]:
+                continue
+
+            for i in range(0, len(hostnames), MATRIX_LIMIT):
+                entries.append((f'{result.stage_name}-{result.job.name}-matrix-{matrix_count}', dict(
+                    templated, parallel={'matrix': [{MATRIX_VARIABLE: hostnames[i:i + MATRIX_LIMIT]}]}
+                )))
+                matrix_count += 1
+
+    return entries
+
+
+def _templated(entry: Dict, hostname: str) -> Union[Dict, None]:
+    # the hostname is swapped for the matrix variable where gitlab expands variables, if it is still anywhere else
+    # afterwards the host can't be part of a matrix.  neither can a job that is already parallel or that uses the
+    # matrix variable for something else.
+    variables = entry.get('variables')
+    if 'parallel' in entry or (isinstance(variables, dict) and MATRIX_VARIABLE in variables):
+        return None
+
+    pattern = re.compile(r'(?<![\w.-])' + re.escape(hostname) + r'(?![\w.-])')
+    replacement = '${' + MATRIX_VARIABLE + '}'
+
+    def substitute(value: Any, script: bool) -> Any:
+        if isinstance(value, str):
+            # a hostname the shell would take literally is left as is, which keeps the host out of the matrix below
+            if script and not all(_shell_expands(value, match.start()) for match in pattern.finditer(value)):
+                return value
+            return pattern.sub(replacement, value)
+        if isinstance(value, list):
+            return [substitute(v, script) for v in value]
+        if isinstance(value, dict):
+            return {k: substitute(v, script) for k, v in value.items()}
+        return value
+
+    templated = {k: substitute(v, k in _SCRIPT_KEYS) if k in _EXPANDED_KEYS else v for k, v in entry.items()}
+    return None if pattern.search(_dump(templated)) else templated
+
+
+def _shell_expands(script: str, position: int) -> bool:
+    # whether the shell expands a variable put at position, that is it isn't in single quotes ('...' or $'...') or
+    # escaped.  heredocs are left alone altogether (the delimiter being quoted or not decides), anything after one
+    # counts as literal.
+    quote = None
+    i = 0
+    while i < position:
+        c = script[i]
+        if quote == "'":
+            if c == "'":
+                quote = None
+        elif quote == "$'":
+            if c == '\\':
+                i += 1
+            elif c == "'":
+                quote = None
+        elif c == '\\':
+            i += 1
+        elif c == '"':
+            quote = None if quote == '"' else '"'
+        elif quote is None and c == "'":
+            quote = "'"
+        elif quote is None and script.startswith("$'", i):
+            quote = "$'"
+            i += 1
+        elif quote is None and script.startswith('<<', i):
+            return False
+
+        i += 1
+
+    # past the position means its first character was escaped
+    return i == position and quote in (None, '"')
+
+
+def _common(entries: List[Dict]) -> Dict:
+    # the keys every entry has with the same value, mappings are compared key by key since extends merges them
+    common = {}
+    for k, v in entries[0].items():
+        if any(k not in entry for entry in entries):
+            continue
+
+        values = [entry[k] for entry in entries]
+        if all(value == v for value in values):
+            common[k] = v
+        elif all(isinstance(value, dict) for value in values):
+            if nested := _common(values):
+                common[k] = nested
+
+    return common
+
+
+def _without(entry: Dict, common: Dict) -> Dict:
+    without = {}
+    for k, v in entry.items():
+        if k not in common:
+            without[k] = v
+        elif isinstance(v, dict) and v != common[k]:
+            without[k] = _without(v, common[k])
+
+    return without
+
+
+def _extends(hidden_name: str, entry: Dict) -> Dict:
+    # an entry that already extends something (that isn't common to all of them) extends the hidden definition last,
+    # the hidden definition came out of the entry itself so it has to win over whatever the entry was extending
+    extends = entry.get('extends', [])
+    extends = [extends] if isinstance(extends, str) else list(extends)
+
+    return dict({'extends': extends + [hidden_name] if extends else hidden_name}, **{
+        k: v for k, v in entry.items() if k != 'extends'
+    })
+
+
+def _dump(data: Dict) -> str:
+    return yaml.dump(data, Dumper=SafeDumper, sort_keys=False, default_flow_style=False, width=1 << 16).strip()
@@ -1,128 +1,176 @@
-from copy import deepcopy
-from typing import Dict, Set, Tuple
-from deploy_pipeline.labels.matching import query_from_object
-from deploy_pipeline.pipeline.utils import with_full_path
+from contextlib import contextmanager
+from typing import Dict, List, Set, Tuple, Union
+from deploy_pipeline.labels.matching import query_from_object, LabelQuery
+from deploy_pipeline.labels.selectors import compile_selector, Selector, SelectorException
+from deploy_pipeline.pipeline.utils import with_full_path, FileNotFoundException
 
+ROOT_PATH = ("<root>",)
 
-def copy_and_init_path(func):
-    def wrapped_func(*args):
-        # don't modify the caller's data, this could get EXPENSIVE if we are called lots of times with giant
-        # pipelines it doesn't seem likely but i'm just pointing it out.
-        inputs = deepcopy(args[0])
-        # provides a way to debug if necessary
-        path_keys = args[1] if len(args) > 1 else ("<root>",)
-        return func(inputs, path_keys)
 
-    return wrapped_func
+# the validators used to deepcopy their input at every level and mutate the copy, which meant a big pipeline was
+# copied over and over again as we walked down into the jobs and selectors.  now each level builds a new, normalized
+# structure out of the parts it validated and shares (never modifies) the parts it didn't touch, so the document is
+# walked exactly once.
+#
+# rather than bailing out on the first problem, every error found along the way is collected.  whichever validator
+# was called first owns the collection and raises once it's done, using the first error found (so the exception type
+# doesn't change) with the messages of all of them.
+@contextmanager
+def collect_errors(errors: Union[List[Exception], None]):
+    owner = errors is None
+    errors = [] if owner else errors
 
+    yield errors
 
-@copy_and_init_path
-def validate_pipeline(pipeline_template: Dict, path_keys: Tuple) -> Dict:
+    if owner and errors:
+        raise _combined_error(errors)
+
+
+def validate_pipeline(pipeline_template: Dict, path_keys: Tuple = ROOT_PATH, errors: List = None) -> Dict:
     # 'the key at this level': True (required to be present) or False (optional)
     level_keys = {
         'phases': True, 'template': True, 'includes': False,
         'selectors': False, 'host_order_label': True, 'jobs': True
     }
 
-    if missing_keys := _validate_keys(
-            _filter_required_keys(level_keys),
-            _filter_present_keys(pipeline_template)
-    ):
-        raise RootValidationException(f"Missing Required Key(s): {','.join(missing_keys)}", path_keys)
-
-    # phases needs to be an List
-    #
-    # look i know that duck typing should be used here, but given that a screw up in the pipeline could an outage,
-    # i am trying to make things as *safe* as possible.
-    if type(pipeline_template['phases']) is not list:
-        raise RootValidationException(f'Invalid phases Key: List is Required', path_keys)
+    with collect_errors(errors) as errors:
+        if type(pipeline_template) is not dict:
+            errors.append(RootValidationException(f'Invalid Pipeline: Dict is Required', path_keys))
+            return pipeline_template
 
-    # template needs to be present
-    pipeline_template['template'] = with_full_path(pipeline_template['template'])
+        if missing_keys := _validate_keys(
+                _filter_required_keys(level_keys),
+                _filter_present_keys(pipeline_template)
+        ):
+            errors.append(RootValidationException(f"Missing Required Key(s): {','.join(missing_keys)}", path_keys))
 
-    # if provided, includes should be valid file paths
-    pipeline_template['includes'] = [with_full_path(i) for i in pipeline_template.get('includes', [])]
+        # anything we don't validate is carried over as is
+        validated = dict(pipeline_template)
 
-    # if provided, selectors should be valid
-    if selectors := pipeline_template.get('selectors', {}):
-        pipeline_template['selectors'] = validate_selectors(selectors, path_keys)
+        # phases needs to be an List
+        #
+        # look i know that duck typing should be used here, but given that a screw up in the pipeline could an outage,
+        # i am trying to make things as *safe* as possible.
+        if 'phases' in pipeline_template and type(pipeline_template['phases']) is not list:
+            errors.append(RootValidationException(f'Invalid phases Key: List is Required', path_keys))
 
-    # jobs should be a dict
-    pipeline_template['jobs'] = validate_jobs(pipeline_template['jobs'], path_keys + ('jobs',))
+        # template needs to be present
+        if 'template' in pipeline_template:
+            validated['template'] = _validate_path(pipeline_template['template'], errors)
 
-    return pipeline_template
+        # if provided, includes should be valid file paths
+        validated['includes'] = [_validate_path(i, errors) for i in pipeline_template.get('includes') or []]
 
+        # if provided, selectors should be valid
+        validated['selectors'] = validate_selectors(pipeline_template.get('selectors') or {}, path_keys, errors)
 
-@copy_and_init_path
-def validate_jobs(jobs: Dict, path_keys: Tuple) -> Dict:
-    # jobs should be a dict
-    if type(jobs) is not dict:
-        raise JobValidationException(f'Invalid Key: Dict is Required', path_keys)
+        # jobs should be a dict
+        if 'jobs' in pipeline_template:
+            validated['jobs'] = validate_jobs(pipeline_template['jobs'], path_keys + ('jobs',), errors)
 
-    # validate the individual jobs
-    for job_k, job_v in jobs.items():
-        jobs[job_k] = validate_job(job_v, path_keys + (job_k,))
+        return validated
 
-    return jobs
 
+def validate_jobs(jobs: Dict, path_keys: Tuple = ROOT_PATH, errors: List = None) -> Dict:
+    with collect_errors(errors) as errors:
+        # jobs should be a dict
+        if type(jobs) is not dict:
+            errors.append(JobValidationException(f'Invalid Key: Dict is Required', path_keys))
+            return jobs
 
-@copy_and_init_path
-def validate_job(job: Dict, path_keys: Tuple) -> Dict:
-    level_keys = {'phase': True, 'variables': False, 'template': True, 'selectors': True}
-
-    if missing_job_keys := _validate_keys(_filter_required_keys(level_keys), _filter_present_keys(job)):
-        raise JobValidationException(f"Missing Job Key(s): {', '.join(missing_job_keys)}", path_keys)
+        # validate the individual jobs
+        return {job_k: validate_job(job_v, path_keys + (job_k,), errors) for job_k, job_v in jobs.items()}
 
-    # validate the job template can be found
-    job['template'] = with_full_path(job['template'])
 
-    # variables (if supplied) should be a dict
-    if job.get('variables') and not isinstance(job['variables'], dict):
-        raise JobValidationException(f"Job Variable(s) Require Key/Value", path_keys)
+def validate_job(job: Dict, path_keys: Tuple = ROOT_PATH, errors: List = None) -> Dict:
+    level_keys = {'phase': True, 'variables': False, 'template': True, 'selectors': True}
 
-    job['selectors'] = validate_selectors(job['selectors'], path_keys + ('selectors',))
+    with collect_errors(errors) as errors:
+        if type(job) is not dict:
+            errors.append(JobValidationException(f'Invalid Job: Dict is Required', path_keys))
+            return job
 
-    return job
+        if missing_job_keys := _validate_keys(_filter_required_keys(level_keys), _filter_present_keys(job)):
+            errors.append(JobValidationException(f"Missing Job Key(s): {', '.join(missing_job_keys)}", path_keys))
 
+        validated = dict(job)
 
-@copy_and_init_path
-def validate_selectors(selectors: Dict, path_keys: Tuple) -> Dict:
-    level_keys = {'host': False, 'package': False}
+        # validate the job template can be found
+        if 'template' in job:
+            validated['template'] = _validate_path(job['template'], errors)
 
-    # selectors should be a dict
-    if type(selectors) is not dict:
-        raise SelectorValidationException(f"Invalid Selectors: Dict is Required", path_keys)
+        # variables (if supplied) should be a dict
+        if job.get('variables') and not isinstance(job['variables'], dict):
+            errors.append(JobValidationException(f"Job Variable(s) Require Key/Value", path_keys))
 
-    if missing_keys := _validate_keys(_filter_required_keys(level_keys), _filter_present_keys(selectors)):
-        raise SelectorValidationException(f"Missing Required Selector(s): {', '.join(missing_keys)}", path_keys)
+        validated['variables'] = job.get('variables') or {}
 
-    # host and package should be a list
-    for level_key in level_keys:
-        if type(selectors.get(level_key, [])) is not list:
-            raise SelectorValidationException(f"Invalid Selector: Expected '{level_key}' List", path_keys)
+        if 'selectors' in job:
+            validated['selectors'] = validate_selectors(job['selectors'], path_keys + ('selectors',), errors)
 
-    # generates a pretty-ish
-    for selector_key, selector_query in (
-            (selector_type, selector_query)
-            for selector_type, selector_type_value in selectors.items() for selector_query in selector_type_value
-    ):
-        validate_formed_selectors(selector_query, path_keys + (selector_key,))
+        return validated
 
-    return selectors
 
+def validate_selectors(selectors: Dict, path_keys: Tuple = ROOT_PATH, errors: List = None) -> Dict[str, List]:
+    level_keys = {'host': False, 'package': False}
 
-@copy_and_init_path
-def validate_formed_selectors(selector: Dict, path_keys: Tuple) -> Dict:
-    # shove the selector into the query_from_object function which should validate it enough for our purposes
-    # it does do minor object construction, but it's a namedtuple for right now which should be pretty lightweight
+    with collect_errors(errors) as errors:
+        # selectors should be a dict
+        if type(selectors) is not dict:
+            errors.append(SelectorValidationException(f"Invalid Selectors: Dict is Required", path_keys))
+            return selectors
+
+        if missing_keys := _validate_keys(_filter_required_keys(level_keys), _filter_present_keys(selectors)):
+            errors.append(SelectorValidationException(
+                f"Missing Required Selector(s): {', '.join(missing_keys)}", path_keys
+            ))
+
+        # both selector types are always handed back (empty if they weren't provided), with each selector parsed into
+        # its query so nobody downstream has to parse them again
+        validated = {}
+        for level_key in level_keys:
+            # host and package should be a list
+            if type(selectors.get(level_key, [])) is not list:
+                errors.append(SelectorValidationException(f"Invalid Selector: Expected '{level_key}' List", path_keys))
+                continue
+
+            validated[level_key] = [
+                validate_formed_selectors(selector_query, path_keys + (level_key,), errors)
+                for selector_query in selectors.get(level_key, [])
+            ]
+
+        return validated
+
+
+def validate_formed_selectors(selector: Union[Dict, str], path_keys: Tuple = ROOT_PATH,
+                              errors: List = None) -> Union[LabelQuery, Selector]:
+    with collect_errors(errors) as errors:
+        # a string is a selector in the selector grammar (i.e. "env in (prod, canary) || region=se3"), compiled once
+        # here so nobody downstream has to parse it again
+        if isinstance(selector, str):
+            try:
+                return compile_selector(selector)
+            except SelectorException as e:
+                errors.append(SelectorValidationException(f'Malformed Selector: {e}', path_keys))
+                return
+
+        # shove the selector into the query_from_object function which should validate it enough for our purposes
+        # it does do minor object construction, but it's a namedtuple for right now which should be pretty lightweight
+        try:
+            return query_from_object(selector)
+        except (KeyError, TypeError, AttributeError):
+            # query from object just calls __get__ on whatever is passed in and throws a key error if it's not found
+            # (or a type/attribute error if it isn't a dict or the operator is bogus), we should handle the exception
+            # and add some additional context so finding the error isn't a pita.
+            errors.append(SelectorValidationException(f'Malformed Selector: {selector}', path_keys))
+
+
+def _validate_path(path: str, errors: List) -> str:
     try:
-        query_from_object(selector)
-    except KeyError:
-        # query from object just just calls __get__ on whatever is passed in and throws a key error if it's not found
-        # we should handle the exception and add some additional context so finding the error isn't a pita.
-        raise SelectorValidationException(f'Malformed Selector: {selector}', path_keys) from None
-
-    return selector
+        return with_full_path(path)
+    except FileNotFoundException as e:
+        errors.append(e)
+        return path
 
 
 def _validate_keys(required: Set, present: Set) -> Set:
@@ -137,6 +185,15 @@ def _filter_required_keys(required: Dict) -> Set:
     return {k for k, v in required.items() if v}
 
 
+def _combined_error(errors: List[Exception]) -> Exception:
+    error = errors[0]
+    if len(errors) > 1:
+        error.args = ('\n'.join(str(e) for e in errors),)
+
+    error.errors = errors
+    return error
+
+
 class PipelineValidationException(Exception):
     def __init__(self, msg: str, key_path: Tuple):
         super().__init__(f"{msg} [Path: {'->'.join(key_path)}]")
@@ -0,0 +1,69 @@
+import hashlib
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Tuple, Union
+from deploy_pipeline.inventory.cache import InventoryCache
+from deploy_pipeline.pipeline.plan import StageJobPlan
+from deploy_pipeline.vars.scopes import job_scope
+
+
+# the child pipeline gets regenerated on every commit, even though most commits don't touch anything that ends up in
+# it.  every (stage, job) is fingerprinted with everything its rendered fragment depends on, and the fragments are kept
+# in the local cache under that fingerprint.  the next run only renders the (stage, job)s whose fingerprint it hasn't
+# seen before and splices the cached fragments in for the rest.  the whole rendered pipeline is cached the same way, so
+# when nothing changed at all the previous output is written out without rendering anything.
+#
+# a fragment is rendered from the stage and job names, the hosts with the packages they get, the job's variables and
+# the job template, so that is what goes into the fingerprint (along with the rest of the job definition).  the
+# templates are fingerprinted by their content, keep in mind that anything they pull in with include/import isn't.
+class FragmentCache:
+    _cache: InventoryCache
+    _fingerprints: Dict[Tuple[str, str], str]
+    _job_scopes: Dict[str, Dict]
+
+    def __init__(self, cache: InventoryCache):
+        self._cache = cache
+
+        # every (stage, job) is fingerprinted once per run, no matter how many times it is looked up
+        self._fingerprints = {}
+        self._job_scopes = {}
+
+    def fingerprint(self, plan: StageJobPlan, variables: Mapping) -> str:
+        job = plan.job
+        fingerprint_key = (plan.stage_name, job.name)
+        if fingerprint_key not in self._fingerprints:
+            if job.name not in self._job_scopes:
+                self._job_scopes[job.name] = job_scope(variables, job.variables)
+
+            self._fingerprints[fingerprint_key] = _digest((
+                plan.stage_name, job.name, job.phase, job.template, self._cache.digest(job.template),
+                job.host_selectors, job.package_selectors, self._job_scopes[job.name], plan.host_count,
+                plan.package_count, sorted((hostname, sorted(p)) for hostname, p in plan.hosts_packages.items())
+            ))
+
+        return self._fingerprints[fingerprint_key]
+
+    def fragments(self, plan: StageJobPlan, variables: Mapping) -> Union[Any, None]:
+        return self._cache.get('fragments', self.fingerprint(plan, variables))
+
+    def store_fragments(self, plan: StageJobPlan, variables: Mapping, rendered: Any):
+        self._cache.put('fragments', self.fingerprint(plan, variables), rendered)
+
+    def output_key(self, template_path: str, template_vars: Dict, plans: List[StageJobPlan], variables: Mapping,
+                   options: Dict = None) -> str:
+        # the pipeline template gets everything in template_vars besides the jobs, the jobs are covered by their
+        # fingerprints.  options are whatever else changes the output without changing any of that (i.e. compaction).
+        return _digest((
+            template_path, self._cache.digest(template_path),
+            sorted((k, v) for k, v in template_vars.items() if k != 'jobs'),
+            [self.fingerprint(plan, variables) for plan in plans],
+            sorted((options or {}).items())
+        ))
+
+    def output(self, output_key: str) -> Union[Iterator[str], None]:
+        return self._cache.read_text('output', output_key)
+
+    def store_output(self, output_key: str, chunks: Iterable[str]) -> Iterator[str]:
+        return self._cache.write_text('output', output_key, chunks)
+
+
+def _digest(parts: Tuple) -> str:
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
@@ -0,0 +1,64 @@
+import os
+import secrets
+import sys
+from contextlib import contextmanager
+from typing import IO, Iterable, Iterator, Union
+
+
+# the rendered pipeline has always been .strip()'ed before being written out.  when streaming we never hold the whole
+# document so the same thing has to be done chunk by chunk: leading whitespace is dropped until the first real content
+# shows up, and trailing whitespace is held back until we know more content follows it.
+def strip_chunks(chunks: Iterable[str]) -> Iterable[str]:
+    pending = None
+    for chunk in chunks:
+        if pending is None:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            pending = ""
+
+        content = chunk.rstrip()
+        if content:
+            yield pending + content
+            pending = chunk[len(content):]
+        else:
+            pending += chunk
+
+
+def write_chunks(chunks: Iterable[str], output_path: Union[str, None] = None, stream: IO = None) -> int:
+    # no output file, dump it to stdout (print used to tack on the trailing newline, so we do the same).  a stream can
+    # be supplied in place of stdout, i.e. to hand the pipeline back to a client of the service.
+    if not output_path:
+        stream = stream or sys.stdout
+        written = sum(stream.write(chunk) for chunk in chunks)
+        stream.write("\n")
+        stream.flush()
+        return written
+
+    with atomic_open(output_path) as f:
+        return sum(f.write(chunk) for chunk in chunks)
+
+
+# write to a temp file next to the output and swap it in once everything has been written, that way a failed write
+# never leaves a half written file behind (i.e. for the trigger job to pick up).  the temp file is created with the
+# same mode a plain open() would use and the kernel applies the umask to it, so the swapped in file ends up with the
+# usual permissions (mkstemp would have made it readable by the owner only).
+@contextmanager
+def atomic_open(output_path: str, mode: str = 'w') -> Iterator[IO]:
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    while True:
+        tmp_path = os.path.join(output_dir, f'.{os.path.basename(output_path)}.{secrets.token_hex(8)}.tmp')
+        try:
+            fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            break
+        except FileExistsError:
+            continue
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
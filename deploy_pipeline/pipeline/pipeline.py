@@ -1,6 +1,8 @@
 from collections import defaultdict
-from itertools import product
-from typing import Dict, List, Union, Tuple, Iterable
+from itertools import groupby, product
+from typing import Any, Dict, List, Union, Tuple, Iterable
+from deploy_pipeline.labels.matching import LabelQuery
+from deploy_pipeline.labels.selectors import Selector
 
 
 # a job is tied to a phase, and even though a phase can only exist once, that doesn't mean a job will run only once.
@@ -13,8 +15,8 @@ class Job:
     template: str
     variables: Union[Dict, None]
 
-    host_selectors: List
-    package_selectors: List
+    host_selectors: List[Union[LabelQuery, Selector]]
+    package_selectors: List[Union[LabelQuery, Selector]]
 
     @property
     def name(self):
@@ -83,6 +85,9 @@ class Pipeline:
 
         return self
 
+    def get_jobs(self) -> Iterable[Job]:
+        yield from self._job_names.values()
+
     def get_jobs_by_phase(self, phase_name) -> Iterable[Job]:
         yield from self._job_phases[phase_name]
 
@@ -115,6 +120,14 @@ class Stage:
         for _, _, stage in self._get_stages():
             yield stage
 
+    def get_stage_groups(self) -> Iterable[Tuple[Any, List[str]]]:
+        # the stages that belong to each host order group, in order (i.e. 0 -> [0-changebroker, 0-partition])
+        for order_group, stages in groupby(self._get_stages(), key=lambda s: s[0]):
+            yield order_group, [stage for _, _, stage in stages]
+
+    def get_jobs(self) -> Iterable[Job]:
+        yield from self._pipeline.get_jobs()
+
     def get_stage_jobs(self) -> Tuple[str, str, str, Job]:
         for stage, phase_name, stage_name in self._get_stages():
             for job in self._pipeline.get_jobs_by_phase(phase_name):
@@ -139,7 +152,8 @@ def load_pipeline_from_config(pipeline_config: Dict) -> Pipeline:
         job.variables = job_v.get('variables', {})
 
         # make the author be EXPLICIT about the selectors they want to use (otherwise bad things can happen),
-        # if they want to include all packages, just pass an empty array for a selector
+        # if they want to include all packages, just pass an empty array for a selector.  the validator has already
+        # parsed them into label queries.
         job.host_selectors.extend(job_v['selectors']['host'])
         job.package_selectors.extend(job_v['selectors']['package'])
 
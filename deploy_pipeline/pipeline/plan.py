@@ -0,0 +1,57 @@
+from typing import Dict, Iterable, NamedTuple, Set, Tuple, Union
+from deploy_pipeline.labels.matching import LabelIndex
+from deploy_pipeline.labels.selectors import match_selectors
+from deploy_pipeline.pipeline.pipeline import Job
+
+# the hosts and packages a job's own selectors pick out of everything still in play.  none of that depends on the stage
+# so it is worked out once per job, not once per (stage, job).
+JobSelection = NamedTuple('JobSelection', (
+    ('hosts', Set),
+    ('packages', Set)
+))
+
+# everything a single (stage, job) work unit needs to render, and nothing else.  the host -> packages mapping is the
+# slice of the inventory the job template is rendered against, so it is all that has to be handed to a worker.
+StageJobPlan = NamedTuple('StageJobPlan', (
+    ('stage_name', str),
+    ('job', Job),
+    ('host_count', int),
+    ('package_count', int),
+    ('hosts_packages', Dict[str, Set])
+))
+
+
+def select_jobs(jobs: Iterable[Job], host_index: LabelIndex, package_index: LabelIndex,
+                host_candidates: Union[Set, int], package_candidates: Union[Set, int]) -> Dict[str, JobSelection]:
+    # each job provides the ability to add host and package selectors of their own to be able to include (or exclude)
+    # hosts and packages at that particular phase.  the queries run against the shared indexes, restricted to the hosts
+    # and packages that survived the pipeline level queries and the join.
+    return {
+        job.name: JobSelection(
+            match_selectors(host_index, job.host_selectors, host_candidates),
+            match_selectors(package_index, job.package_selectors, package_candidates)
+        ) for job in jobs
+    }
+
+
+def plan_stage_jobs(stage_jobs: Iterable[Tuple], job_selections: Dict[str, JobSelection], host_order: Dict[str, Set],
+                    host_packages: Dict[str, Set]) -> Iterable[StageJobPlan]:
+    # every (stage, job) used to run its own host query (the job selectors plus an In query on the host order label),
+    # its own package query and its own join.  the stage part of that is exactly the host order grouping we already
+    # have, the job part is the job selection and the join was already done once for the whole pipeline, so all that is
+    # left per (stage, job) is intersecting them.
+    for stage, phase_name, stage_name, job in stage_jobs:
+        job_selection = job_selections[job.name]
+        stage_hosts = host_order.get(stage, set()) & job_selection.hosts
+
+        # a job without package selectors keeps every package the global join found, so the host's packages can be
+        # used as is.  otherwise only keep the job's packages, dropping any host that is left with nothing to install.
+        if job.package_selectors:
+            hosts_packages = {}
+            for hostname in stage_hosts:
+                if packages := host_packages[hostname] & job_selection.packages:
+                    hosts_packages[hostname] = packages
+        else:
+            hosts_packages = {hostname: host_packages[hostname] for hostname in stage_hosts if host_packages[hostname]}
+
+        yield StageJobPlan(stage_name, job, len(stage_hosts), len(job_selection.packages), hosts_packages)
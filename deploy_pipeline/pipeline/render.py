@@ -0,0 +1,135 @@
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Set, Tuple, Union
+from jinja2.environment import Template
+from deploy_pipeline.pipeline.pipeline import Job
+from deploy_pipeline.pipeline.fragments import FragmentCache
+from deploy_pipeline.pipeline.plan import StageJobPlan
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+from deploy_pipeline.pipeline.workers import worker_pool, worker_state
+from deploy_pipeline.vars.scopes import job_scope
+import deploy_pipeline.metrics.metrics as metrics
+
+# the result of a single (stage, job) work unit.  the rendered fragments are kept alongside the hostname and packages
+# they were rendered for so the caller can log them in order, regardless of where the work was actually done.
+RenderedStageJob = NamedTuple('RenderedStageJob', (
+    ('stage_name', str),
+    ('job', Job),
+    ('host_count', int),
+    ('package_count', int),
+    ('rendered', List[Tuple[str, Set, str]])
+))
+
+
+def render_stage_job(stage_template: Template, plan: StageJobPlan, job_variables: Dict) -> RenderedStageJob:
+    with metrics.span('render'):
+        return _render_stage_job(stage_template, plan, job_variables)
+
+
+def _render_stage_job(stage_template: Template, plan: StageJobPlan, job_variables: Dict) -> RenderedStageJob:
+    # all of the matching and joining was done while planning (see plan.py), all that is left here is the rendering
+    job = plan.job
+    stage_hosts_packages = plan.hosts_packages
+
+    # the hosts come out of the plan in whatever order the matched sets happen to iterate in, which depends on the
+    # order the queries were applied.  sort them so the rendered pipeline doesn't.
+    rendered = []
+    for hostname in sorted(stage_hosts_packages):
+        packages = stage_hosts_packages[hostname]
+        # setup the variables that will be shared with the template, for right now these are all of the
+        # variables that *any* job would need. i am explicitly providing key/value pairs here for the most part
+        # so the underlying jinja templates don't need to change if the domain object signature changes.  heh,
+        # this shows how much faith i have in the initial design.
+        rendered.append((hostname, packages, stage_template.render({
+            "stagename": plan.stage_name,
+            "jobname": job.name,
+            "hostname": hostname,
+            "packages": sorted(packages),
+            "vars": job_variables
+        })))
+
+    return RenderedStageJob(plan.stage_name, job, plan.host_count, plan.package_count, rendered)
+
+
+def render_stage_jobs(stage_job_plans: Iterable[StageJobPlan], templates: TemplateRegistry, variables: Mapping,
+                      workers: int = 1, fragment_cache: FragmentCache = None) -> Iterable[RenderedStageJob]:
+    # with a fragment cache, anything rendered by a previous run with the same fingerprint is handed back as is and
+    # only the rest is rendered (and then cached)
+    def cached(plan: StageJobPlan) -> Union[RenderedStageJob, None]:
+        # the cached result carries a copy of the job from whichever run rendered it, hand back this run's job instead
+        if not fragment_cache:
+            return None
+
+        result = fragment_cache.fragments(plan, variables)
+        metrics.count('fragment_cache.hits' if result else 'fragment_cache.misses')
+        return result._replace(job=plan.job) if result else None
+
+    def rendered(plan: StageJobPlan, result: RenderedStageJob) -> RenderedStageJob:
+        if fragment_cache:
+            fragment_cache.store_fragments(plan, variables, result)
+
+        return result
+
+    # nothing to fan out, keep everything in process
+    if workers <= 1:
+        job_scopes = {}
+        for plan in stage_job_plans:
+            yield cached(plan) or rendered(plan, render_stage_job(
+                templates.get_template(plan.job.template), plan, _get_job_scope(job_scopes, variables, plan.job)
+            ))
+        return
+
+    # each worker gets its own template registry along with the variables (see workers.py), every work unit then only
+    # carries its own plan, which is just the hosts and packages that job renders for.  whatever the workers record
+    # (i.e. the render spans) comes back with each result and is merged into this run's metrics.
+    with worker_pool(
+            workers, templates, variables=variables, job_scopes={}, recording=metrics.current() is not None
+    ) as executor:
+        # results are handed back strictly in submission order, which is the order the serial path produces.  only a
+        # handful of work units are kept in flight so a slow consumer (i.e. streaming output) doesn't cause every
+        # rendered job to pile up in memory.
+        #
+        # cached results take their place in line like everything else, they just don't go anywhere near the pool.
+        pending = deque()
+        for plan in stage_job_plans:
+            if cached_result := cached(plan):
+                future = Future()
+                future.set_result(cached_result)
+                pending.append((plan, future, True))
+            else:
+                pending.append((plan, executor.submit(_render_in_worker, plan), False))
+
+            if len(pending) >= workers * 2:
+                yield _completed(*pending.popleft(), rendered)
+
+        while pending:
+            yield _completed(*pending.popleft(), rendered)
+
+
+def _completed(plan: StageJobPlan, future: Future, hit: bool,
+               rendered: Callable[[StageJobPlan, RenderedStageJob], RenderedStageJob]) -> RenderedStageJob:
+    if hit:
+        return future.result()
+
+    result, recorded = future.result()
+    metrics.merge(recorded)
+    return rendered(plan, result)
+
+
+def _render_in_worker(plan: StageJobPlan) -> Tuple[RenderedStageJob, Union[metrics.Metrics, None]]:
+    # each work unit records on its own, the metrics go back to the parent with the result
+    with metrics.recording() if worker_state['recording'] else nullcontext() as recorded:
+        return render_stage_job(
+            worker_state['templates'].get_template(plan.job.template),
+            plan,
+            _get_job_scope(worker_state['job_scopes'], worker_state['variables'], plan.job)
+        ), recorded
+
+
+def _get_job_scope(job_scopes: Dict[str, Dict], variables: Mapping, job: Job) -> Dict:
+    # a job is rendered once per stage (and once per host within that), its variables only need resolving the once
+    if job.name not in job_scopes:
+        job_scopes[job.name] = job_scope(variables, job.variables)
+
+    return job_scopes[job.name]
@@ -0,0 +1,134 @@
+import os
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Tuple, Union
+import yaml
+from deploy_pipeline.pipeline.compact import compact_jobs
+from deploy_pipeline.pipeline.fragments import FragmentCache
+from deploy_pipeline.pipeline.output import write_chunks
+from deploy_pipeline.pipeline.plan import StageJobPlan
+from deploy_pipeline.pipeline.render import render_stage_jobs
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+from deploy_pipeline.pipeline.workers import worker_pool, worker_state
+
+# the parent pipeline is tiny, libyaml is used when it is there simply because the loader does the same
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# a single child pipeline with thousands of jobs is slow for gitlab to parse, and it all shows up as one giant
+# pipeline.  the stages can instead be split across several child pipelines (one per host order group, or every N
+# stages), each of them a complete pipeline of its own rendered with the same pipeline template, and a small parent
+# pipeline that triggers them one after the other.
+Shard = NamedTuple('Shard', (
+    ('name', str),
+    ('path', str),
+    ('stages', List[str]),
+    ('plans', List[StageJobPlan])
+))
+
+# what is left of a shard once it has been written out, the rendered jobs never leave the process that rendered them
+WrittenShard = NamedTuple('WrittenShard', (
+    ('name', str),
+    ('path', str),
+    ('stage_count', int),
+    ('job_count', int),
+    ('written', int)
+))
+
+SHARD_PREFIX = 'shard'
+
+
+def split_shards(stage_groups: Iterable[Tuple[Any, List[str]]], stage_job_plans: Iterable[StageJobPlan],
+                 shard_dir: str, stages_per_shard: int = None) -> List[Shard]:
+    # gitlab only includes files from within the project, which is the working directory of the job generating the
+    # pipeline.  a shard directory anywhere else couldn't be included by the parent pipeline.
+    if os.path.commonpath([os.path.abspath(shard_dir), os.getcwd()]) != os.getcwd():
+        raise ShardException(f"Shard Directory Outside of the Project Directory: {shard_dir}")
+
+    # one shard per host order group unless a number of stages was asked for, in which case the stages are chunked
+    # in order regardless of which group they belong to
+    shard_stages = [stages for _, stages in stage_groups]
+    if stages_per_shard:
+        stages = [stage for group_stages in shard_stages for stage in group_stages]
+        shard_stages = [stages[i:i + stages_per_shard] for i in range(0, len(stages), stages_per_shard)]
+
+    stage_plans = {}
+    for plan in stage_job_plans:
+        stage_plans.setdefault(plan.stage_name, []).append(plan)
+
+    # gitlab refuses a pipeline without any jobs in it, a shard that wouldn't render a single job is left out
+    # altogether rather than triggering a child pipeline that can't run.  a job renders for the hosts it has packages
+    # for, the package selectors can leave it without any even though its hosts matched.
+    shards = []
+    for stages in shard_stages:
+        plans = [plan for stage in stages for plan in stage_plans.get(stage, [])]
+        if not any(plan.hosts_packages for plan in plans):
+            continue
+
+        name = f'{SHARD_PREFIX}-{len(shards)}'
+        shards.append(Shard(name, os.path.join(shard_dir, f'{name}.yml'), stages, plans))
+
+    return shards
+
+
+def write_shards(shards: List[Shard], templates: TemplateRegistry, pipeline_template: str, template_vars: Dict,
+                 variables: Mapping, workers: int = 1, fragment_cache: FragmentCache = None,
+                 compact: bool = False) -> Iterable[WrittenShard]:
+    # every shard carries the full template vars (includes and all), only the stages and jobs are its own
+    if workers <= 1:
+        for shard in shards:
+            yield _write_shard(shard, templates, pipeline_template, template_vars, variables, fragment_cache, compact)
+        return
+
+    # the shards are independent of each other, so each one is rendered and written out by a worker of its own (the
+    # same kind of pool as the render pool, see workers.py).  only the totals come back, in shard order.
+    with worker_pool(
+            min(workers, len(shards)) or 1, templates, pipeline_template=pipeline_template,
+            template_vars=template_vars, variables=variables, fragment_cache=fragment_cache, compact=compact
+    ) as executor:
+        yield from executor.map(_write_shard_in_worker, shards)
+
+
+def render_parent(shards: List[Shard], trigger_job: str = None) -> str:
+    # each child pipeline gets a trigger job in a stage of its own, so they run strictly one after the other, and
+    # strategy: depend holds the parent (and the next shard) until the child pipeline has finished.  the child
+    # pipeline files are either artifacts of the job that generated them or, without one, files in the repository.
+    # either way gitlab looks for them relative to the project directory, the job's working directory, not by an
+    # absolute path on the runner (i.e. an absolute --shard-dir, split_shards made sure it is within the project).
+    def include(shard: Shard) -> Dict:
+        path = os.path.relpath(shard.path)
+        return {'artifact': path, 'job': trigger_job} if trigger_job else {'local': path}
+
+    parent = {'stages': [shard.name for shard in shards]}
+    for shard in shards:
+        parent[shard.name] = {
+            'stage': shard.name,
+            'trigger': {'include': [include(shard)], 'strategy': 'depend'}
+        }
+
+    return yaml.dump(parent, Dumper=SafeDumper, sort_keys=False, default_flow_style=False).strip()
+
+
+def _write_shard(shard: Shard, templates: TemplateRegistry, pipeline_template: str, template_vars: Dict,
+                 variables: Mapping, fragment_cache: Union[FragmentCache, None], compact: bool) -> WrittenShard:
+    # each shard is compacted on its own, the hidden job definitions have to be in the file that extends them
+    results = render_stage_jobs(shard.plans, templates, variables, fragment_cache=fragment_cache)
+    jobs = compact_jobs(results) if compact else [
+        rendered_job for result in results for _, _, rendered_job in result.rendered
+    ]
+
+    rendered_shard = templates.get_template(pipeline_template).render(
+        dict(template_vars, stages=shard.stages, jobs=jobs)
+    ).strip()
+
+    return WrittenShard(
+        shard.name, shard.path, len(shard.stages), len(jobs), write_chunks([rendered_shard], shard.path)
+    )
+
+
+def _write_shard_in_worker(shard: Shard) -> WrittenShard:
+    return _write_shard(
+        shard, worker_state['templates'], worker_state['pipeline_template'], worker_state['template_vars'],
+        worker_state['variables'], worker_state['fragment_cache'], worker_state['compact']
+    )
+
+
+class ShardException(Exception):
+    pass
@@ -1,18 +1,75 @@
 import os
+from typing import Iterable, Union
+from jinja2.bccache import FileSystemBytecodeCache
 from jinja2.environment import Environment, Template
 from jinja2.exceptions import TemplateNotFound
 from jinja2.loaders import BaseLoader
 from jinja2.utils import select_autoescape
+import deploy_pipeline.metrics.metrics as metrics
+
+# number of compiled templates kept around by the registry, a pipeline rarely has more than a handful of distinct
+# templates so this is really just a ceiling to keep a long lived registry from growing without bound
+DEFAULT_CACHE_SIZE = 400
+
+
+# a single long lived jinja environment.  previously every call to get_template built a brand new environment (and
+# loader) which meant the same job template was read, parsed and compiled once per stage/job.  the environment already
+# keeps an lru of compiled templates, so all we need to do is hang on to it and make sure the cache key (the template
+# name) is stable, which is what the realpath is for.
+class TemplateRegistry:
+    _environment: Environment
+
+    cache_dir: Union[str, None]
+
+    def __init__(self, cache_dir: Union[str, None] = None, cache_size: int = DEFAULT_CACHE_SIZE):
+        # the bytecode cache is opt-in, when a directory is supplied the compiled templates are written out to disk so
+        # subsequent runs (i.e. the next ci job) can skip the compile step entirely.  jinja keys the bytecode by a
+        # checksum of the template source so a changed template is simply recompiled.
+        self.cache_dir = cache_dir
+
+        bytecode_cache = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+        self._environment = Environment(
+            loader=FullPathLoader(),
+            autoescape=select_autoescape(['html', 'xml']),
+            trim_blocks=True,
+            lstrip_blocks=True,
+            cache_size=cache_size,
+            bytecode_cache=bytecode_cache
+        )
+
+    @property
+    def environment(self) -> Environment:
+        return self._environment
+
+    def get_template(self, template_path: str) -> Template:
+        return self._environment.get_template(os.path.realpath(template_path))
+
+    def load_templates(self, template_paths: Iterable[str]) -> "TemplateRegistry":
+        # eagerly compile the templates so syntax errors surface before we spend any time matching labels
+        with metrics.span('template.compile'):
+            for template_path in template_paths:
+                self.get_template(template_path)
+
+        return self
+
+
+_default_registry: Union[TemplateRegistry, None] = None
+
+
+def get_registry() -> TemplateRegistry:
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = TemplateRegistry()
+
+    return _default_registry
 
 
 def get_template(template_path: str) -> Template:
-    # init jinja environment
-    return Environment(
-        loader=FullPathLoader(),
-        autoescape=select_autoescape(['html', 'xml']),
-        trim_blocks=True,
-        lstrip_blocks=True
-    ).get_template(template_path)
+    return get_registry().get_template(template_path)
 
 
 # implement a loader that is capable of loading a template using an absolute path
@@ -0,0 +1,36 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, Union
+
+# the templates (and jinja with them) are only imported by the workers that need them, the config loader shares the
+# pool too and has no use for them
+if TYPE_CHECKING:
+    from deploy_pipeline.pipeline.templates import TemplateRegistry
+
+# per process state of a worker pool, populated by the pool initializer.  a worker process only ever belongs to the
+# one pool, so there is only the one set of state.
+worker_state: Dict[str, Any] = {}
+
+
+# the config loader, render and shard pools all hand the workers everything that stays the same for the whole run
+# once, when the worker starts, so the work units only carry their own bits.  compiled jinja templates can't be
+# pickled, so each worker gets its own registry (sharing the bytecode cache if there is one) when the templates are
+# passed in.  forking is preferred where it is available, the workers then start with everything the parent already
+# had loaded.
+def worker_pool(workers: int, templates: 'TemplateRegistry' = None, **state: Any) -> ProcessPoolExecutor:
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(templates is not None, templates.cache_dir if templates is not None else None, state)
+    )
+
+
+def _init_worker(with_templates: bool, template_cache_dir: Union[str, None], state: Dict[str, Any]):
+    worker_state.clear()
+    worker_state.update(state)
+
+    if with_templates:
+        from deploy_pipeline.pipeline.templates import TemplateRegistry
+        worker_state['templates'] = TemplateRegistry(template_cache_dir)
@@ -0,0 +1,253 @@
+import argparse
+import io
+import json
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple, Union
+from deploy_pipeline.inventory.cache import InventoryCache
+from deploy_pipeline.logs import start_logging, stop_logging, LOG_LEVELS
+from deploy_pipeline.main import add_arguments, deploy_pipeline, load_inventory, logger, DEFAULT_CONFIG, Inventory
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# how many inventories (distinct sets of config files and index modes) are kept loaded, the least recently used one is
+# dropped to make room for another
+MAX_INVENTORIES = 4
+
+
+# every ci job starts out in a fresh container, so every run pays for starting the interpreter, parsing the inventory
+# yaml, building the label indexes and compiling the templates before it renders a thing.  the service does all of
+# that once and hangs on to it: each request carries the same arguments the cli takes and gets the rendered pipeline
+# back.
+#
+# the inventory files are watched by their modified time and size, whenever one of them changes (or a file is added
+# to a config directory) the inventory is loaded again on the next request.  jinja already checks the templates for
+# changes on its own, and the pipeline and variable files are small enough to simply be read on every request.
+#
+# requests are handled on a thread each.  everything shared between them (the inventories and the template
+# registries) is only ever read once it has been loaded.  the bookkeeping happens under a lock, loading an inventory
+# only holds up the requests waiting on that same inventory (each one being loaded has a lock of its own).
+class PipelineService:
+    max_inventories: int
+
+    _lock: threading.Lock
+    _inventories: "OrderedDict[Tuple, Tuple[Tuple, Inventory]]"
+    _loading: Dict[Tuple, threading.Lock]
+    _templates: Dict[Union[str, None], TemplateRegistry]
+
+    def __init__(self, max_inventories: int = MAX_INVENTORIES):
+        self.max_inventories = max_inventories
+
+        self._lock = threading.Lock()
+        self._inventories = OrderedDict()
+        self._loading = {}
+        self._templates = {}
+
+    def inventory(self, config_files: List[str], inventory_cache: Union[InventoryCache, None], workers: int,
+                  index_mode: str) -> Inventory:
+        inventory_key = (tuple(config_files), index_mode)
+        signature = _signature(config_files)
+        with self._lock:
+            inventory = self._loaded_inventory(inventory_key, signature)
+            if inventory is not None:
+                return inventory
+
+            loading = self._loading.setdefault(inventory_key, threading.Lock())
+
+        with loading:
+            # whoever held the lock before us may well have just loaded the very same files
+            with self._lock:
+                inventory = self._loaded_inventory(inventory_key, signature)
+                if inventory is not None:
+                    return inventory
+
+            try:
+                logger.info("Loading Inventory: %s", ', '.join(config_files))
+                inventory = load_inventory(config_files, inventory_cache, workers, index_mode)
+
+                # the posting lists are built lazily, get that done now rather than have concurrent requests race to
+                # do it
+                _ = inventory.host_index.postings, inventory.package_index.postings
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(inventory_key, None)
+                raise
+
+            # anyone still waiting on the lock finds the inventory loaded, so the lock can go
+            with self._lock:
+                self._loading.pop(inventory_key, None)
+                self._inventories[inventory_key] = (signature, inventory)
+                self._inventories.move_to_end(inventory_key)
+                while len(self._inventories) > self.max_inventories:
+                    evicted_key, _ = self._inventories.popitem(last=False)
+                    logger.info("Dropping Inventory: %s", ', '.join(evicted_key[0]))
+
+            return inventory
+
+    def _loaded_inventory(self, inventory_key: Tuple, signature: Tuple) -> Union[Inventory, None]:
+        # called with the lock held
+        loaded = self._inventories.get(inventory_key)
+        if loaded is None or loaded[0] != signature:
+            return None
+
+        self._inventories.move_to_end(inventory_key)
+        return loaded[1]
+
+    def templates(self, cache_dir: Union[str, None]) -> TemplateRegistry:
+        with self._lock:
+            if cache_dir not in self._templates:
+                self._templates[cache_dir] = TemplateRegistry(cache_dir)
+
+            return self._templates[cache_dir]
+
+    def render(self, argv: Iterable[str]) -> Tuple[int, str]:
+        parser = add_arguments(_RequestArgumentParser(prog='deploy-pipeline', add_help=False))
+        args = vars(parser.parse_args(list(argv)))
+
+        # forking the worker pools out of a process full of request threads is asking for a deadlock, everything is
+        # done in the request's own thread.  the rest of the run level arguments (logging, metrics and profiling)
+        # belong to the service, they are ignored here.
+        args['jobs'] = 1
+
+        # nothing is recorded, the instrumentation does next to nothing without a recording to go to
+        stream = io.StringIO()
+        result = deploy_pipeline(args, self.inventory, self.templates(args.get('template_cache_dir')), stream)
+
+        return result, stream.getvalue()
+
+
+class _RequestArgumentParser(argparse.ArgumentParser):
+    # argparse prints the error and exits the process, the service hands it back to the client instead (which is also
+    # why there is no --help in a request)
+    def error(self, message: str):
+        raise RequestException(message)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # GET /health - 200 once the service is up
+    # POST /render - {"args": ["--pipeline", "pipeline.yml", "--config", "hosts.yml", ...]}, answers with the rendered
+    #                pipeline (empty when --output was passed, the pipeline is written to that file instead as usual)
+    def do_GET(self):
+        if self.path != '/health':
+            return self._respond(404, 'Not Found')
+
+        self._respond(200, 'OK')
+
+    def do_POST(self):
+        if self.path != '/render':
+            return self._respond(404, 'Not Found')
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+            argv = request.get('args') if isinstance(request, dict) else None
+            if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+                raise RequestException('Expected a JSON Object With a List of Arguments Under "args"')
+
+            result, rendered = self.server.service.render(argv)
+        except (RequestException, ValueError) as e:
+            return self._respond(400, str(e))
+        except Exception as e:
+            logger.exception("Request Failed")
+            return self._respond(500, f'{type(e).__name__}: {e}')
+
+        # the run itself failed (i.e. nothing matched the label queries), the reason is in the service's log
+        if result:
+            return self._respond(422, f'Exited With Status {result}')
+
+        self._respond(200, rendered, 'application/yaml')
+
+    def _respond(self, status: int, body: str, content_type: str = 'text/plain'):
+        encoded = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format: str, *args):
+        # the client address is an empty string on a unix socket, which the stock implementation chokes on
+        logger.debug(format, *args)
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service: PipelineService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                  socket_path: str = None) -> Union[ThreadingHTTPServer, _ThreadingUnixHTTPServer]:
+    if socket_path:
+        # a socket left behind by a previous service that didn't shut down cleanly would fail the bind
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        server = _ThreadingUnixHTTPServer(socket_path, _RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), _RequestHandler)
+
+    server.service = service
+    return server
+
+
+def main(argv: Iterable[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='deploy-pipeline serve',
+        description='keep the inventory, label indexes and templates loaded and render pipelines on request'
+    )
+
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on')
+
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+
+    parser.add_argument('--socket', metavar='<path to socket>',
+                        help='listen on a unix socket rather than a tcp port')
+
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default=DEFAULT_CONFIG['global']['general']['log_level'],
+                        help='only log messages at or above this level')
+
+    parser.add_argument('--max-inventories', metavar='N', type=int, default=MAX_INVENTORIES,
+                        help='number of inventories to keep loaded, the least recently used is dropped first')
+
+    args = parser.parse_args(argv)
+
+    log_listener = start_logging(logger, args.log_level, DEFAULT_CONFIG['global']['general']['log_format'])
+    server = create_server(PipelineService(args.max_inventories), args.host, args.port, args.socket)
+    logger.info("Listening on %s", args.socket or f'{args.host}:{server.server_address[1]}')
+
+    # containers get stopped with a SIGTERM, it is treated like a ctrl-c so the service still shuts down cleanly
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.unlink(args.socket)
+
+        stop_logging(logger, log_listener)
+
+    return 0
+
+
+def _signature(paths: List[str]) -> Tuple:
+    # a file that can't be stat'ed is left for the load that follows to report
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+
+    return tuple(signature)
+
+
+class RequestException(Exception):
+    pass
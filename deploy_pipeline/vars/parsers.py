@@ -26,8 +26,16 @@ def with_env_var(variable_name: str, inputs: Dict = None) -> Dict:
 
 
 def with_var_file(input_file: str, inputs: Dict = None) -> Dict:
+    return with_vars(load_var_file(input_file), inputs)
+
+
+def with_vars(new_values: Dict, inputs: Dict = None) -> Dict:
+    return _merge_inputs(new_values, inputs)
+
+
+def load_var_file(input_file: str) -> Dict:
     with open(input_file) as f:
-        return _merge_inputs(json.load(f), inputs)
+        return json.load(f)
 
 
 def with_key_value(k: str, v: str) -> Dict:
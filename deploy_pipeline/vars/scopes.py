@@ -0,0 +1,36 @@
+from collections import ChainMap
+from typing import Dict, Iterable, Mapping
+from deploy_pipeline.vars.parsers import with_var, with_env_var
+
+
+# variables used to be merged one source at a time ({**inputs, **new_values}), copying everything merged so far for
+# every var file, cli var and environment variable.  instead each kind of source gets its own layer which is filled in
+# place, and the layers are stacked with the highest precedence first: env > cli > files.  lookups fall through the
+# layers, so a later source still overrides an earlier one exactly like the old merging did.
+def variable_scope(file_vars: Iterable[Dict] = (), cli_vars: Iterable[str] = (),
+                   env_vars: Iterable[str] = ()) -> ChainMap:
+    return ChainMap(
+        _layer(with_env_var(env_var) for env_var in env_vars),
+        _layer(with_var(cli_var) for cli_var in cli_vars),
+        _layer(file_vars)
+    )
+
+
+def job_scope(scope: Mapping, job_variables: Dict) -> Dict:
+    # the job's own variables sit on top of everything else (that's how {**variables, **job.variables} behaved), the
+    # result is resolved into a plain dict once per job and shared by every host the job is rendered for
+    return resolve_scope(ChainMap(job_variables, scope))
+
+
+def resolve_scope(scope: Mapping) -> Dict:
+    # flatten the layers into the dict the templates get.  the keys come out in the order they were first seen, the
+    # same order the old merging produced.
+    return dict(scope)
+
+
+def _layer(values: Iterable[Dict]) -> Dict:
+    layer = {}
+    for value in values:
+        layer.update(value)
+
+    return layer
@@ -0,0 +1,49 @@
+from benchmarks.generate import generate_hosts, generate_packages, write_inventory
+from benchmarks.run import run_benchmark, compare_results, STAGES
+from deploy_pipeline.inventory.loader import load_config
+
+
+def test_generate_deterministic():
+    packages = generate_packages(20, seed=1)
+    assert generate_packages(20, seed=1) == packages
+    assert generate_hosts(50, sorted(packages), seed=1) == generate_hosts(50, sorted(packages), seed=1)
+    assert generate_hosts(50, sorted(packages), seed=1) != generate_hosts(50, sorted(packages), seed=2)
+
+
+def test_write_inventory(tmp_path):
+    files = write_inventory(str(tmp_path), 50)
+    config = load_config([files.hosts, files.packages])
+
+    assert len(config['hosts']) == 50
+    assert len(config['packages']) == 20
+
+
+def test_run_benchmark(tmp_path):
+    files = write_inventory(str(tmp_path), 50)
+    results = run_benchmark(files, str(tmp_path / "output.yml"))
+
+    assert list(results) == list(STAGES)
+    assert all(r['seconds'] >= 0 and r['peak_bytes'] >= 0 for r in results.values())
+    assert (tmp_path / "output.yml").read_text().startswith("stages:")
+
+
+def test_compare_results():
+    baseline = {'scales': {'1000': {
+        'render': {'seconds': 1.0, 'peak_bytes': 1000},
+        'write': {'seconds': 0.001, 'peak_bytes': 1000},
+    }}}
+
+    assert compare_results({'scales': {'1000': {
+        'render': {'seconds': 1.1, 'peak_bytes': 1100},
+        # way slower, but still too quick to be anything but noise
+        'write': {'seconds': 0.005, 'peak_bytes': 1000},
+        # not in the baseline
+        'group': {'seconds': 10.0, 'peak_bytes': 10000},
+    }}}, baseline) == []
+
+    assert compare_results({'scales': {'1000': {
+        'render': {'seconds': 2.0, 'peak_bytes': 2000},
+    }}}, baseline) == [
+        '1000 hosts, render: 2.000s (baseline 1.000s)',
+        '1000 hosts, render: 2000 bytes (baseline 1000 bytes)',
+    ]
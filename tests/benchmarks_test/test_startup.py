@@ -0,0 +1,43 @@
+import os
+import pytest
+from benchmarks.startup import parse_importtime, check_budget, measure_startup, ImportTime
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       498 |       1267 | _frozen_importlib_external
+import time:      2317 |       2533 |   deploy_pipeline.labels.indexing
+import time:      6382 |      50872 | deploy_pipeline.main
+usage: deploy-pipeline [-h] --pipeline <path to pipeline config>.yml
+"""
+
+
+def test_parse_importtime():
+    assert parse_importtime(IMPORTTIME_OUTPUT) == [
+        ImportTime('_frozen_importlib_external', 498, 1267, 0),
+        ImportTime('deploy_pipeline.labels.indexing', 2317, 2533, 1),
+        ImportTime('deploy_pipeline.main', 6382, 50872, 0),
+    ]
+
+
+def test_check_budget():
+    import_times = parse_importtime(IMPORTTIME_OUTPUT)
+
+    assert check_budget(import_times, 60) == []
+    assert check_budget(import_times + [ImportTime('yaml', 100, 1000, 1)], 40) == [
+        'yaml imported at startup',
+        'deploy_pipeline.main took 50.9ms to import (budget 40ms)',
+    ]
+
+
+def test_startup_deferred():
+    # --help (or a bad argument) shouldn't pay for yaml, jinja or the label and pipeline modules
+    import_times = measure_startup(['--help'], repeat=1)
+
+    assert 'deploy_pipeline.main' in {import_time.name for import_time in import_times}
+    assert check_budget(import_times, budget_ms=float('inf')) == []
+
+
+# wall clock time depends on whatever else the machine is up to, so the budget is only held to when asked for (i.e. on
+# a quiet machine, the same as running python -m benchmarks.startup)
+@pytest.mark.skipif(not os.environ.get('DEPLOY_PIPELINE_BENCHMARKS'), reason='set DEPLOY_PIPELINE_BENCHMARKS=1')
+def test_startup_budget():
+    assert check_budget(measure_startup(['--help'], repeat=3)) == []
@@ -0,0 +1,105 @@
+import os
+import time
+from deploy_pipeline.inventory.cache import InventoryCache
+from deploy_pipeline.labels.matching import build_label_index
+
+
+class CountingLoader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path) as f:
+            return {"content": f.read()}
+
+
+def test_cache_load(tmp_path):
+    config_path = tmp_path / "hosts.yml"
+    config_path.write_text("hosts: {}")
+    loader = CountingLoader()
+
+    assert InventoryCache(str(tmp_path / "cache")).load(str(config_path), loader) == {"content": "hosts: {}"}
+    # a fresh cache (i.e. the next run) should read the stored entry rather than calling the loader
+    assert InventoryCache(str(tmp_path / "cache")).load(str(config_path), loader) == {"content": "hosts: {}"}
+    assert loader.calls == 1
+
+
+def test_cache_content_change(tmp_path):
+    config_path = tmp_path / "hosts.yml"
+    config_path.write_text("hosts: {}")
+    loader = CountingLoader()
+
+    InventoryCache(str(tmp_path / "cache")).load(str(config_path), loader)
+    config_path.write_text("hosts: {host-1: {}}")
+    assert InventoryCache(str(tmp_path / "cache")).load(str(config_path), loader) == {"content": "hosts: {host-1: {}}"}
+    assert loader.calls == 2
+
+
+def test_cache_corrupt_entry(tmp_path):
+    config_path = tmp_path / "hosts.yml"
+    config_path.write_text("hosts: {}")
+    cache_dir = tmp_path / "cache"
+    loader = CountingLoader()
+
+    InventoryCache(str(cache_dir)).load(str(config_path), loader)
+    for entry in os.listdir(cache_dir):
+        if entry.startswith("data-"):
+            (cache_dir / entry).write_bytes(b"")
+
+    assert InventoryCache(str(cache_dir)).load(str(config_path), loader) == {"content": "hosts: {}"}
+    assert loader.calls == 2
+
+
+def test_cache_label_index(tmp_path, host_data):
+    config_path = tmp_path / "hosts.yml"
+    config_path.write_text("hosts: {}")
+
+    label_index = InventoryCache(str(tmp_path / "cache")).label_index([str(config_path)], "hosts", host_data, "labels")
+    assert label_index == build_label_index(host_data, "labels")
+
+    # the second lookup is served from the cache, so it doesn't matter what source is passed in
+    assert InventoryCache(str(tmp_path / "cache")).label_index([str(config_path)], "hosts", {}, "labels") == label_index
+
+
+def test_cache_text_entry(tmp_path):
+    cache = InventoryCache(str(tmp_path / "cache"))
+    assert cache.read_text("output", "key") is None
+
+    # the chunks pass straight through and the entry shows up once they have all been consumed
+    assert list(cache.write_text("output", "key", ["foo", "bar"])) == ["foo", "bar"]
+    assert "".join(cache.read_text("output", "key")) == "foobar"
+
+    # a consumer bailing out part way doesn't leave anything behind
+    chunks = cache.write_text("output", "other", ["foo", "bar"])
+    next(chunks)
+    chunks.close()
+    assert cache.read_text("output", "other") is None
+    assert not [f for f in os.listdir(tmp_path / "cache") if f.endswith(".tmp")]
+
+
+def test_cache_prune(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache = InventoryCache(str(cache_dir), max_entries=2, max_age=3600)
+    for key in ("old", "a", "b", "c"):
+        cache.put("fragments", key, key)
+
+    # entries of another cache version, ones unused for too long and past the limit the least recently used ones go
+    now = time.time()
+    (cache_dir / "fragments-v0-key.pickle").write_bytes(b"")
+    (cache_dir / "notes.txt").write_text("not an entry")
+    for age, key in ((7200, "old"), (30, "a"), (20, "b"), (10, "c")):
+        os.utime(cache_dir / f"fragments-v1-{key}.pickle", (now - age, now - age))
+    os.unlink(cache_dir / ".pruned")
+
+    cache = InventoryCache(str(cache_dir), max_entries=2, max_age=3600)
+    cache.put("fragments", "d", "d")
+    assert sorted(os.listdir(cache_dir)) == [
+        ".pruned", "fragments-v1-b.pickle", "fragments-v1-c.pickle", "fragments-v1-d.pickle", "notes.txt"
+    ]
+
+    # the next run within the hour doesn't go through the whole dir again
+    cache = InventoryCache(str(cache_dir), max_entries=1, max_age=3600)
+    cache.put("fragments", "e", "e")
+    assert len(os.listdir(cache_dir)) == 6
+    assert cache.get("fragments", "c") == "c"
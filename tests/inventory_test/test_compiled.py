@@ -0,0 +1,143 @@
+import argparse
+import datetime
+import io
+import os
+import struct
+import pytest
+from benchmarks.generate import write_inventory
+from deploy_pipeline.inventory.compiled import compile_inventory, open_inventory, is_compiled_inventory, main, \
+    CompiledInventoryException, MAGIC
+from deploy_pipeline.inventory.loader import load_config
+from deploy_pipeline.labels.indexing import INDEX_MODES
+from deploy_pipeline.labels.matching import build_label_index, LabelIndex, new_query, Operator, INDEX_BITSET
+from deploy_pipeline.main import add_arguments, deploy_pipeline, load_inventory
+
+
+@pytest.fixture
+def inventory_files(tmp_path):
+    return write_inventory(str(tmp_path), 200)
+
+
+@pytest.fixture
+def typed_config():
+    return {
+        "hosts": {
+            "host-1": {"labels": {"stage": 0, "canary": True, "weight": 1.5}, "packages": ["package-1", "package-2"]},
+            "host-2": {"labels": {"stage": "0", "canary": False, "zone": None}, "packages": []},
+            "host-3": {"labels": {}, "packages": ["package-2", "package-3"], "name": "HOST_3"},
+            4: {"labels": {"stage": 1}, "packages": ["package-1"]},
+        },
+        "packages": {
+            "package-1": {"labels": {"type": "binary"}},
+            "package-2": {"labels": {"type": "index", "1": 1}},
+        },
+    }
+
+
+def test_compiled_inventory(tmp_path, typed_config):
+    path = str(tmp_path / "inventory.dpinv")
+    compile_inventory(typed_config, path)
+    inventory = open_inventory(path)
+
+    # the sections read just like the config did, less anything the pipeline doesn't use (i.e. the name of host-3)
+    assert list(inventory.hosts) == ["host-1", "host-2", "host-3", 4]
+    assert {k: dict(v) for k, v in inventory.hosts.items()} == {
+        k: {"labels": v["labels"], "packages": v["packages"]} for k, v in typed_config["hosts"].items()
+    }
+    assert {k: dict(v) for k, v in inventory.packages.items()} == typed_config["packages"]
+
+    # the types are kept, 0 and "0" (and 1 and True) are different labels
+    assert [type(inventory.hosts[k]["labels"].get("stage")) for k in ("host-1", "host-2", "host-3")] == [
+        int, str, type(None)
+    ]
+    assert inventory.hosts["host-1"]["labels"]["canary"] is True
+    assert "host-5" not in inventory.hosts
+    with pytest.raises(KeyError):
+        inventory.hosts["host-5"]
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_compiled_postings(tmp_path, inventory_files, index_mode):
+    config = load_config([inventory_files.hosts, inventory_files.packages])
+    path = str(tmp_path / "inventory.dpinv")
+    compile_inventory(config, path)
+    inventory = open_inventory(path)
+
+    for section_name in ("hosts", "packages"):
+        expected = build_label_index(config[section_name], "labels", index_mode)
+        postings = getattr(inventory, section_name).postings(index_mode)
+
+        # same index keys, in the same order, and the same posting lists behind them
+        assert list(postings.keys()) == list(expected.keys())
+        if index_mode == INDEX_BITSET:
+            assert all(postings.bits(k) == expected.bits(k) for k in expected.keys())
+        else:
+            assert all(postings[k] == expected[k] for k in expected.keys())
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_compiled_label_index(tmp_path, typed_config, index_mode):
+    path = str(tmp_path / "inventory.dpinv")
+    compile_inventory(typed_config, path)
+    hosts = open_inventory(path).hosts
+
+    label_index = LabelIndex(hosts, "labels", index_mode, hosts.postings(index_mode))
+    assert label_index.match().add_query(new_query("stage", Operator.In, [0])).do() == {"host-1"}
+    assert label_index.match().add_query(new_query("stage", Operator.In, ["0"])).do() == {"host-2"}
+    assert label_index.match().add_query(new_query("stage", Operator.DoesNotExist)).do() == {"host-3"}
+    assert label_index.match(label_index.restrict({"host-1", 4})).add_query(
+        new_query("canary", Operator.NotIn, [True])
+    ).do() == {4}
+
+
+def render(args) -> str:
+    stream = io.StringIO()
+    assert deploy_pipeline(vars(add_arguments(argparse.ArgumentParser()).parse_args(args)), stream=stream) == 0
+    return stream.getvalue()
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_compiled_deploy_pipeline(tmp_path, inventory_files, index_mode):
+    path = str(tmp_path / "inventory.dpinv")
+    assert main(["--config", inventory_files.hosts, inventory_files.packages, "--output", path]) == 0
+    assert is_compiled_inventory(path)
+    assert not is_compiled_inventory(inventory_files.hosts)
+
+    # the compiled inventory renders exactly the same pipeline as the yaml it was compiled from
+    args = ["--pipeline", inventory_files.pipeline, "--vars", "foo=bar", "--index-mode", index_mode]
+    assert render(args + ["--config", path]) == render(
+        args + ["--config", inventory_files.hosts, inventory_files.packages]
+    )
+
+
+def test_compiled_inventory_invalid(tmp_path, inventory_files):
+    path = str(tmp_path / "inventory.dpinv")
+    compile_inventory({"hosts": {}}, path)
+
+    # it is the whole inventory, there is nothing to merge it with
+    with pytest.raises(CompiledInventoryException):
+        load_inventory([path, inventory_files.packages], None, 1, "set")
+
+    with pytest.raises(CompiledInventoryException):
+        compile_inventory({"hosts": {"host-1": {"labels": {"built": datetime.date(2021, 1, 1)}}}}, path)
+
+    with pytest.raises(CompiledInventoryException):
+        open_inventory(inventory_files.hosts)
+
+    # a file compiled by another version of the format has to be compiled again
+    (tmp_path / "old.dpinv").write_bytes(struct.pack('<6sHQ', MAGIC, 0, 0))
+    with pytest.raises(CompiledInventoryException):
+        open_inventory(str(tmp_path / "old.dpinv"))
+
+
+def test_compiled_inventory_permissions(tmp_path, typed_config):
+    path = str(tmp_path / "inventory.dpinv")
+    previous = os.umask(0o022)
+    try:
+        compile_inventory(typed_config, path)
+    finally:
+        os.umask(previous)
+
+    # readable by everyone like any other file written out, and nothing left behind next to it
+    assert os.stat(path).st_mode & 0o777 == 0o644
+    assert os.listdir(tmp_path) == ["inventory.dpinv"]
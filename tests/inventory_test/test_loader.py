@@ -0,0 +1,78 @@
+import pytest
+from deploy_pipeline.inventory.cache import InventoryCache
+from deploy_pipeline.inventory.loader import load_config_file, load_config, expand_config_paths, merge_config, \
+    InventoryConflictException, InventoryException
+
+
+def test_load_config_file(tmp_path):
+    config_path = tmp_path / "hosts.yml"
+    config_path.write_text("hosts:\n  host-1:\n    labels: {stage: 0}\n")
+    expected = {"hosts": {"host-1": {"labels": {"stage": 0}}}}
+
+    assert load_config_file(str(config_path)) == expected
+    assert load_config_file(str(config_path), InventoryCache(str(tmp_path / "cache"))) == expected
+
+
+@pytest.fixture
+def sharded_config(tmp_path):
+    config_dir = tmp_path / "inventory"
+    config_dir.mkdir()
+    (config_dir / "hosts-0.yml").write_text("hosts:\n  host-1: {labels: {stage: 0}}\n  host-2: {labels: {stage: 1}}\n")
+    (config_dir / "hosts-1.yaml").write_text("hosts:\n  host-3: {labels: {stage: 0}}\n")
+    (config_dir / "packages.yml").write_text("packages:\n  package-1: {labels: {}}\n")
+    (config_dir / "README.md").write_text("not config")
+    return config_dir
+
+
+def test_expand_config_paths(tmp_path, sharded_config):
+    extra_path = str(tmp_path / "extra.yml")
+    assert expand_config_paths([str(sharded_config), extra_path]) == [
+        str(sharded_config / "hosts-0.yml"),
+        str(sharded_config / "hosts-1.yaml"),
+        str(sharded_config / "packages.yml"),
+        extra_path,
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_load_sharded_config(sharded_config, workers):
+    config = load_config(expand_config_paths([str(sharded_config)]), workers=workers)
+    assert config == {
+        "hosts": {
+            "host-1": {"labels": {"stage": 0}},
+            "host-2": {"labels": {"stage": 1}},
+            "host-3": {"labels": {"stage": 0}},
+        },
+        "packages": {"package-1": {"labels": {}}}
+    }
+
+
+def test_merge_config():
+    config = {"global": {"general": {}}}
+    merge_config(config, {"hosts": {"host-1": {"labels": {}}}, "global": {"other": {}}}, "a.yml")
+    # the same definition in two files isn't a conflict
+    merge_config(config, {"hosts": {"host-1": {"labels": {}}, "host-2": {"labels": {}}}}, "b.yml")
+
+    assert config == {
+        "global": {"other": {}},
+        "hosts": {"host-1": {"labels": {}}, "host-2": {"labels": {}}}
+    }
+
+
+def test_merge_config_conflict():
+    origins = {}
+    config = merge_config({}, {"hosts": {"host-1": {"labels": {"stage": 0}}}}, "a.yml", origins)
+
+    with pytest.raises(InventoryConflictException, match="a.yml and b.yml"):
+        merge_config(config, {"hosts": {"host-1": {"labels": {"stage": 1}}}}, "b.yml", origins)
+
+
+def test_merge_config_empty_sections():
+    # a shard with every host commented out loads as hosts: null
+    config = merge_config({}, {"hosts": None, "packages": None}, "a.yml")
+    merge_config(config, {"hosts": {"host-1": {"labels": {}}}, "packages": None}, "b.yml")
+
+    assert config == {"hosts": {"host-1": {"labels": {}}}, "packages": {}}
+
+    with pytest.raises(InventoryException, match="'hosts' in c.yml"):
+        merge_config(config, {"hosts": ["host-2"]}, "c.yml")
@@ -0,0 +1,113 @@
+import sys
+import pytest
+import deploy_pipeline.metrics.metrics as metrics
+from deploy_pipeline.labels.caching import MatchCache, MatchCacheStats, result_size
+from deploy_pipeline.labels.indexing import INDEX_MODES
+from deploy_pipeline.labels.matching import LabelIndex, new_query, Operator, INDEX_BITSET
+
+
+def test_match_cache_lru():
+    match_cache = MatchCache(budget=30)
+    match_cache.put('a', 1, 10)
+    match_cache.put('b', 2, 10)
+    match_cache.put('c', 3, 10)
+
+    # a is used most recently, so b is the one to go
+    assert match_cache.get('a') == 1
+    match_cache.put('d', 4, 10)
+
+    assert match_cache.get('b') is None
+    assert [match_cache.get(k) for k in ('a', 'c', 'd')] == [1, 3, 4]
+    assert match_cache.stats() == MatchCacheStats(hits=4, misses=1, evictions=1, entries=3, size=30, budget=30)
+
+
+def test_match_cache_budget():
+    match_cache = MatchCache(budget=30)
+    match_cache.put('a', 1, 10)
+    match_cache.put('a', 2, 20)
+
+    # replacing an entry frees up what it used, anything bigger than the whole budget isn't kept at all
+    assert match_cache.get('a') == 2
+    assert match_cache.stats().size == 20
+
+    match_cache.put('b', 3, 31)
+    assert match_cache.get('b') is None
+    assert match_cache.get('a') == 2
+
+    match_cache.clear()
+    assert match_cache.get('a') is None
+    assert match_cache.stats().size == 0
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_label_match_cached(host_data, index_mode):
+    match_cache = MatchCache()
+    label_index = LabelIndex(host_data, 'labels', index_mode, match_cache=match_cache)
+    queries = [
+        new_query('pogo.deploy.environment', Operator.In, ('prod-aws',)),
+        new_query('pogo.test.data', Operator.Exists)
+    ]
+
+    with metrics.recording() as recorded:
+        first = label_index.match().add_queries(queries)
+        matched = first.do()
+
+        # the same queries in any order hand back the very same (frozen) result, and the plan that came with it
+        second = label_index.match().add_queries(reversed(queries))
+        assert second.do() is matched
+        assert second.explain() == first.explain()
+
+    assert matched == {'ora-del-sup-001', 'orb-del-sup-001', 'ora-del-sup-007'}
+    assert isinstance(matched, frozenset)
+    assert recorded.counters['label_match.cache_hits'] == 1
+    assert recorded.counters['label_match.cache_misses'] == 1
+    assert recorded.counters['label_match.queries'] == 2
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_label_match_cache_keys(host_data, index_mode):
+    match_cache = MatchCache()
+    label_index = LabelIndex(host_data, 'labels', index_mode, match_cache=match_cache)
+    query = new_query('pogo.test.data', Operator.Exists)
+
+    assert label_index.match().add_query(query).do() == {'ora-del-sup-001', 'orb-del-sup-001', 'ora-del-sup-007'}
+
+    # other candidates are another question, the same ones are the same question however they were passed in (as
+    # long as the index would hand them back in that form)
+    candidates = label_index.restrict({'ora-del-sup-001', 'se3-del-sup-001'})
+    assert label_index.match(candidates).add_query(query).do() == {'ora-del-sup-001'}
+    assert label_index.match({'ora-del-sup-001', 'se3-del-sup-001'}).add_query(query).do() == {'ora-del-sup-001'}
+    assert match_cache.stats().hits == (0 if index_mode == INDEX_BITSET else 1)
+
+    # so is another index over a different source, even with the same queries
+    other_index = LabelIndex({'orx-del-sup-001': {'labels': {'pogo.test.data': 'True'}}}, 'labels', index_mode,
+                             match_cache=match_cache)
+    assert other_index.version != label_index.version
+    assert other_index.match().add_query(query).do() == {'orx-del-sup-001'}
+    assert match_cache.stats().entries == (4 if index_mode == INDEX_BITSET else 3)
+
+
+def test_label_match_uncached(host_data):
+    # an index without a match cache runs every query
+    label_index = LabelIndex(host_data, 'labels')
+    query = new_query('pogo.test.data', Operator.Exists)
+
+    with metrics.recording() as recorded:
+        assert label_index.match().add_query(query).do() == label_index.match().add_query(query).do()
+
+    assert 'label_match.cache_hits' not in recorded.counters
+    assert recorded.counters['label_match.queries'] == 2
+
+
+def test_result_size():
+    query = new_query('pogo.deploy.environment', Operator.In, ('prod-aws', 'canary'))
+    result = frozenset({'ora-del-sup-001', 'orb-del-sup-001'})
+
+    # the containers nested in the key and the plan count as well, shared objects count once
+    assert result_size(result) == sys.getsizeof(result)
+    assert result_size((1, frozenset([query])), result, [query]) == sum(sys.getsizeof(v) for v in (
+        (1, frozenset([query])), 1, frozenset([query]), result, [query], query, query.values
+    ))
+
+    # the bitset candidates are one big int
+    assert result_size((1, frozenset(), 1 << 4096)) > 512
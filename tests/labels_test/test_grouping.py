@@ -1,5 +1,8 @@
 import pytest
 from deploy_pipeline.labels.grouping import LabelGroup
+from deploy_pipeline.labels.indexing import INDEX_MODES
+from deploy_pipeline.labels.matching import LabelIndex
+from deploy_pipeline.labels.utils import with_data
 
 
 @pytest.mark.parametrize("source,sub_key,group_label,expected", [
@@ -42,5 +45,50 @@ from deploy_pipeline.labels.grouping import LabelGroup
             }
     )
 ])
-def test_grouping(source, sub_key, group_label, expected):
-    assert LabelGroup(source, sub_key).group(group_label) == expected
+@pytest.mark.parametrize("index_mode", (None,) + INDEX_MODES)
+def test_grouping(source, sub_key, group_label, expected, index_mode):
+    label_index = LabelIndex(source, sub_key, index_mode) if index_mode else None
+    assert LabelGroup(source, sub_key, label_index).group(group_label) == expected
+
+
+@pytest.mark.parametrize("index_mode", (None,) + INDEX_MODES)
+def test_grouping_view(index_mode):
+    source = {
+        "key_1": {"labels": {"group_label": 1}},
+        "key_2": {"labels": {"group_label": 2}},
+        "key_3": {"labels": {"group_label": 2}},
+    }
+    label_index = LabelIndex(source, "labels", index_mode) if index_mode else None
+
+    assert LabelGroup(with_data({"key_1", "key_2"}, source), "labels", label_index).group("group_label") == {
+        1: {"key_1"},
+        2: {"key_2"}
+    }
+
+
+@pytest.mark.parametrize("index_mode", (None,) + INDEX_MODES)
+def test_grouping_composite(host_data, index_mode):
+    label_index = LabelIndex(host_data, "labels", index_mode) if index_mode else None
+
+    assert LabelGroup(host_data, "labels", label_index).group(("pogo.deploy.environment", "pogo.deploy.stage")) == {
+        ("prod-aws", 0): {"ora-del-sup-001", "orb-del-sup-001"},
+        ("prod-aws", 1): {"ora-del-sup-007", "orc-del-sup-001"},
+        ("prod-se3", 0): {"se3-del-sup-001"},
+        ("prod-se3", 1): {"se3-del-sup-007"},
+    }
+
+    # hosts without the label are left out rather than raising
+    assert LabelGroup(host_data, "labels", label_index).group(("pogo.test.data",)) == {
+        ("True",): {"ora-del-sup-001", "ora-del-sup-007", "orb-del-sup-001"}
+    }
+
+
+def test_grouping_postings(host_data):
+    label_index = LabelIndex(host_data, "labels")
+
+    # grouping the whole source hands back the index's posting lists, frozen so the index can't be changed through them
+    groups = LabelGroup(host_data, "labels", label_index).group("pogo.deploy.stage")
+    posting = label_index.posting(("pogo.deploy.stage", 0))
+    assert groups[0] == posting
+    assert groups[0] is not posting
+    assert isinstance(groups[0], frozenset)
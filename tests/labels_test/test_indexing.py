@@ -0,0 +1,38 @@
+import pytest
+from array import array
+from deploy_pipeline.labels.indexing import build_bitset_index, iter_ids
+
+
+@pytest.mark.parametrize("bits,expected", [
+    (0, []),
+    (0b1, [0]),
+    (0b101100, [2, 3, 5]),
+    (1 << 200 | 1 << 64, [64, 200]),
+])
+def test_iter_ids(bits, expected):
+    assert list(iter_ids(bits)) == expected
+
+
+def test_bitset_index(host_data):
+    label_index = build_bitset_index(host_data, 'labels')
+
+    assert len(label_index) == len(host_data)
+    assert label_index.keys_of(label_index.all_bits) == set(host_data)
+    assert label_index.keys_of(label_index.bits(('pogo.deploy.environment', 'prod-se3'))) == {
+        'se3-del-sup-001', 'se3-del-sup-007'
+    }
+    assert ('pogo.test.data',) in label_index
+    assert ('pogo.test.data2',) not in label_index
+    assert label_index.bits(('pogo.test.data2',)) == 0
+
+
+def test_bitset_index_sparse_postings():
+    source = {f'host-{i:03d}': {'labels': {'stage': i % 2, 'name': f'host-{i:03d}'}} for i in range(100)}
+    label_index = build_bitset_index(source, 'labels')
+
+    # a label on a single host is stored as an array of ids, one on half the hosts as a bitmap
+    assert type(label_index._postings[('name', 'host-042')]) is array
+    assert type(label_index._postings[('stage', 0)]) is int
+
+    assert label_index.keys_of(label_index.bits(('name', 'host-042'))) == {'host-042'}
+    assert label_index.keys_of(label_index.bits(('stage', 1))) == {f'host-{i:03d}' for i in range(1, 100, 2)}
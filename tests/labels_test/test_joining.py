@@ -1,5 +1,6 @@
 import pytest
-from deploy_pipeline.labels.joining import LabelJoin
+from deploy_pipeline.labels.joining import LabelJoin, build_join_index
+from deploy_pipeline.labels.utils import with_data
 
 
 @pytest.mark.parametrize("left,left_join_key,right,right_join_key,expected", [
@@ -23,7 +24,34 @@ from deploy_pipeline.labels.joining import LabelJoin
             {"key_1": {"joiner": ["key_3"]}}, "joiner",
             {"key_2": {"key_1"}}
     ),
+    (
+            {"key_1": {}, "key_2": {}}, None,
+            {"key_2": {}, "key_3": {}}, None,
+            {"key_2": {"key_2"}}
+    ),
+    (
+            {"key_1": {"joiner": ["key_3", "key_4"]}, "key_2": {"joiner": ["key_5"]}}, "joiner",
+            {"key_6": {"joiner": ["key_3"]}, "key_7": {"joiner": ["key_4", "key_3"]}, "key_8": {"joiner": []}}, "joiner",
+            {"key_1": {"key_6", "key_7"}}
+    ),
 ])
 def test_joining(left, left_join_key, right, right_join_key, expected):
     joiner = LabelJoin(left, left_join_key).match(right, right_join_key)
     assert joiner == expected
+
+
+def test_join_index():
+    assert build_join_index({"key_1": {"joiner": ["key_3"]}, "key_2": {"joiner": ["key_3", "key_4"]}}, "joiner") == {
+        "key_3": {"key_1", "key_2"},
+        "key_4": {"key_2"}
+    }
+    assert build_join_index({"key_1", "key_2"}) == {"key_1": {"key_1"}, "key_2": {"key_2"}}
+
+
+def test_joining_view():
+    left = {"key_1": {"joiner": ["key_3"]}, "key_2": {"joiner": ["key_4"]}}
+    right = {"key_3": {}, "key_4": {}, "key_5": {}}
+
+    assert LabelJoin(with_data({"key_1"}, left), "joiner").match(with_data({"key_3", "key_4"}, right)) == {
+        "key_1": {"key_3"}
+    }
@@ -1,5 +1,9 @@
 import pytest
-from deploy_pipeline.labels.matching import LabelMatch, new_query, Operator, query_from_object, query_from_string, LabelQuery
+from deploy_pipeline.labels.indexing import INDEX_MODES
+from deploy_pipeline.labels.matching import LabelMatch, new_query, Operator, query_from_object, query_from_string, LabelQuery, \
+    build_label_index, INDEX_SET, INDEX_BITSET, SCAN_THRESHOLD, STRATEGY_INDEX, STRATEGY_SCAN, QueryPlan, \
+    PlanStep, LabelIndex
+from deploy_pipeline.labels.utils import with_data
 
 
 @pytest.mark.parametrize("key,operator,value,expected", [
@@ -12,11 +16,87 @@ from deploy_pipeline.labels.matching import LabelMatch, new_query, Operator, que
     ('pogo.test.data', Operator.DoesNotExist, ('',), {'orc-del-sup-001', 'se3-del-sup-001', 'se3-del-sup-007'}),
     ('pogo.deploy.stage', Operator.DoesNotExist, ('',), set())
 ])
-def test_query_result(host_data, key, operator, value, expected):
-    in_result = LabelMatch(host_data, 'labels').add_query(new_query(key, operator, value)).do()
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+@pytest.mark.parametrize("scan_threshold", [SCAN_THRESHOLD, 0])
+def test_query_result(host_data, key, operator, value, expected, index_mode, scan_threshold):
+    in_result = LabelMatch(host_data, 'labels', index_mode=index_mode, scan_threshold=scan_threshold).add_query(
+        new_query(key, operator, value)
+    ).do()
     assert in_result == expected
 
 
+@pytest.mark.parametrize("queries,expected", [
+    (
+            [
+                new_query('pogo.deploy.environment', Operator.In, ('prod-aws',)),
+                new_query('pogo.test.data', Operator.Exists)
+            ],
+            {'ora-del-sup-001', 'orb-del-sup-001', 'ora-del-sup-007'}
+    ),
+    (
+            [new_query('pogo.deploy.stage', Operator.NotIn, (0,)), new_query('pogo.test.data', Operator.DoesNotExist)],
+            {'orc-del-sup-001', 'se3-del-sup-007'}
+    ),
+    (
+            [
+                new_query('pogo.deploy.stage', Operator.In, (0, 1)),
+                new_query('pogo.deploy.environment', Operator.NotIn, ('prod-aws',))
+            ],
+            {'se3-del-sup-001', 'se3-del-sup-007'}
+    ),
+])
+@pytest.mark.parametrize("index_mode,scan_threshold", [(INDEX_SET, 0), (INDEX_BITSET, 0), (INDEX_SET, SCAN_THRESHOLD)])
+def test_multi_query_result(host_data, queries, expected, index_mode, scan_threshold):
+    assert LabelMatch(host_data, 'labels', index_mode=index_mode, scan_threshold=scan_threshold).add_queries(
+        queries
+    ).do() == expected
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_query_plan(host_data, index_mode):
+    not_in = new_query('pogo.deploy.stage', Operator.NotIn, (0,))
+    exists = new_query('pogo.test.data', Operator.Exists)
+    environment = new_query('pogo.deploy.environment', Operator.In, ('prod-aws',))
+    plan = LabelMatch(host_data, 'labels', index_mode=index_mode, scan_threshold=0).add_queries(
+        [not_in, environment, exists]
+    ).explain()
+
+    # positive queries first, most selective first, negative queries last
+    assert plan == QueryPlan(STRATEGY_INDEX, 6, [
+        PlanStep(exists, 3, 3),
+        PlanStep(environment, 4, 3),
+        PlanStep(not_in, 3, 1),
+    ], 1)
+
+
+def test_query_plan_stops_when_empty(host_data):
+    missing = new_query('pogo.deploy.stage', Operator.In, (2,))
+    not_in = new_query('pogo.deploy.environment', Operator.NotIn, ('prod-se3',))
+    plan = LabelMatch(host_data, 'labels', scan_threshold=0).add_queries([not_in, missing]).explain()
+
+    assert plan.steps == [PlanStep(missing, 0, 0), PlanStep(not_in, 4, None)]
+    assert plan.matched == 0
+
+
+def test_query_plan_scan(host_data):
+    not_in = new_query('pogo.deploy.environment', Operator.NotIn, ('prod-aws',))
+    stage = new_query('pogo.deploy.stage', Operator.In, (0,))
+    query = LabelMatch(host_data, 'labels').add_queries([not_in, stage])
+
+    assert query.do() == {'se3-del-sup-001'}
+    assert query.explain() == QueryPlan(STRATEGY_SCAN, 6, [PlanStep(stage, None, 3), PlanStep(not_in, None, 1)], 1)
+
+
+def test_query_prebuilt_index(host_data):
+    label_index = build_label_index(host_data, 'labels')
+    assert label_index[('pogo.deploy.stage', 1)] == {'ora-del-sup-007', 'orc-del-sup-001', 'se3-del-sup-007'}
+
+    result = LabelMatch(host_data, 'labels', label_index).add_query(
+        new_query('pogo.deploy.stage', Operator.In, (1,))
+    ).do()
+    assert result == {'ora-del-sup-007', 'orc-del-sup-001', 'se3-del-sup-007'}
+
+
 @pytest.mark.parametrize("object_query,expected", [
     (
             {"key": "key_1", "operator": "In", "values": ["value_1"]},
@@ -83,3 +163,43 @@ def test_query_from_object(object_query, expected):
 ])
 def test_query_from_string(string_query, expected):
     assert query_from_string(string_query) == expected
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_index_candidates(host_data, index_mode):
+    label_index = LabelIndex(host_data, 'labels', index_mode)
+    stage_0 = label_index.match().add_query(new_query('pogo.deploy.stage', Operator.In, (0,))).do()
+    candidates = label_index.restrict(stage_0)
+
+    # the same index answers queries restricted to the candidates
+    assert label_index.match(candidates).add_query(
+        new_query('pogo.deploy.environment', Operator.In, ('prod-aws',))
+    ).do() == {'ora-del-sup-001', 'orb-del-sup-001'}
+    assert label_index.match(candidates).add_query(new_query('pogo.test.data', Operator.DoesNotExist)).do() == {
+        'se3-del-sup-001'
+    }
+    assert label_index.match(stage_0).do() == stage_0
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+@pytest.mark.parametrize("scan_threshold", [0, SCAN_THRESHOLD])
+def test_query_view(host_data, index_mode, scan_threshold):
+    source = with_data({'ora-del-sup-001', 'ora-del-sup-007', 'se3-del-sup-001'}, host_data)
+
+    assert LabelMatch(
+        source, 'labels', index_mode=index_mode, scan_threshold=scan_threshold
+    ).add_query(new_query('pogo.deploy.environment', Operator.In, ('prod-aws',))).do() == {
+        'ora-del-sup-001', 'ora-del-sup-007'
+    }
+
+
+def test_index_built_once(host_data):
+    label_index = LabelIndex(host_data, 'labels')
+
+    # small enough to be scanned, so the index isn't built
+    label_index.match().add_query(new_query('pogo.test.data', Operator.Exists)).do()
+    assert not label_index.built
+
+    postings = label_index.postings
+    label_index.match({'ora-del-sup-001'}).add_query(new_query('pogo.test.data', Operator.Exists)).do()
+    assert label_index.postings is postings
@@ -0,0 +1,111 @@
+import pytest
+from deploy_pipeline.labels.indexing import INDEX_MODES
+from deploy_pipeline.labels.matching import new_query, Operator, LabelIndex
+from deploy_pipeline.labels.selectors import compile_selector, combine_selectors, match_selectors, \
+    selector_from_queries, Selector, SelectorSyntaxException
+
+
+@pytest.mark.parametrize("source,expected", [
+    ("key_1", [[new_query("key_1", Operator.Exists)]]),
+    ("!key_1", [[new_query("key_1", Operator.DoesNotExist)]]),
+    ("key_1=value_1", [[new_query("key_1", Operator.In, ["value_1"])]]),
+    ("key_1 == value_1", [[new_query("key_1", Operator.In, ["value_1"])]]),
+    ("key_1!=value_1", [[new_query("key_1", Operator.NotIn, ["value_1"])]]),
+    ("key_1 in (value_2, value_1)", [[new_query("key_1", Operator.In, ["value_1", "value_2"])]]),
+    ("key_1 notin (value_1)", [[new_query("key_1", Operator.NotIn, ["value_1"])]]),
+    ("key_1, !key_2", [[new_query("key_1", Operator.Exists), new_query("key_2", Operator.DoesNotExist)]]),
+    ("key_1 && !key_2", [[new_query("key_1", Operator.Exists), new_query("key_2", Operator.DoesNotExist)]]),
+    ("key_1 || key_2", [[new_query("key_1", Operator.Exists)], [new_query("key_2", Operator.Exists)]]),
+    (
+            "(key_1=value_1 || key_1=value_2), !key_2",
+            [
+                [new_query("key_1", Operator.In, ["value_1"]), new_query("key_2", Operator.DoesNotExist)],
+                [new_query("key_1", Operator.In, ["value_2"]), new_query("key_2", Operator.DoesNotExist)],
+            ]
+    ),
+    ("key_1, key_1 || key_1", [[new_query("key_1", Operator.Exists)]]),
+])
+def test_compile_selector(source, expected):
+    assert compile_selector(source) == Selector(tuple(tuple(group) for group in expected))
+
+
+@pytest.mark.parametrize("source,same_as", [
+    ("key_2, key_1", "key_1 && key_2"),
+    ("key_2 || key_1=value_1", "key_1 = value_1 || key_2"),
+    ("key_1 in (b, a)", "key_1 in (a,b)"),
+    ("(key_1 || key_2), key_3", "key_3, key_2 || key_1, key_3"),
+])
+def test_compile_selector_canonical(source, same_as):
+    # however it was written, the same selector compiles to the same (hashable) plan
+    assert compile_selector(source) == compile_selector(same_as)
+    assert hash(compile_selector(source)) == hash(compile_selector(same_as))
+
+
+def test_compile_selector_cached():
+    assert compile_selector("key_1 || key_2") is compile_selector("key_1 || key_2")
+
+
+@pytest.mark.parametrize("source", [
+    "",
+    "key_1=",
+    "=value_1",
+    "key_1 in ()",
+    "key_1 in value_1",
+    "key_1 value_1",
+    "(key_1",
+    "key_1)",
+    "key_1 ||",
+    "key_1, , key_2",
+])
+def test_compile_selector_invalid(source):
+    with pytest.raises(SelectorSyntaxException):
+        compile_selector(source)
+
+
+@pytest.mark.parametrize("selectors,expected", [
+    (["pogo.test.data"], {'ora-del-sup-001', 'ora-del-sup-007', 'orb-del-sup-001'}),
+    (
+            ["pogo.test.data || pogo.deploy.environment=prod-se3"],
+            {'ora-del-sup-001', 'ora-del-sup-007', 'orb-del-sup-001', 'se3-del-sup-001', 'se3-del-sup-007'}
+    ),
+    (
+            ["(pogo.test.data || pogo.deploy.environment=prod-se3), pogo.deploy.environment notin (prod-aws)"],
+            {'se3-del-sup-001', 'se3-del-sup-007'}
+    ),
+    (
+            ["!pogo.test.data || pogo.deploy.environment=prod-se3", "pogo.deploy.environment in (prod-aws)"],
+            {'orc-del-sup-001'}
+    ),
+    (["pogo.test.data || pogo.test.data2", "!pogo.test.data"], set()),
+    ([], {
+        'ora-del-sup-001', 'ora-del-sup-007', 'orb-del-sup-001', 'orc-del-sup-001', 'se3-del-sup-001',
+        'se3-del-sup-007'
+    }),
+])
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_match_selectors(host_data, selectors, expected, index_mode):
+    label_index = LabelIndex(host_data, 'labels', index_mode)
+    assert match_selectors(label_index, [compile_selector(s) for s in selectors]) == expected
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_match_selectors_candidates(host_data, index_mode):
+    label_index = LabelIndex(host_data, 'labels', index_mode)
+    candidates = label_index.restrict({'ora-del-sup-001', 'orc-del-sup-001', 'se3-del-sup-007'})
+
+    # plain queries mix with compiled selectors, and only the candidates are ever matched
+    assert match_selectors(label_index, [
+        compile_selector("pogo.test.data || pogo.deploy.environment=prod-se3"),
+        new_query('pogo.deploy.stage', Operator.In, (1,))
+    ], candidates) == {'se3-del-sup-007'}
+
+
+def test_combine_selectors():
+    key_1, key_2, key_3 = (new_query(key, Operator.Exists) for key in ('key_1', 'key_2', 'key_3'))
+
+    assert combine_selectors([]) == Selector(((),))
+    assert combine_selectors([key_1, key_2]) == selector_from_queries([key_2, key_1])
+    assert combine_selectors([compile_selector("key_1 || key_2"), key_3]) == Selector((
+        (key_1, key_3),
+        (key_2, key_3),
+    ))
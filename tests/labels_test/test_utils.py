@@ -1,5 +1,5 @@
 import pytest
-from deploy_pipeline.labels.utils import with_data
+from deploy_pipeline.labels.utils import with_data, DataView
 
 
 @pytest.mark.parametrize("keys,data,expected", [
@@ -38,3 +38,29 @@ from deploy_pipeline.labels.utils import with_data
 ])
 def test_with_data(keys, data, expected):
     assert with_data(keys, data) == expected
+
+
+def test_data_view():
+    data = {
+        "key_1": {"name": "Key 1"},
+        "key_2": {"name": "Key 2"},
+        "key_3": {"name": "Key 3"}
+    }
+    view = with_data({"key_1", "key_2"}, data)
+
+    assert isinstance(view, DataView)
+    assert len(view) == 2
+    assert sorted(view) == ["key_1", "key_2"]
+    assert "key_3" not in view
+
+    # nothing is copied, the values are the ones in the backing dict
+    assert view["key_1"] is data["key_1"]
+
+    with pytest.raises(KeyError):
+        view["key_3"]
+
+    with pytest.raises(TypeError):
+        view["key_3"] = {}
+
+    # views can be narrowed further
+    assert with_data(["key_2"], view) == {"key_2": {"name": "Key 2"}}
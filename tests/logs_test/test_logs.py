@@ -0,0 +1,44 @@
+import io
+import logging as log
+from deploy_pipeline.logs import start_logging, stop_logging, LazyJoin
+
+
+class Unformattable:
+    def __str__(self):
+        raise AssertionError("formatted a message that was never going to be written")
+
+
+def test_logging():
+    logger = log.getLogger("deploy-pipeline-test")
+    stream = io.StringIO()
+
+    listener = start_logging(logger, "INFO", "%(levelname)s - %(message)s", stream)
+    logger.info("Rendering Job Template for %s: %s", "host-1", LazyJoin(["property01", "property07"]))
+    logger.debug("Skipped %s", Unformattable())
+    stop_logging(logger, listener)
+
+    assert stream.getvalue() == "INFO - Rendering Job Template for host-1: property01, property07\n"
+    assert not logger.handlers
+
+
+def test_logging_restart():
+    logger = log.getLogger("deploy-pipeline-test")
+    stream = io.StringIO()
+
+    previous_stream = io.StringIO()
+
+    # starting again replaces the previous handler rather than adding another one, and stops its listener (after it
+    # wrote out what it was given)
+    previous = start_logging(logger, "INFO", "%(message)s", previous_stream)
+    logger.info("before")
+    listener = start_logging(logger, "INFO", "%(message)s", stream)
+    assert len(logger.handlers) == 1
+    assert previous_stream.getvalue() == "before\n"
+
+    logger.info("once")
+    stop_logging(logger, previous)
+    stop_logging(logger, listener)
+
+    assert stream.getvalue() == "once\n"
+    assert not logger.handlers
+    assert previous._thread is None and listener._thread is None
@@ -0,0 +1,96 @@
+import json
+import pytest
+import deploy_pipeline.metrics.metrics as metrics
+from deploy_pipeline.labels.joining import LabelJoin
+from deploy_pipeline.labels.indexing import INDEX_MODES
+from deploy_pipeline.labels.matching import new_query, Operator, LabelIndex, LabelMatch
+
+
+def test_not_recording():
+    assert metrics.current() is None
+
+    # nothing to record to, these should be no-ops
+    with metrics.span("span"):
+        metrics.count("counter")
+
+    assert metrics.current() is None
+
+
+def test_recording():
+    with metrics.recording() as recorded:
+        assert metrics.current() is recorded
+
+        for _ in range(3):
+            with metrics.span("span"):
+                metrics.count("counter", 2)
+
+    assert metrics.current() is None
+    assert recorded.spans["span"][0] == 3
+    assert recorded.spans["span"][1] >= recorded.spans["span"][2] >= 0
+    assert recorded.counters == {"counter": 6}
+
+
+def test_recording_instrumented(host_data):
+    with metrics.recording() as recorded:
+        label_index = LabelIndex(host_data, "labels")
+        label_index.match().add_query(new_query("pogo.deploy.stage", Operator.In, (0,))).do()
+        label_index.match().add_query(new_query("pogo.test.data", Operator.Exists)).do()
+        LabelJoin(host_data, "packages").match({"property01"})
+
+    assert recorded.spans["label_match"][0] == 2
+    assert recorded.spans["label_join"][0] == 1
+    assert recorded.counters["label_match.queries"] == 2
+    assert recorded.counters["label_join.matched"] == 6
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+@pytest.mark.parametrize("operator,expected", [(Operator.Exists, 3), (Operator.DoesNotExist, 3)])
+def test_recording_postings_touched(host_data, index_mode, operator, expected):
+    # the negative queries read the same posting lists as the positive ones, whatever is left over after them
+    with metrics.recording() as recorded:
+        LabelMatch(host_data, "labels", index_mode=index_mode, scan_threshold=0).add_query(
+            new_query("pogo.test.data", operator)
+        ).do()
+
+    assert recorded.counters["label_match.postings_touched"] == expected
+
+
+def test_merge():
+    recorded, other = metrics.Metrics(), metrics.Metrics()
+    recorded.add_span("render", 1.0)
+    recorded.count("output.bytes", 100)
+    other.add_span("render", 2.0)
+    other.count("output.bytes", 10)
+    other.count("label_match.queries")
+
+    # i.e. the metrics of a worker process, merged into the run's
+    with metrics.recording(recorded):
+        metrics.merge(other)
+        metrics.merge(None)
+
+    assert recorded.spans == {"render": [2, 3.0, 2.0]}
+    assert recorded.counters == {"output.bytes": 110, "label_match.queries": 1}
+
+
+def test_report_formats(tmp_path):
+    recorded = metrics.Metrics()
+    recorded.add_span("label_match", 0.5)
+    recorded.add_span("label_match", 1.5)
+    recorded.count("output.bytes", 100)
+
+    recorded.write(str(tmp_path / "metrics.json"))
+    assert json.loads((tmp_path / "metrics.json").read_text()) == {
+        "spans": {"label_match": {"count": 2, "total_seconds": 2.0, "max_seconds": 1.5}},
+        "counters": {"output.bytes": 100}
+    }
+
+    recorded.write(str(tmp_path / "metrics.txt"), metrics.FORMAT_OPENMETRICS)
+    assert (tmp_path / "metrics.txt").read_text().splitlines() == [
+        "# TYPE deploy_pipeline_span_seconds summary",
+        "# UNIT deploy_pipeline_span_seconds seconds",
+        'deploy_pipeline_span_seconds_count{span="label_match"} 2',
+        'deploy_pipeline_span_seconds_sum{span="label_match"} 2.0',
+        "# TYPE deploy_pipeline_output_bytes counter",
+        "deploy_pipeline_output_bytes_total 100",
+        "# EOF",
+    ]
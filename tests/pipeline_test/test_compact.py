@@ -0,0 +1,145 @@
+import pytest
+import yaml
+from deploy_pipeline.pipeline.compact import compact_jobs, MATRIX_LIMIT
+from deploy_pipeline.pipeline.pipeline import Job
+from deploy_pipeline.pipeline.render import RenderedStageJob
+
+
+def rendered_stage_job(stage_name, job_name, hosts_packages, template):
+    rendered = [
+        (hostname, packages, template.format(stage=stage_name, job=job_name, host=hostname, packages=packages))
+        for hostname, packages in hosts_packages.items()
+    ]
+    return RenderedStageJob(stage_name, Job(job_name, "deploy"), len(hosts_packages), 1, rendered)
+
+
+JOB_TEMPLATE = (
+    "{stage}-{job}-{host}:\n  stage: {stage}\n  image: deploy:latest\n  variables:\n    ACTION: deploy\n"
+    "    HOST: {host}\n  script:\n    - deploy {packages} on {host}\n"
+)
+
+
+def test_compact_jobs():
+    compacted = compact_jobs([
+        rendered_stage_job("0-deploy", "job", {"host-1": "p1", "host-2": "p1", "host-3": "p2"}, JOB_TEMPLATE),
+        rendered_stage_job("1-deploy", "job", {"host-4": "p1"}, JOB_TEMPLATE),
+    ])
+
+    assert [yaml.safe_load(c) for c in compacted] == [
+        {".compact-job": {"image": "deploy:latest", "variables": {"ACTION": "deploy"}}},
+        {"0-deploy-job-matrix-0": {
+            "extends": ".compact-job",
+            "stage": "0-deploy",
+            "variables": {"HOST": "${DEPLOY_HOSTNAME}"},
+            "script": ["deploy p1 on ${DEPLOY_HOSTNAME}"],
+            "parallel": {"matrix": [{"DEPLOY_HOSTNAME": ["host-1", "host-2"]}]},
+        }},
+        {"0-deploy-job-host-3": {
+            "extends": ".compact-job", "stage": "0-deploy", "variables": {"HOST": "host-3"}, "script": ["deploy p2 on host-3"]
+        }},
+        {"1-deploy-job-host-4": {
+            "extends": ".compact-job", "stage": "1-deploy", "variables": {"HOST": "host-4"}, "script": ["deploy p1 on host-4"]
+        }},
+    ]
+
+
+@pytest.mark.parametrize("template", [
+    # the hostname shows up somewhere gitlab doesn't expand variables
+    "{stage}-{job}-{host}:\n  stage: {stage}\n  tags: [{host}]\n  script:\n    - deploy {packages}\n",
+    # already a parallel job
+    "{stage}-{job}-{host}:\n  stage: {stage}\n  parallel: 2\n  script:\n    - deploy {packages}\n",
+    # the shell doesn't expand variables in single quotes, escaped or in heredocs
+    "{stage}-{job}-{host}:\n  script:\n    - echo '{host}' > /etc/target\n",
+    "{stage}-{job}-{host}:\n  script:\n    - echo \"'\"'{host}' $'{host}'\n",
+    "{stage}-{job}-{host}:\n  script:\n    - echo \\{host}\n",
+    "{stage}-{job}-{host}:\n  script:\n    - |\n      cat <<'EOF' > /etc/target\n      {host}\n      EOF\n",
+])
+def test_compact_jobs_without_matrix(template):
+    compacted = compact_jobs([rendered_stage_job("0-deploy", "job", {"host-1": "p1", "host-2": "p1"}, template)])
+
+    assert [next(iter(yaml.safe_load(c))) for c in compacted][-2:] == ["0-deploy-job-host-1", "0-deploy-job-host-2"]
+
+
+@pytest.mark.parametrize("script", [
+    "echo {host}", 'echo "{host}"', "echo '$HOME' {host}", "echo \"it's\" {host}",
+])
+def test_compact_jobs_shell_expanded(script):
+    template = "{stage}-{job}-{host}:\n  script:\n    - " + script + "\n"
+    compacted = compact_jobs([rendered_stage_job("0-deploy", "job", {"host-1": "p1", "host-2": "p1"}, template)])
+
+    # everywhere else the shell sees the matrix variable
+    (name, entry), = yaml.safe_load(compacted[-1]).items()
+    assert name == "0-deploy-job-matrix-0"
+    assert entry["parallel"] == {"matrix": [{"DEPLOY_HOSTNAME": ["host-1", "host-2"]}]}
+
+
+def test_compact_jobs_matrix_limit():
+    hosts_packages = {f"host-{i}": "p1" for i in range(MATRIX_LIMIT + 1)}
+    compacted = [yaml.safe_load(c) for c in compact_jobs([
+        rendered_stage_job("0-deploy", "job", hosts_packages, JOB_TEMPLATE)
+    ])]
+
+    matrices = [list(c.values())[0]["parallel"]["matrix"][0]["DEPLOY_HOSTNAME"] for c in compacted[1:]]
+    assert [len(m) for m in matrices] == [MATRIX_LIMIT, 1]
+    assert sum(matrices, []) == list(hosts_packages)
+
+
+def test_compact_jobs_extends():
+    # the hidden definition comes out of the job itself, it has to win over whatever the job already extended
+    compacted = compact_jobs([rendered_stage_job(
+        "0-deploy", "job", {"host-1": "p1", "host-2": "p2"},
+        "{stage}-{job}-{host}:\n  extends: .base-{packages}\n  image: deploy\n  script:\n    - deploy {packages}\n"
+    )])
+
+    assert yaml.safe_load(compacted[1]) == {
+        "0-deploy-job-host-1": {"extends": [".base-p1", ".compact-job"], "script": ["deploy p1"]}
+    }
+
+
+def test_compact_jobs_unparsable():
+    # anything that isn't a single job per fragment is left exactly as it was rendered
+    result = rendered_stage_job(
+        "0-deploy", "job", {"host-1": "p1"}, "{host}-a:\n  script: [a]\n{host}-b:\n  script: [b]"
+    )
+
+    assert compact_jobs([result]) == [result.rendered[0][2]]
+
+
+@pytest.mark.parametrize("template", [
+    # gitlab's own tags don't load with the safe loader
+    "{host}:\n  script: !reference [.base, script]\n",
+    # anchors and aliases load, but wouldn't come back out the way they were written
+    "{host}:\n  variables: &vars\n    HOST: {host}\n  script: [deploy {packages}]\n  after_script: *vars\n",
+])
+def test_compact_jobs_not_round_tripped(template):
+    result = rendered_stage_job("0-deploy", "job", {"host-1": "p1", "host-2": "p1"}, template)
+
+    assert compact_jobs([result]) == [rendered_job for _, _, rendered_job in result.rendered]
+
+
+def test_compact_jobs_needs():
+    # a job another job needs (by its per host name) keeps that name instead of going into a matrix
+    compacted = [yaml.safe_load(c) for c in compact_jobs([
+        rendered_stage_job("0-deploy", "job", {"host-1": "p1", "host-2": "p1"}, JOB_TEMPLATE),
+        rendered_stage_job(
+            "1-verify", "verify", {"host-1": "p1", "host-2": "p1"},
+            "{stage}-{job}-{host}:\n  script: [verify {host}]\n  needs:\n    - job: 0-deploy-job-{host}\n"
+        ),
+    ])]
+
+    assert [list(c)[0] for c in compacted] == [
+        ".compact-job", "0-deploy-job-host-1", "0-deploy-job-host-2", "1-verify-verify-host-1", "1-verify-verify-host-2"
+    ]
+
+
+def test_compact_jobs_hidden_name():
+    # a single entry isn't worth a hidden definition
+    result = rendered_stage_job("0-deploy", "job", {"host-1": "p1"}, JOB_TEMPLATE)
+    assert [yaml.safe_load(c) for c in compact_jobs([result])] == [yaml.safe_load(result.rendered[0][2])]
+
+    # nor does the hidden definition take the name of anything the jobs already define or extend
+    compacted = compact_jobs([rendered_stage_job(
+        "0-deploy", "job", {"host-1": "p1", "host-2": "p2"},
+        "{stage}-{job}-{host}:\n  extends: .compact-job\n  image: deploy\n  script:\n    - deploy {packages}\n"
+    )])
+    assert [next(iter(yaml.safe_load(c))) for c in compacted][0] == ".compact-job-1"
@@ -3,15 +3,24 @@ import os
 import deploy_pipeline.pipeline.config as deploy_config
 from tests.conftest import config_dir
 from deploy_pipeline.pipeline.utils import FileNotFoundException
-from functools import partial
+from deploy_pipeline.labels.matching import LabelQuery, Operator
+from deploy_pipeline.labels.selectors import compile_selector
 
 
-@pytest.mark.parametrize("fn_inputs,fn_to_call", [
+def valid_file():
+    return os.path.realpath(os.path.join(config_dir(), "valid_file"))
+
+
+@pytest.mark.parametrize("fn_inputs,fn_to_call,expected", [
     (
             {
                 "host": [{"key": "key", "operator": "In", "values": ["values_1"]}]
             },
-            deploy_config.validate_selectors
+            deploy_config.validate_selectors,
+            {
+                "host": [LabelQuery(key="key", operator=Operator.In, values=("values_1",))],
+                "package": []
+            }
     ),
     (
             {
@@ -26,20 +35,29 @@ from functools import partial
                     }
                 }
             },
-            deploy_config.validate_jobs
+            deploy_config.validate_jobs,
+            {
+                "job_1": {
+                    "phase": "phase_1",
+                    "variables": {
+                        "type": "var_type"
+                    },
+                    "template": valid_file(),
+                    "selectors": {
+                        "host": [LabelQuery(key="key", operator=Operator.In, values=("values_1",))],
+                        "package": []
+                    }
+                }
+            }
     ),
     (
             {
                 'phases': ['phase_1'],
                 "template": os.path.join(config_dir(), "valid_file"),
                 "host_order_label": "foo",
-                "includes": [],
                 "jobs": {
                     "job_1": {
                         "phase": "phase_1",
-                        "variables": {
-                            "type": "var_type"
-                        },
                         "template": os.path.join(config_dir(), "valid_file"),
                         "selectors": {
                             "host": [{"key": "key", "operator": "In", "values": ["values_1"]}]
@@ -47,17 +65,38 @@ from functools import partial
                     }
                 }
             },
-            deploy_config.validate_pipeline
+            deploy_config.validate_pipeline,
+            {
+                'phases': ['phase_1'],
+                "template": valid_file(),
+                "host_order_label": "foo",
+                "includes": [],
+                "selectors": {
+                    "host": [],
+                    "package": [],
+                },
+                "jobs": {
+                    "job_1": {
+                        "phase": "phase_1",
+                        "variables": {},
+                        "template": valid_file(),
+                        "selectors": {
+                            "host": [LabelQuery(key="key", operator=Operator.In, values=("values_1",))],
+                            "package": []
+                        }
+                    }
+                }
+            }
     ),
     (
             {
                 'phases': ['phase_1'],
                 "template": os.path.join(config_dir(), "valid_file"),
                 "host_order_label": "foo",
-                "includes": [],
+                "includes": [os.path.join(config_dir(), "valid_file")],
                 "selectors": {
                     "host": [],
-                    "package": [],
+                    "package": [{"key": "key_2", "operator": "Exists"}],
                 },
                 "jobs": {
                     "job_1": {
@@ -72,11 +111,58 @@ from functools import partial
                     }
                 }
             },
-            deploy_config.validate_pipeline
+            deploy_config.validate_pipeline,
+            {
+                'phases': ['phase_1'],
+                "template": valid_file(),
+                "host_order_label": "foo",
+                "includes": [valid_file()],
+                "selectors": {
+                    "host": [],
+                    "package": [LabelQuery(key="key_2", operator=Operator.Exists, values=tuple())],
+                },
+                "jobs": {
+                    "job_1": {
+                        "phase": "phase_1",
+                        "variables": {
+                            "type": "var_type"
+                        },
+                        "template": valid_file(),
+                        "selectors": {
+                            "host": [LabelQuery(key="key", operator=Operator.In, values=("values_1",))],
+                            "package": []
+                        }
+                    }
+                }
+            }
     )
 ])
-def test_valid_config(fn_inputs, fn_to_call):
-    assert fn_to_call(fn_inputs) == fn_inputs
+def test_valid_config(fn_inputs, fn_to_call, expected):
+    assert fn_to_call(fn_inputs) == expected
+
+
+def test_valid_config_input_untouched():
+    selectors = {"host": [{"key": "key", "operator": "In", "values": ["values_1"]}]}
+    deploy_config.validate_selectors(selectors)
+    assert selectors == {"host": [{"key": "key", "operator": "In", "values": ["values_1"]}]}
+
+
+def test_valid_string_selectors():
+    # strings are compiled with the selector grammar, objects are still plain queries
+    assert deploy_config.validate_selectors({
+        "host": ["key_1 || key_2=value_2"],
+        "package": [{"key": "key_3", "operator": "Exists"}]
+    }) == {
+        "host": [compile_selector("key_2=value_2 || key_1")],
+        "package": [LabelQuery(key="key_3", operator=Operator.Exists, values=tuple())]
+    }
+
+
+def test_invalid_string_selectors():
+    with pytest.raises(deploy_config.SelectorValidationException) as e:
+        deploy_config.validate_selectors({"host": ["key_1 in (value_1"]})
+
+    assert "Malformed Selector: Expected ')'" in str(e.value)
 
 
 @pytest.mark.parametrize("fn_input,fn_to_call,throws", [
@@ -185,3 +271,30 @@ def test_valid_config(fn_inputs, fn_to_call):
 def test_invalid_config(fn_input, fn_to_call, throws):
     with pytest.raises(throws):
         fn_to_call(fn_input)
+
+
+def test_invalid_config_collects_errors():
+    with pytest.raises(deploy_config.JobValidationException) as e:
+        deploy_config.validate_jobs({
+            "job_1": {
+                "phase": "phase_1",
+                "selectors": {
+                    "host": [{"key_invalid": "key", "operator": "In"}]
+                }
+            },
+            "job_2": {
+                "phase": "phase_1",
+                "template": "invalid_file_path",
+                "variables": ["not", "a", "dict"],
+                "selectors": {}
+            }
+        })
+
+    assert [type(error) for error in e.value.errors] == [
+        deploy_config.JobValidationException,
+        deploy_config.SelectorValidationException,
+        FileNotFoundException,
+        deploy_config.JobValidationException,
+    ]
+    assert "[Path: <root>->job_1->selectors->host]" in str(e.value)
+    assert "[Path: <root>->job_2]" in str(e.value)
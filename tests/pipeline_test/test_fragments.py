@@ -0,0 +1,78 @@
+import pytest
+from deploy_pipeline.inventory.cache import InventoryCache
+from deploy_pipeline.pipeline.fragments import FragmentCache
+from deploy_pipeline.pipeline.pipeline import Job
+from deploy_pipeline.pipeline.plan import StageJobPlan
+from deploy_pipeline.pipeline.render import render_stage_jobs, RenderedStageJob
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+
+
+@pytest.fixture
+def job(tmp_path):
+    template_path = tmp_path / "job.j2"
+    template_path.write_text("{{ stagename }}-{{ hostname }}: {{ packages|join(',') }} {{ vars.foo }}")
+
+    job = Job("job-changebroker", "changebroker")
+    job.template = str(template_path)
+    return job
+
+
+def stage_job_plan(job, hosts_packages=None):
+    hosts_packages = hosts_packages or {"host-1": {"property01", "property07"}, "host-2": {"property01"}}
+    return StageJobPlan("0-changebroker", job, len(hosts_packages), 2, hosts_packages)
+
+
+def test_fingerprint(tmp_path, job):
+    fingerprint = FragmentCache(InventoryCache(str(tmp_path / "cache"))).fingerprint(stage_job_plan(job), {"foo": 1})
+
+    # set ordering doesn't matter, the fingerprint is the same on the next run
+    assert FragmentCache(InventoryCache(str(tmp_path / "cache"))).fingerprint(stage_job_plan(job, {
+        "host-2": {"property01"}, "host-1": {"property07", "property01"}
+    }), {"foo": 1}) == fingerprint
+
+    # the hosts, the variables and the template all count
+    assert FragmentCache(InventoryCache(str(tmp_path / "cache"))).fingerprint(stage_job_plan(job, {
+        "host-1": {"property01", "property07"}
+    }), {"foo": 1}) != fingerprint
+    assert FragmentCache(InventoryCache(str(tmp_path / "cache"))).fingerprint(
+        stage_job_plan(job), {"foo": 2}
+    ) != fingerprint
+
+    with open(job.template, "a") as f:
+        f.write(" changed")
+    assert FragmentCache(InventoryCache(str(tmp_path / "cache"))).fingerprint(
+        stage_job_plan(job), {"foo": 1}
+    ) != fingerprint
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_cached_fragments(tmp_path, job, workers):
+    fragment_cache = FragmentCache(InventoryCache(str(tmp_path / "cache")))
+
+    results = list(render_stage_jobs(
+        [stage_job_plan(job)], TemplateRegistry(), {"foo": "bar"}, workers, fragment_cache
+    ))
+    assert [rendered for _, _, rendered in results[0].rendered] == [
+        "0-changebroker-host-1: property01,property07 bar",
+        "0-changebroker-host-2: property01 bar",
+    ]
+
+    # anything with a cached fragment is handed back without being rendered again
+    cached = RenderedStageJob("0-changebroker", job, 2, 2, [("host-1", {"property01"}, "cached")])
+    fragment_cache.store_fragments(stage_job_plan(job), {"foo": "bar"}, cached)
+    assert list(render_stage_jobs(
+        [stage_job_plan(job)], TemplateRegistry(), {"foo": "bar"}, workers, FragmentCache(
+            InventoryCache(str(tmp_path / "cache"))
+        )
+    )) == [cached._replace(job=job)]
+
+
+def test_output(tmp_path, job):
+    fragment_cache = FragmentCache(InventoryCache(str(tmp_path / "cache")))
+    output_key = fragment_cache.output_key(job.template, {"stages": ["0-changebroker"]}, [stage_job_plan(job)], {})
+
+    assert fragment_cache.output(output_key) is None
+    assert list(fragment_cache.store_output(output_key, ["foo", "bar"])) == ["foo", "bar"]
+    assert "".join(fragment_cache.output(output_key)) == "foobar"
+
+    assert fragment_cache.output_key(job.template, {"stages": []}, [stage_job_plan(job)], {}) != output_key
@@ -0,0 +1,59 @@
+import os
+import pytest
+from deploy_pipeline.pipeline.output import strip_chunks, write_chunks
+
+
+@pytest.mark.parametrize("chunks", [
+    [],
+    ["  ", "\n"],
+    ["stages:\n", "  - 0-pre\n", "\n"],
+    ["\n\n", "  stages:", "\n", "", "  - 0-pre  ", "\n\n", "job:\n", "  stage: 0-pre\n\n"],
+    ["job: 1", " ", " ", "job: 2 \n"],
+])
+def test_strip_chunks(chunks):
+    assert "".join(strip_chunks(chunks)) == "".join(chunks).strip()
+
+
+def test_write_chunks(tmp_path):
+    output_path = str(tmp_path / "pipeline.yml")
+
+    assert write_chunks(["stages:\n", "  - 0-pre"], output_path) == 17
+    with open(output_path) as f:
+        assert f.read() == "stages:\n  - 0-pre"
+
+    # only the output file should be left behind, no temp files
+    assert os.listdir(tmp_path) == ["pipeline.yml"]
+
+
+def test_write_chunks_failure(tmp_path):
+    output_path = str(tmp_path / "pipeline.yml")
+    with open(output_path, 'w') as f:
+        f.write("previous")
+
+    def failing_chunks():
+        yield "stages:\n"
+        raise RuntimeError("render failed")
+
+    with pytest.raises(RuntimeError):
+        write_chunks(failing_chunks(), output_path)
+
+    # the previous output should be untouched
+    with open(output_path) as f:
+        assert f.read() == "previous"
+
+    assert os.listdir(tmp_path) == ["pipeline.yml"]
+
+
+@pytest.mark.parametrize("umask", [0o022, 0o077])
+def test_write_chunks_permissions(tmp_path, umask):
+    output_path = str(tmp_path / "pipeline.yml")
+
+    # the output gets the permissions a plain open() would have given it, and the umask itself is left alone
+    previous = os.umask(umask)
+    try:
+        write_chunks(["stages: []"], output_path)
+        assert os.umask(umask) == umask
+    finally:
+        os.umask(previous)
+
+    assert os.stat(output_path).st_mode & 0o777 == 0o666 & ~umask
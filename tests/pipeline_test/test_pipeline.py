@@ -64,3 +64,17 @@ def test_job_duplicate_job_name(pipeline_phases, pipeline_jobs):
         for job_k, job_v in chain(pipeline_jobs.items(), pipeline_jobs.items()):
             job = Job(job_k, job_v['phase'])
             pipeline.add_job(job)
+
+
+def test_stage_groups(pipeline_phases, pipeline_stages):
+    pipeline = Pipeline()
+
+    for pipeline_phase in pipeline_phases:
+        pipeline.add_phase(pipeline_phase)
+
+    job_stages = Stage(pipeline, pipeline_stages)
+    assert list(job_stages.get_stage_groups()) == [
+        (0, ["0-pre", "0-changebroker", "0-partition"]),
+        (1, ["1-pre", "1-changebroker", "1-partition"]),
+        (2, ["2-pre", "2-changebroker", "2-partition"]),
+    ]
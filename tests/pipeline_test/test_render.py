@@ -0,0 +1,129 @@
+import pytest
+from deploy_pipeline.labels.grouping import LabelGroup
+from deploy_pipeline.labels.joining import LabelJoin
+from deploy_pipeline.labels.indexing import INDEX_MODES
+from deploy_pipeline.labels.matching import new_query, Operator, LabelIndex
+from deploy_pipeline.pipeline.pipeline import Pipeline, Stage, Job
+from deploy_pipeline.pipeline.plan import select_jobs, plan_stage_jobs
+from deploy_pipeline.pipeline.render import render_stage_jobs
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+import deploy_pipeline.metrics.metrics as metrics
+
+
+@pytest.fixture
+def package_data():
+    return {
+        "property01": {"labels": {"type": "binary"}},
+        "property07": {"labels": {"type": "index"}},
+        "property13": {"labels": {"type": "binary"}},
+    }
+
+
+@pytest.fixture
+def pipeline(tmp_path, pipeline_phases):
+    template_path = tmp_path / "job.j2"
+    template_path.write_text("{{ stagename }}-{{ jobname }}-{{ hostname }}: {{ packages|join(',') }} {{ vars.foo }}")
+
+    pipeline = Pipeline()
+    for pipeline_phase in pipeline_phases:
+        pipeline.add_phase(pipeline_phase)
+
+    job = Job("job-changebroker", "changebroker")
+    job.template = str(template_path)
+    job.variables = {"foo": "job"}
+    job.package_selectors.append(new_query("type", Operator.In, ["binary"]))
+    pipeline.add_job(job)
+
+    job = Job("job-partition", "partition")
+    job.template = str(template_path)
+    job.host_selectors.append(new_query("pogo.test.data", Operator.Exists))
+    pipeline.add_job(job)
+
+    return pipeline
+
+
+@pytest.fixture
+def job_stages(pipeline):
+    return Stage(pipeline, [0, 1])
+
+
+def stage_job_plans(host_data, package_data, job_stages, index_mode=INDEX_MODES[0]):
+    host_index = LabelIndex(host_data, "labels", index_mode)
+    package_index = LabelIndex(package_data, "labels", index_mode)
+
+    host_packages = LabelJoin(host_data, "packages").match(set(package_data))
+    host_order = LabelGroup(host_data, "labels").group("pogo.deploy.stage")
+
+    job_selections = select_jobs(
+        job_stages.get_jobs(), host_index, package_index, host_index.restrict(host_packages.keys()),
+        package_index.restrict(set(package_data))
+    )
+
+    return plan_stage_jobs(job_stages.get_stage_jobs(), job_selections, host_order, host_packages)
+
+
+def test_plan_stage_jobs(host_data, package_data, job_stages):
+    plans = list(stage_job_plans(host_data, package_data, job_stages))
+
+    assert [(p.stage_name, p.job.name, p.host_count, p.package_count) for p in plans] == [
+        ("0-changebroker", "job-changebroker", 3, 2),
+        ("0-partition", "job-partition", 2, 3),
+        ("1-changebroker", "job-changebroker", 3, 2),
+        ("1-partition", "job-partition", 1, 3),
+    ]
+
+    # only the job's packages are kept for each host
+    assert plans[0].hosts_packages == {
+        "ora-del-sup-001": {"property01", "property13"},
+        "orb-del-sup-001": {"property01", "property13"},
+        "se3-del-sup-001": {"property01", "property13"},
+    }
+
+    assert plans[3].hosts_packages == {"ora-del-sup-007": {"property01", "property07", "property13"}}
+
+
+def test_render_stage_jobs(host_data, package_data, job_stages):
+    results = list(render_stage_jobs(
+        stage_job_plans(host_data, package_data, job_stages), TemplateRegistry(), {"foo": "bar"}
+    ))
+
+    assert [(r.stage_name, r.job.name, r.host_count, r.package_count) for r in results] == [
+        ("0-changebroker", "job-changebroker", 3, 2),
+        ("0-partition", "job-partition", 2, 3),
+        ("1-changebroker", "job-changebroker", 3, 2),
+        ("1-partition", "job-partition", 1, 3),
+    ]
+
+    assert [rendered for _, _, rendered in results[0].rendered] == [
+        "0-changebroker-job-changebroker-ora-del-sup-001: property01,property13 job",
+        "0-changebroker-job-changebroker-orb-del-sup-001: property01,property13 job",
+        "0-changebroker-job-changebroker-se3-del-sup-001: property01,property13 job",
+    ]
+
+    assert [rendered for _, _, rendered in results[3].rendered] == [
+        "1-partition-job-partition-ora-del-sup-007: property01,property07,property13 bar",
+    ]
+
+
+@pytest.mark.parametrize("index_mode", INDEX_MODES)
+def test_render_stage_jobs_parallel(host_data, package_data, job_stages, index_mode):
+    serial, parallel = (
+        [
+            (r.stage_name, r.job.name, r.rendered) for r in render_stage_jobs(
+                stage_job_plans(host_data, package_data, job_stages, index_mode), TemplateRegistry(), {},
+                workers=workers
+            )
+        ] for workers in (1, 2)
+    )
+
+    assert parallel == serial
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_stage_jobs_metrics(host_data, package_data, job_stages, workers):
+    # whatever the workers record is merged into the run's metrics, the same as rendering in process
+    plans = list(stage_job_plans(host_data, package_data, job_stages))
+    with metrics.recording() as recorded:
+        assert len(list(render_stage_jobs(plans, TemplateRegistry(), {}, workers=workers))) == 4
+
+    assert recorded.spans["render"][0] == 4
@@ -0,0 +1,118 @@
+import pytest
+import yaml
+from deploy_pipeline.pipeline.pipeline import Job
+from deploy_pipeline.pipeline.plan import StageJobPlan
+from deploy_pipeline.pipeline.shards import split_shards, write_shards, render_parent, ShardException
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+
+
+@pytest.fixture
+def templates(tmp_path):
+    (tmp_path / "pipeline.j2").write_text(
+        "include: {{ includes|join(',') }}\nstages: {{ stages|join(',') }}\n{% for j in jobs %}\n{{ j }}\n{% endfor %}"
+    )
+    (tmp_path / "job.j2").write_text("{{ stagename }}-{{ jobname }}-{{ hostname }}: {{ vars.foo }}")
+
+    return TemplateRegistry()
+
+
+@pytest.fixture
+def stage_groups():
+    return [
+        (0, ["0-pre", "0-post"]),
+        (1, ["1-pre", "1-post"]),
+        (2, ["2-pre", "2-post"]),
+    ]
+
+
+@pytest.fixture
+def stage_job_plans(tmp_path, stage_groups):
+    job = Job("job-pre", "pre")
+    job.template = str(tmp_path / "job.j2")
+    job.variables = {"foo": "job"}
+
+    # nothing matched in stage 1
+    hosts_packages = {0: {"host-a": {"p1"}, "host-b": {"p2"}}, 1: {}, 2: {"host-c": {"p1"}}}
+    return [
+        StageJobPlan(stages[0], job, len(hosts_packages[group]), 2, hosts_packages[group])
+        for group, stages in stage_groups
+    ]
+
+
+@pytest.mark.parametrize("stages_per_shard,expected", [
+    (None, [("shard-0", ["0-pre", "0-post"], ["0-pre"]), ("shard-1", ["2-pre", "2-post"], ["2-pre"])]),
+    (3, [
+        ("shard-0", ["0-pre", "0-post", "1-pre"], ["0-pre", "1-pre"]),
+        ("shard-1", ["1-post", "2-pre", "2-post"], ["2-pre"])
+    ]),
+    (6, [("shard-0", ["0-pre", "0-post", "1-pre", "1-post", "2-pre", "2-post"], ["0-pre", "1-pre", "2-pre"])]),
+])
+def test_split_shards(stage_groups, stage_job_plans, stages_per_shard, expected):
+    shards = split_shards(stage_groups, stage_job_plans, "shards", stages_per_shard)
+
+    assert [(s.name, s.stages, [p.stage_name for p in s.plans]) for s in shards] == expected
+    assert [s.path for s in shards] == [f"shards/{name}.yml" for name, _, _ in expected]
+
+
+def test_split_shards_without_jobs(stage_groups, stage_job_plans):
+    # the package selectors left the hosts of stage 2 without any packages, so nothing renders there
+    stage_job_plans[2] = stage_job_plans[2]._replace(hosts_packages={})
+    shards = split_shards(stage_groups, stage_job_plans, "shards")
+
+    assert [(s.name, s.stages) for s in shards] == [("shard-0", ["0-pre", "0-post"])]
+
+
+def test_split_shards_outside_project(monkeypatch, tmp_path, stage_groups, stage_job_plans):
+    # gitlab won't include anything from outside of the project, the working directory of the generating job
+    (tmp_path / "project").mkdir()
+    monkeypatch.chdir(tmp_path / "project")
+    with pytest.raises(ShardException, match="Outside of the Project"):
+        split_shards(stage_groups, stage_job_plans, "../shards")
+
+    with pytest.raises(ShardException):
+        split_shards(stage_groups, stage_job_plans, str(tmp_path / "shards"))
+
+    assert len(split_shards(stage_groups, stage_job_plans, str(tmp_path / "project" / "shards"))) == 2
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_write_shards(monkeypatch, tmp_path, templates, stage_groups, stage_job_plans, workers):
+    monkeypatch.chdir(tmp_path)
+    shards = split_shards(stage_groups, stage_job_plans, str(tmp_path))
+    template_vars = {"stages": [], "includes": ["common.yml"], "jobs": [], "vars": {}}
+
+    written = list(write_shards(
+        shards, templates, str(tmp_path / "pipeline.j2"), template_vars, {"foo": "bar"}, workers
+    ))
+
+    assert [(w.name, w.stage_count, w.job_count) for w in written] == [("shard-0", 2, 2), ("shard-1", 2, 1)]
+
+    # every shard carries the includes, and only its own stages and jobs
+    assert (tmp_path / "shard-0.yml").read_text() == (
+        "include: common.yml\nstages: 0-pre,0-post\n0-pre-job-pre-host-a: job\n0-pre-job-pre-host-b: job"
+    )
+    assert (tmp_path / "shard-1.yml").read_text() == (
+        "include: common.yml\nstages: 2-pre,2-post\n2-pre-job-pre-host-c: job"
+    )
+    assert written[1].written == len((tmp_path / "shard-1.yml").read_text())
+
+
+@pytest.mark.parametrize("trigger_job,include", [
+    (None, {"local": "shards/shard-1.yml"}),
+    ("generate-pipeline", {"artifact": "shards/shard-1.yml", "job": "generate-pipeline"}),
+])
+def test_render_parent(stage_groups, stage_job_plans, trigger_job, include):
+    parent = yaml.safe_load(render_parent(split_shards(stage_groups, stage_job_plans, "shards"), trigger_job))
+
+    assert parent["stages"] == ["shard-0", "shard-1"]
+    assert parent["shard-1"] == {"stage": "shard-1", "trigger": {"include": [include], "strategy": "depend"}}
+
+
+def test_render_parent_absolute_shard_dir(monkeypatch, tmp_path, stage_groups, stage_job_plans):
+    # the includes are relative to the working directory (the project directory in a gitlab job)
+    monkeypatch.chdir(tmp_path)
+    shards = split_shards(stage_groups, stage_job_plans, str(tmp_path / "generated" / "shards"))
+
+    assert yaml.safe_load(render_parent(shards))["shard-0"]["trigger"]["include"] == [
+        {"local": "generated/shards/shard-0.yml"}
+    ]
@@ -0,0 +1,39 @@
+import os
+import pytest
+from jinja2.exceptions import TemplateSyntaxError
+from deploy_pipeline.pipeline.templates import TemplateRegistry
+
+
+def _write_template(path, source):
+    with open(path, 'w') as f:
+        f.write(source)
+
+    return str(path)
+
+
+def test_template_cached_by_realpath(tmp_path):
+    template_path = _write_template(tmp_path / "job.j2", "{{ hostname }}")
+    registry = TemplateRegistry()
+
+    template = registry.get_template(template_path)
+    assert template.render(hostname="host-1") == "host-1"
+    assert registry.get_template(os.path.join(str(tmp_path), ".", "job.j2")) is template
+
+
+def test_template_bytecode_cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    template_path = _write_template(tmp_path / "job.j2", "{{ hostname }}")
+
+    TemplateRegistry(str(cache_dir)).get_template(template_path)
+    assert os.listdir(cache_dir)
+
+    # a fresh registry (i.e. the next run) should load from the bytecode cache and render the same
+    assert TemplateRegistry(str(cache_dir)).get_template(template_path).render(hostname="host-1") == "host-1"
+
+
+def test_load_templates_invalid_syntax(tmp_path):
+    valid_path = _write_template(tmp_path / "valid.j2", "{{ hostname }}")
+    invalid_path = _write_template(tmp_path / "invalid.j2", "{% for %}")
+
+    with pytest.raises(TemplateSyntaxError):
+        TemplateRegistry().load_templates([valid_path, invalid_path])
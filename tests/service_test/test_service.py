@@ -0,0 +1,149 @@
+import argparse
+import copy
+import http.client
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import deploy_pipeline.service as service_module
+from benchmarks.generate import write_inventory
+from deploy_pipeline.main import add_arguments, deploy_pipeline, DEFAULT_CONFIG
+from deploy_pipeline.service import create_server, PipelineService
+
+
+@pytest.fixture
+def inventory_files(tmp_path):
+    return write_inventory(str(tmp_path), 50)
+
+
+@pytest.fixture
+def server():
+    server = create_server(PipelineService(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def run_args(files):
+    return ["--pipeline", files.pipeline, "--config", files.hosts, files.packages, "--vars", "foo=bar"]
+
+
+def render(files) -> str:
+    args = vars(add_arguments(argparse.ArgumentParser()).parse_args(run_args(files)))
+
+    stream = io.StringIO()
+    assert deploy_pipeline(args, stream=stream) == 0
+    return stream.getvalue()
+
+
+def post(server, body) -> (int, str):
+    connection = http.client.HTTPConnection(*server.server_address)
+    try:
+        connection.request("POST", "/render", json.dumps(body), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, response.read().decode("utf-8")
+    finally:
+        connection.close()
+
+
+def test_deploy_pipeline_default_config(inventory_files):
+    default_config = copy.deepcopy(DEFAULT_CONFIG)
+
+    # the same run twice in one process gives the same pipeline, and doesn't leave anything behind in the defaults
+    assert render(inventory_files) == render(inventory_files)
+    assert DEFAULT_CONFIG == default_config
+
+
+def test_service_render(server, inventory_files):
+    expected = render(inventory_files)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda _: post(server, {"args": run_args(inventory_files)}), range(8)))
+
+    assert responses == [(200, expected)] * 8
+
+
+def test_service_reload(server, tmp_path, inventory_files):
+    assert post(server, {"args": run_args(inventory_files)})[0] == 200
+
+    # a changed inventory file is picked up by the next request
+    files = write_inventory(str(tmp_path), 20, seed=1)
+    assert post(server, {"args": run_args(files)}) == (200, render(files))
+
+
+@pytest.mark.parametrize("body,status", [
+    ({"args": ["--pipeline", "pipeline.yml"]}, 400),
+    ({"args": "--pipeline pipeline.yml"}, 400),
+    (["--pipeline"], 400),
+])
+def test_service_bad_request(server, body, status):
+    assert post(server, body)[0] == status
+
+
+def test_service_failed_run(server, inventory_files):
+    assert post(server, {"args": run_args(inventory_files) + ["--host-selector", "does.not=exist"]})[0] == 422
+
+
+def test_service_inventories_evicted(tmp_path, inventory_files):
+    service = PipelineService(max_inventories=1)
+    other_files = write_inventory(str(tmp_path / "other"), 20, seed=1)
+
+    def inventory(files):
+        return service.inventory([files.hosts, files.packages], None, 1, "set")
+
+    # the same files hand back the loaded inventory, until another one pushes it out
+    first = inventory(inventory_files)
+    assert inventory(inventory_files) is first
+    assert inventory(other_files) is not first
+    assert inventory(inventory_files) is not first
+
+
+def test_service_inventory_loading(monkeypatch, tmp_path, inventory_files):
+    service = PipelineService()
+    other_files = write_inventory(str(tmp_path / "other"), 20, seed=1)
+
+    # hold up loading the first inventory until everything else is done
+    load_inventory = service_module.load_inventory
+    released = threading.Event()
+
+    def slow_load_inventory(config_files, *args):
+        if config_files[0] == inventory_files.hosts:
+            assert released.wait(10)
+        return load_inventory(config_files, *args)
+
+    monkeypatch.setattr(service_module, "load_inventory", slow_load_inventory)
+
+    def inventory(files):
+        return service.inventory([files.hosts, files.packages], None, 1, "set")
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        slow = [executor.submit(inventory, inventory_files) for _ in range(2)]
+
+        # neither the templates nor another inventory wait on the one being loaded
+        assert service.templates(None) is service.templates(None)
+        assert inventory(other_files) is not None
+        assert not any(f.done() for f in slow)
+
+        released.set()
+        first, second = (f.result() for f in slow)
+
+    # and the requests waiting on the same files share the one load
+    assert first is second
+
+
+def test_deploy_pipeline_host_order_label(tmp_path, inventory_files):
+    expected = render(inventory_files)
+
+    # the host order label is a label name, whatever is in it, not a selector
+    for path in (inventory_files.hosts, inventory_files.pipeline):
+        with open(path) as f:
+            content = f.read()
+        with open(path, "w") as f:
+            f.write(content.replace("pogo.deploy.stage", "'deploy, stage (a || b)'"))
+
+    assert render(inventory_files) == expected
@@ -44,3 +44,8 @@ def test_valid_variables(source, inputs, fn_to_call, expected):
 ])
 def test_valid_files(source, inputs, expected):
     assert parsers.with_var_file(os.path.join(config_dir(), source), inputs) == expected
+
+
+def test_var_file_data():
+    var_data = parsers.load_var_file(os.path.join(config_dir(), "variable_test.json"))
+    assert parsers.with_vars(var_data, {"foo": "bar"}) == {"foo": "bar", **var_data}
@@ -0,0 +1,43 @@
+import pytest
+import deploy_pipeline.vars.parsers as parsers
+import deploy_pipeline.vars.scopes as scopes
+
+
+@pytest.mark.parametrize("file_vars,cli_vars,env_vars,expected", [
+    (
+        [], [], {}, {},
+    ),
+    (
+        [{"foo": "file", "bar": "file"}, {"bar": "file2"}], [], {}, {"foo": "file", "bar": "file2"},
+    ),
+    (
+        [{"foo": "file", "bar": "file"}], ["bar=cli", '{"baz": "cli"}'], {}, {"foo": "file", "bar": "cli", "baz": "cli"},
+    ),
+    (
+        [{"foo": "file"}], ["foo=cli", "bar=cli"], {"DEPLOY_VAR_foo": "env"}, {"foo": "env", "bar": "cli"},
+    ),
+])
+def test_variable_scope(monkeypatch, file_vars, cli_vars, env_vars, expected):
+    for env_k, env_v in env_vars.items():
+        monkeypatch.setenv(env_k, env_v)
+
+    scope = scopes.variable_scope(file_vars, cli_vars, env_vars)
+    assert scopes.resolve_scope(scope) == expected
+
+    # same thing the old one at a time merging produced, keys in the same order too
+    merged = {}
+    for file_var in file_vars:
+        merged = parsers.with_vars(file_var, merged)
+    for cli_var in cli_vars:
+        merged = parsers.with_var(cli_var, merged)
+    for env_var in env_vars:
+        merged = parsers.with_env_var(env_var, merged)
+
+    assert list(scopes.resolve_scope(scope).items()) == list(merged.items())
+
+
+def test_job_scope():
+    scope = scopes.variable_scope([{"foo": "file", "bar": "file"}], ["bar=cli"])
+
+    assert scopes.job_scope(scope, {"foo": "job", "baz": "job"}) == {"foo": "job", "bar": "cli", "baz": "job"}
+    assert scopes.job_scope(scope, {}) == {"foo": "file", "bar": "cli"}